@@ -77,6 +77,16 @@ exports.submitEmailCommunication = async (req, res) => {
     } catch (error) {
         console.error('Error in submitEmailCommunication:', error.message);
         console.error('Error details:', error.response?.data);
+        // Nothing is saved before the ML call, so an overloaded ML backend is passed on for a retry
+        const { overloaded, retryAfter } = mlService.overloadInfo(error);
+        if (overloaded) {
+            res.set('Retry-After', String(retryAfter));
+            return res.status(503).json({
+                success: false,
+                error: 'ML backend overloaded, retry later',
+                retryAfter
+            });
+        }
         res.status(500).json({ 
             success: false, 
             error: error.message,
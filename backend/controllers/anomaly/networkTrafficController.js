@@ -78,6 +78,15 @@ exports.submitNetworkTraffic = async (req, res) => {
         data: networkTraffic,
         prediction: prediction.data
       });
+    } else if (prediction.overloaded) {
+      // The ML backend is shedding load: drop the pending record, so the agent's retry
+      // after Retry-After does not store the flow twice
+      await networkTraffic.deleteOne();
+      res.set('Retry-After', String(prediction.retryAfter));
+      res.status(503).json({
+        message: 'ML backend overloaded, retry later',
+        retryAfter: prediction.retryAfter
+      });
     } else {
       // ML prediction failed, but data is saved
       res.status(201).json({
@@ -3,6 +3,22 @@ const axios = require('axios');
 // ML Backend URL from environment or default
 const ML_BACKEND_URL = process.env.ML_BACKEND_URL || 'http://localhost:8000';
 
+/**
+ * The ML backend sheds load with 503 + Retry-After when its inference
+ * queue is full, so callers can back off instead of waiting for a timeout
+ * @param {Error} error - Axios error
+ * @returns {Object} Overload details, empty for other errors
+ */
+function overloadInfo(error) {
+    if (error.response?.status !== 503) {
+        return {};
+    }
+    return {
+        overloaded: true,
+        retryAfter: Number(error.response.headers['retry-after']) || 1
+    };
+}
+
 class MLService {
     /**
      * Predict network traffic anomaly
@@ -28,7 +44,8 @@ class MLService {
             console.error('Full error:', error.response?.data || error);
             return {
                 success: false,
-                error: error.message
+                error: error.message,
+                ...overloadInfo(error)
             };
         }
     }
@@ -57,7 +74,8 @@ class MLService {
             console.error('Full error:', error.response?.data || error);
             return {
                 success: false,
-                error: error.message
+                error: error.message,
+                ...overloadInfo(error)
             };
         }
     }
@@ -109,3 +127,4 @@ class MLService {
 }
 
 module.exports = new MLService();
+module.exports.overloadInfo = overloadInfo;
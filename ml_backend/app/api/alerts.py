@@ -1,70 +1,359 @@
-from fastapi import APIRouter, HTTPException
-
-from datetime import datetime
+import asyncio
+import base64
+import heapq
+from itertools import islice
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from bson import ObjectId
+from pymongo import ReturnDocument
+from bson.errors import InvalidId
+from datetime import datetime, timedelta, timezone
+from app.db.mongodb import database
+from app.api.predict import overloaded
+from app.services.alert_rollups import AlertRollups, ROLLUP_FIELDS
+from app.services.inference_pool import OverloadedError
+from app.models.schemas import BulkTriageRequest
+from app.config import (
+    ALERTS_PAGE_SIZE, ALERTS_MAX_PAGE_SIZE, ALERTS_QUERY_TIMEOUT_MS, ALERTS_MAX_TRIAGE_IDS,
+    ALERTS_TRIAGE_BATCH_SIZE, ALERT_STATS_MAX_DAYS, ALERT_ROLLUPS, ALERT_ROLLUP_MAX_PENDING_KEYS
+)
 
 router = APIRouter()
 
+# Alert rollups behind /api/alerts/stats, counting stored anomalies and their triage
+alert_rollups = AlertRollups(ALERT_ROLLUP_MAX_PENDING_KEYS) if ALERT_ROLLUPS else None
+
+# Fields returned per alert; feature payloads and anything else stored stay in the database
+ALERT_FIELDS = (
+    'timestamp', 'is_anomaly', 'anomaly_score', 'threat_class', 'confidence', 'details', 'reviewed',
+    'user_id', 'source_ip', 'destination_ip', 'protocol', 'port_number', 'sender_email', 'receiver_email',
+)
+
+# Filters on fields only one modality's alerts carry skip the other collections
+_FILTER_MODALITIES = {'source_ip': ('network',)}
+
+_EPOCH = datetime(1970, 1, 1)
+_NEWEST_FIRST = [('timestamp', -1), ('_id', -1)]
+
+
+def encode_cursor(alert):
+    """Opaque keyset cursor for the page after `alert`: its timestamp (BSON millisecond precision) and _id"""
+    millis = (alert['timestamp'].replace(tzinfo=None) - _EPOCH) // timedelta(milliseconds=1)
+    return base64.urlsafe_b64encode(f"{millis}.{alert['_id']}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns: (timestamp, ObjectId) of the last alert of the previous page
+    Raises: ValueError for a malformed cursor
+    """
+    try:
+        millis, _id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('.')
+        return _EPOCH + timedelta(milliseconds=int(millis)), ObjectId(_id)
+    except (ValueError, InvalidId, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def alert_filter(reviewed=None, threat_class=None, since=None, until=None, after=None,
+                 source_ip=None, score_below=None, is_anomaly=None):
+    """Mongo query for the alert filters, resuming strictly after the `after` (timestamp, _id) key"""
+    clauses = []
+    if is_anomaly is not None:
+        # The collections hold every scored event; alerts are the anomalies among them
+        clauses.append({'is_anomaly': is_anomaly})
+    if reviewed is not None:
+        # Alerts that were never triaged have no reviewed field
+        clauses.append({'reviewed': True} if reviewed else {'reviewed': {'$ne': True}})
+    if threat_class is not None:
+        clauses.append({'threat_class': threat_class})
+    if source_ip is not None:
+        clauses.append({'source_ip': source_ip})
+    if score_below is not None:
+        clauses.append({'anomaly_score': {'$lt': score_below}})
+    if since is not None or until is not None:
+        window = {}
+        if since is not None:
+            window['$gte'] = since
+        if until is not None:
+            window['$lt'] = until
+        clauses.append({'timestamp': window})
+    if after is not None:
+        timestamp, _id = after
+        clauses.append({'$or': [
+            {'timestamp': {'$lt': timestamp}},
+            {'timestamp': timestamp, '_id': {'$lt': _id}},
+        ]})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def _tagged(alerts, modality):
+    for alert in alerts:
+        alert['modality'] = modality
+        yield alert
+
+
+async def list_alerts(collections, limit=ALERTS_PAGE_SIZE, cursor=None, **filters):
+    """
+    One page of alerts (is_anomaly: true) from every collection, newest first.
+    Each collection is read through its (is_anomaly, timestamp, _id) index for at most limit + 1 alerts,
+    all collections at once, and the sorted batches are merged lazily, so a
+    page costs O(limit) whatever the alert history.
+    Returns: {"alerts": [...], "next_cursor": cursor for the next page or None}
+    """
+    query = alert_filter(after=decode_cursor(cursor) if cursor else None, is_anomaly=True, **filters)
+    projection = dict.fromkeys(ALERT_FIELDS, 1)
+    batches = await asyncio.gather(*(
+        collection.find(query, projection, batch_size=limit + 1, max_time_ms=ALERTS_QUERY_TIMEOUT_MS)
+        .sort(_NEWEST_FIRST).limit(limit + 1).to_list(length=limit + 1)
+        for collection in collections.values()
+    ))
+    sources = [_tagged(batch, modality) for modality, batch in zip(collections, batches)]
+    merged = heapq.merge(*sources, key=lambda alert: (alert['timestamp'], alert['_id']), reverse=True)
+    page = list(islice(merged, limit + 1))
+
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    alerts = page[:limit]
+    for alert in alerts:
+        alert['_id'] = str(alert['_id'])
+    return {"alerts": alerts, "next_cursor": next_cursor}
+
+
+async def _write(collection, action, query):
+    if action == 'delete':
+        result = await collection.delete_many(query)
+        return result.deleted_count, result.deleted_count
+    result = await collection.update_many(query, {'$set': {'reviewed': True}})
+    return result.matched_count, result.modified_count
+
+
+async def _uncount(rollups, rollup_collections, modality, action, alerts):
+    """
+    Move triaged alerts within the rollups: out of them when deleted, to reviewed when reviewed.
+    Only alerts ingest() already counted move; later ones are counted as they are by then.
+    Call it after the write. An ingest that read the alerts just before the write and claims
+    them just after can leave them miscounted until the next backfill.
+    """
+    try:
+        upto = await AlertRollups.counted_upto(rollup_collections, modality)
+    except Exception as e:
+        # The write stands either way; the backfill job repairs the rollups
+        print(f"⚠️  Alert rollups not updated after {action}: {e}")
+        return
+    alerts = [alert for alert in alerts if upto is not None and alert['_id'] <= upto]
+    if action == 'delete':
+        rollups.add_documents(modality, alerts, sign=-1)
+        return
+    unreviewed = [alert for alert in alerts if alert.get('reviewed') is not True]
+    rollups.add_documents(modality, unreviewed, sign=-1)
+    rollups.add_documents(modality, unreviewed, reviewed=True)
+
+
+async def triage(collections, action, ids=None, filters=None, rollups=None, rollup_collections=None):
+    """
+    Review or delete alerts, given either their ObjectIds or alert_filter()
+    fields. IDs go out in batches of ALERTS_TRIAGE_BATCH_SIZE, one update_many
+    (delete_many) per batch and collection; a filter is one write per
+    collection and only ever selects anomalies, never the normal events
+    stored next to them. Collections are written concurrently.
+    With rollups (and their rollup_collections), the selected alerts' rollup
+    fields are read first and the writes go out by ID in batches, so the
+    rollups move by exactly the alerts written.
+    Returns: {modality: {"matched": n, "modified": n}} (deleted alerts count as both)
+    """
+    if ids is not None:
+        batches = [{'_id': {'$in': ids[i:i + ALERTS_TRIAGE_BATCH_SIZE]}}
+                   for i in range(0, len(ids), ALERTS_TRIAGE_BATCH_SIZE)]
+        targets = dict(collections)
+    else:
+        batches = [alert_filter(is_anomaly=True, **filters)]
+        targets = {
+            modality: collection for modality, collection in collections.items()
+            if all(modality in _FILTER_MODALITIES.get(field, (modality,)) for field in filters)
+        }
+
+    async def write_all(modality, collection):
+        matched = modified = 0
+
+        async def write(query, alerts=None):
+            nonlocal matched, modified
+            batch_matched, batch_modified = await _write(collection, action, query)
+            matched += batch_matched
+            modified += batch_modified
+            if alerts is not None:
+                await _uncount(rollups, rollup_collections, modality, action, alerts)
+
+        for query in batches:
+            if rollups is None:
+                await write(query)
+                continue
+            selected = []
+            async for alert in collection.find(query, list(ROLLUP_FIELDS), batch_size=ALERTS_TRIAGE_BATCH_SIZE):
+                selected.append(alert)
+                if len(selected) == ALERTS_TRIAGE_BATCH_SIZE:
+                    await write({'_id': {'$in': [alert['_id'] for alert in selected]}}, selected)
+                    selected = []
+            if selected:
+                await write({'_id': {'$in': [alert['_id'] for alert in selected]}}, selected)
+        return {"matched": matched, "modified": modified}
+
+    counts = await asyncio.gather(*(write_all(modality, collection) for modality, collection in targets.items()))
+    return dict(zip(targets, counts))
+
+
+def _object_id(alert_id):
+    try:
+        return ObjectId(alert_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail=f"Invalid alert id: {alert_id}")
+
 
 @router.get("/api/alerts")
-async def get_alerts():
-    """Get all alerts from both network and email collections"""
+async def get_alerts(
+    limit: int = Query(ALERTS_PAGE_SIZE, ge=1, le=ALERTS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    reviewed: Optional[bool] = None,
+    threat_class: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """
+    Page through alerts from both network and email collections, most recent first.
+    Pass the returned next_cursor back as `cursor` for the following page
+    """
+    try:
+        async with database.slot() as collections:
+            return await list_alerts(
+                collections, limit, cursor,
+                reviewed=reviewed, threat_class=threat_class, since=since, until=until
+            )
+    except OverloadedError as e:
+        raise overloaded(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/api/alerts/stats")
+async def get_alert_stats(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    top: int = Query(10, ge=1, le=100),
+):
+    """
+    Alert counts per modality, threat class, reviewed state and hour, and the
+    top source IPs and senders, from the rollups (default: the last 24 hours)
+    """
+    # Rollups bucket alerts by their event time, which MongoDB stores as naive UTC
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=1)
+    since, until = (t.astimezone(timezone.utc).replace(tzinfo=None) if t.tzinfo else t for t in (since, until))
+    if since >= until or until - since > timedelta(days=ALERT_STATS_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"Give since < until, at most {ALERT_STATS_MAX_DAYS} days apart")
+
     try:
-        network_alerts = list(network_collection.find().sort("timestamp", -1))
-        email_alerts = list(email_collection.find().sort("timestamp", -1))
-        
-        all_alerts = network_alerts + email_alerts
-        
-        # Sort by timestamp (most recent first)
-        all_alerts.sort(key=lambda x: x['timestamp'], reverse=True)
-        
-        # Convert ObjectId to string
-        for alert in all_alerts:
-            alert['_id'] = str(alert['_id'])
-        
-        return all_alerts
+        # Read-only: alerts show up once ingested, within ML_ALERT_ROLLUP_FLUSH_SECONDS plus the lag
+        async with database.slot():
+            return await AlertRollups.summary(database.rollups, since, until, top)
+    except OverloadedError as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _uncount_one(action, found):
+    """_uncount() for an alert triaged by ID ({modality: alert as found})"""
+    if alert_rollups is not None:
+        for modality, alert in found.items():
+            await _uncount(alert_rollups, database.rollups, modality, action, [alert])
+
+
 @router.delete("/api/alerts/{alert_id}")
 async def delete_alert(alert_id: str):
     """Delete an alert by ID"""
+    query = {"_id": _object_id(alert_id)}
     try:
-        # Try to delete from network collection first
-        result = network_collection.delete_one({"_id": ObjectId(alert_id)})
-        
-        # If not found, try email collection
-        if result.deleted_count == 0:
-            result = email_collection.delete_one({"_id": ObjectId(alert_id)})
-        
-        if result.deleted_count == 0:
-            raise HTTPException(status_code=404, detail="Alert not found")
-        
-        return {"message": "Alert deleted successfully"}
+        # IDs are unique across collections: ask both at once instead of one after the other
+        async with database.slot():
+            results = await database.for_each_collection(
+                lambda collection: collection.find_one_and_delete(query, projection=list(ROLLUP_FIELDS))
+            )
+            found = {modality: alert for modality, alert in results.items() if alert is not None}
+            await _uncount_one('delete', found)
+    except OverloadedError as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    if not found:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    return {"message": "Alert deleted successfully"}
+
 
 @router.patch("/api/alerts/{alert_id}/review")
 async def mark_alert_reviewed(alert_id: str):
     """Mark an alert as reviewed"""
+    query = {"_id": _object_id(alert_id)}
     try:
-        # Try to update in network collection first
-        result = network_collection.update_one(
-            {"_id": ObjectId(alert_id)},
-            {"$set": {"reviewed": True}}
-        )
-        
-        # If not found, try email collection
-        if result.matched_count == 0:
-            result = email_collection.update_one(
-                {"_id": ObjectId(alert_id)},
-                {"$set": {"reviewed": True}}
+        # The alert as it was before the update tells the rollups whether it was already reviewed
+        async with database.slot():
+            results = await database.for_each_collection(
+                lambda collection: collection.find_one_and_update(
+                    query, {"$set": {"reviewed": True}}, projection=list(ROLLUP_FIELDS),
+                    return_document=ReturnDocument.BEFORE
+                )
             )
-        
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Alert not found")
-        
-        return {"message": "Alert marked as reviewed"}
+            found = {modality: alert for modality, alert in results.items() if alert is not None}
+            await _uncount_one('review', found)
+    except OverloadedError as e:
+        raise overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not found:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    return {"message": "Alert marked as reviewed"}
+
+
+async def _bulk(action, request):
+    if (request.ids is None) == (request.filter is None):
+        raise HTTPException(status_code=400, detail="Give either ids or filter")
+
+    ids = filters = None
+    if request.ids is not None:
+        if len(request.ids) > ALERTS_MAX_TRIAGE_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {ALERTS_MAX_TRIAGE_IDS} ids per request")
+        ids = list(dict.fromkeys(map(_object_id, request.ids)))
+    else:
+        filters = request.filter.model_dump(exclude_none=True)
+        if not filters:
+            # An empty filter would select every alert
+            raise HTTPException(status_code=400, detail="The filter needs at least one field")
+
+    try:
+        async with database.slot() as collections:
+            counts = await triage(collections, action, ids, filters, alert_rollups, database.rollups)
+    except OverloadedError as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "matched": sum(count["matched"] for count in counts.values()),
+        "modified": sum(count["modified"] for count in counts.values()),
+        "collections": counts,
+    }
+
+
+@router.post("/api/alerts/bulk/review")
+async def bulk_review_alerts(request: BulkTriageRequest):
+    """Mark every alert given by ID or matching a filter as reviewed"""
+    return await _bulk('review', request)
+
+
+@router.post("/api/alerts/bulk/delete")
+async def bulk_delete_alerts(request: BulkTriageRequest):
+    """Delete every alert given by ID or matching a filter"""
+    return await _bulk('delete', request)
@@ -1,88 +1,288 @@
-from fastapi import APIRouter, HTTPException
-from app.models.schemas import NetworkFeatures, EmailFeatures, AnomalyPrediction
-from app.models.anomaly_detector import AnomalyDetector
+from fastapi import APIRouter, HTTPException, Request
+from app.models.schemas import NetworkFeatures, EmailFeatures, AnomalyPrediction, BatchPredictionRequest
+from app.models.registry import ModelRegistry, ActiveModels
+from app.services.batcher import MicroBatcher
+from app.services.features import (
+    extract_network_features, extract_email_features, parse_records, network_columns, email_columns,
+    event_seconds, wall_seconds
+)
+from app.services.prediction_cache import PredictionCache, register_metrics as register_cache_metrics
+from app.services.user_baselines import UserBaselineStore, register_metrics as register_baseline_metrics
+from app.services.velocity import VelocityStore
+from app.services.inference_pool import InferencePool, OverloadedError
+from app.services.metrics import stage_timer, observe_since_request_start, REGISTRY, CallbackMetric
+from app.config import (
+    INFERENCE_ENGINE, ENGINE_MAX_BATCH, MODEL_FORMAT, MODEL_REGISTRY_PATH, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, BATCH_MAX_QUEUE,
+    INFERENCE_WORKERS, INFERENCE_MAX_PENDING, RETRY_AFTER_SECONDS, DEBUG_LOG,
+    PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL_SECONDS, PREDICTION_CACHE_MANTISSA_BITS,
+    NETWORK_DETECTOR, EMAIL_DETECTOR, ONLINE_MODEL_PATH,
+    USER_BASELINE_MAX_USERS, USER_BASELINE_MIN_EVENTS, USER_BASELINE_HISTORY, USER_BASELINE_QUANTILE,
+    USER_BASELINE_ZSCORE, USER_BASELINE_PATH,
+    VELOCITY_FEATURES, VELOCITY_MAX_KEYS, VELOCITY_MAX_PAIRS, VELOCITY_IDLE_SECONDS
+)
+import os
+from typing import List, Optional
+from functools import partial
 import numpy as np
 from datetime import datetime
 
 
 router = APIRouter()
 
-# Initialize and load trained models
-detector = AnomalyDetector()
-detector.load_models()
-
-
-def extract_network_features(data: NetworkFeatures):
-    """Convert NetworkFeatures to numpy array"""
-    return np.array([
-        data.packet_size,
-        data.connection_duration,
-        data.port_number,
-        data.packets_sent,
-        data.packets_received,
-        data.bytes_sent,
-        data.bytes_received,
-        data.timestamp.hour,
-        data.timestamp.weekday(),
-        1 if data.protocol.lower() == 'tcp' else 0,
-        1 if data.protocol.lower() == 'udp' else 0,
-    ])
-
-
-def extract_email_features(data: EmailFeatures):
-    """Convert EmailFeatures to numpy array"""
-    return np.array([
-        data.num_recipients,
-        data.email_size,
-        1 if data.has_attachment else 0,
-        data.num_attachments,
-        data.subject_length,
-        data.body_length,
-        1 if data.is_reply else 0,
-        1 if data.is_forward else 0,
-        data.timestamp.hour,
-        data.timestamp.weekday(),
-        len(data.sender_email.split('@')[1]) if '@' in data.sender_email else 0,
-    ])
+# Load the active model version; reloads swap active_models.detector atomically
+registry = ModelRegistry(MODEL_REGISTRY_PATH)
+online_modalities = [
+    modality for modality, kind in (('network', NETWORK_DETECTOR), ('email', EMAIL_DETECTOR))
+    if kind == 'half_space_trees'
+]
+active_models = ActiveModels(
+    registry, MODEL_FORMAT, INFERENCE_ENGINE, ENGINE_MAX_BATCH,
+    online_modalities=online_modalities,
+    online_path=ONLINE_MODEL_PATH,
+    velocity=VELOCITY_FEATURES
+)
+active_models.load()
+
+
+# Optional cache of scored rows, emptied whenever another model version is swapped in.
+# Velocity columns change with every event, so rows would never repeat: no cache then.
+# Online detectors learn from every row they score and their scores drift, so a hit would
+# serve a stale score and skip the update: their modalities bypass the cache
+prediction_cache = None
+if PREDICTION_CACHE_SIZE > 0 and VELOCITY_FEATURES:
+    print("⚠️  Prediction cache disabled: it never hits with ML_VELOCITY_FEATURES=true")
+elif PREDICTION_CACHE_SIZE > 0 and len(online_modalities) == 2:
+    print("⚠️  Prediction cache disabled: both detectors are online (half_space_trees)")
+elif PREDICTION_CACHE_SIZE > 0:
+    prediction_cache = PredictionCache(
+        PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL_SECONDS, PREDICTION_CACHE_MANTISSA_BITS
+    )
+    register_cache_metrics(prediction_cache)
+    active_models.on_swap.append(lambda version: prediction_cache.clear())
+    if online_modalities:
+        print(f"⚠️  Prediction cache bypassed for the online {online_modalities[0]} detector")
+
+
+# Optional per-user baselines; they sit after the cache, which knows nothing about users
+user_baselines = None
+if USER_BASELINE_MAX_USERS > 0:
+    user_baselines = UserBaselineStore(
+        USER_BASELINE_MAX_USERS, USER_BASELINE_MIN_EVENTS, USER_BASELINE_HISTORY, USER_BASELINE_QUANTILE,
+        USER_BASELINE_ZSCORE
+    )
+    register_baseline_metrics(user_baselines)
+    if os.path.exists(USER_BASELINE_PATH):
+        try:
+            print(f"✅ Restored {user_baselines.load(USER_BASELINE_PATH)} user baselines")
+        except Exception as e:
+            print(f"⚠️  User baselines not restored, starting empty: {e}")
+
+
+# Optional sliding-window counters; when enabled every scoring path appends the
+# velocity columns and _score_cached keeps them only for extended-schema models
+velocity_store = None
+if VELOCITY_FEATURES:
+    velocity_store = VelocityStore(VELOCITY_MAX_KEYS, VELOCITY_MAX_PAIRS, VELOCITY_IDLE_SECONDS)
+
+
+def with_velocity(modality, features, keys, peers, seconds):
+    """
+    Count events in the velocity store and append their velocity columns
+    keys/peers: source and destination IPs, or sender and receiver emails
+    """
+    if velocity_store is None:
+        return features
+    with stage_timer('velocity', modality):
+        return np.hstack([features, velocity_store.rows(modality, keys, peers, seconds)])
+
+
+def with_record_velocity(modality, features, records):
+    """with_velocity() for validated JSON records"""
+    if velocity_store is None:
+        return features
+    if modality == 'network':
+        keys, peers = [r['source_ip'] for r in records], [r['destination_ip'] for r in records]
+    else:
+        keys, peers = [r['sender_email'] for r in records], [r['receiver_email'] for r in records]
+    return with_velocity(modality, features, keys, peers, event_seconds(records))
+
+
+def _model_columns(detector, modality, features):
+    """Keep the feature columns the serving models were trained on"""
+    n_features = detector.n_features(modality)
+    if features.shape[1] < n_features:
+        raise RuntimeError(
+            f"The {modality} models expect {n_features} features (velocity features), "
+            f"got {features.shape[1]}; set ML_VELOCITY_FEATURES=true"
+        )
+    return features[:, :n_features]
+
+
+def score_network_batch(features):
+    """
+    Run a network feature matrix through the scaler, detector and classifier
+    Returns: list of (is_anomaly, anomaly_score, threat_class, confidence)
+    """
+    return _score_cached('network', features)
+
+
+def score_email_batch(features):
+    """
+    Run an email feature matrix through the scaler, detector and classifier
+    Returns: list of (is_anomaly, anomaly_score, threat_class, confidence)
+    """
+    return _score_cached('email', features)
+
+
+def _score_cached(modality, features, lookup=True):
+    """Score a feature matrix, serving rows seen recently from the prediction cache"""
+    # Version before detector, see ActiveModels._swap
+    version = active_models.version
+    detector = active_models.detector
+    features = _model_columns(detector, modality, features)
+    score = detector.score_network_batch if modality == 'network' else detector.score_email_batch
+    if prediction_cache is None or modality in online_modalities:
+        return _rows(*score(features))
+
+    keys = prediction_cache.keys(modality, version, features)
+    if lookup:
+        results = prediction_cache.get_many(modality, keys)
+        missing = [i for i, result in enumerate(results) if result is None]
+    else:
+        results = [None] * len(keys)
+        missing = list(range(len(keys)))
+
+    if missing:
+        scored = _rows(*score(features[missing]))
+        for i, result in zip(missing, scored):
+            results[i] = result
+        prediction_cache.put_many([keys[i] for i in missing], scored)
+    return results
+
+
+def cached_prediction(modality, features):
+    """Cached result for a single feature row, or None"""
+    if prediction_cache is None or modality in online_modalities:
+        return None
+    version = active_models.version
+    features = _model_columns(active_models.detector, modality, features.reshape(1, -1))
+    keys = prediction_cache.keys(modality, version, features)
+    return prediction_cache.get_many(modality, keys)[0]
+
+
+def _rows(is_anomaly, anomaly_score, threat_class, confidence):
+    """Split the scored columns back into per-row tuples"""
+    return [
+        (bool(is_anomaly[i]), float(anomaly_score[i]), threat_class[i], float(confidence[i]))
+        for i in range(len(is_anomaly))
+    ]
+
+
+# Model calls run on a dedicated pool so they never block the event loop
+inference_pool = InferencePool(INFERENCE_WORKERS, INFERENCE_MAX_PENDING, RETRY_AFTER_SECONDS)
+
+# Concurrent single-row requests are scored together as one matrix
+# (the routes already looked each row up in the prediction cache)
+network_batcher = MicroBatcher(
+    partial(_score_cached, 'network', lookup=False), BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, BATCH_MAX_QUEUE, inference_pool, name='network'
+)
+email_batcher = MicroBatcher(
+    partial(_score_cached, 'email', lookup=False), BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, BATCH_MAX_QUEUE, inference_pool, name='email'
+)
+
+REGISTRY.register(CallbackMetric(
+    'ml_inference_queue_depth', 'Requests waiting for inference', ('queue',),
+    lambda: {
+        ('pool',): inference_pool.pending,
+        ('network_batcher',): network_batcher.queue_depth,
+        ('email_batcher',): email_batcher.queue_depth,
+    }
+))
+REGISTRY.register(CallbackMetric(
+    'ml_inference_rejected_total', 'Requests shed because a queue was full', ('queue',),
+    lambda: {
+        ('pool',): inference_pool.rejected,
+        ('network_batcher',): network_batcher.rejected,
+        ('email_batcher',): email_batcher.rejected,
+    },
+    kind='counter'
+))
+
+
+def overloaded(error):
+    """503 with a Retry-After hint, so callers back off instead of timing out"""
+    return HTTPException(
+        status_code=503,
+        detail=f"ML service overloaded: {error}",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+def inference_stats():
+    """Queue depths and rejection counts of the inference path"""
+    return {
+        "pool": inference_pool.stats(),
+        "network_batcher": network_batcher.stats(),
+        "email_batcher": email_batcher.stats(),
+        "prediction_cache": prediction_cache.stats() if prediction_cache is not None else None,
+        "user_baselines": user_baselines.stats() if user_baselines is not None else None,
+        "velocity": velocity_store.stats() if velocity_store is not None else None
+    }
+
+
+def build_prediction(result, details, baseline=(None, None)):
+    """Turn a scored row (and its user's baseline percentile and z-score, if any) into an AnomalyPrediction"""
+    is_anomaly, anomaly_score, threat_class, confidence = result
+    return AnomalyPrediction(
+        is_anomaly=is_anomaly,
+        anomaly_score=anomaly_score,
+        threat_class=str(threat_class) if threat_class else None,
+        confidence=confidence,
+        timestamp=datetime.now(),
+        details=details,
+        user_score_percentile=baseline[0],
+        user_max_zscore=baseline[1]
+    )
 
 
 @router.post("/predict/network", response_model=AnomalyPrediction)
 async def predict_network(data: NetworkFeatures):
     """Predict anomaly for network traffic"""
     try:
-        features = extract_network_features(data)
+        observe_since_request_start('validation', 'network')
+        with stage_timer('extract_features', 'network'):
+            features = extract_network_features(data)
+        features = with_velocity(
+            'network', features.reshape(1, -1), [data.source_ip], [data.destination_ip], [wall_seconds(data.timestamp)]
+        )[0]
         
-        # DEBUG
-        print("\n" + "="*60)
-        print(f"NETWORK TRAFFIC DETECTION")
-        print(f"Source: {data.source_ip} → Destination: {data.destination_ip}")
-        print(f"Protocol: {data.protocol}, Port: {data.port_number}")
-        print(f"Packets sent: {data.packets_sent}, received: {data.packets_received}")
-        print(f"Bytes sent: {data.bytes_sent}, received: {data.bytes_received}")
-        print("="*60)
+        if DEBUG_LOG:
+            print("\n" + "="*60)
+            print(f"NETWORK TRAFFIC DETECTION")
+            print(f"Source: {data.source_ip} → Destination: {data.destination_ip}")
+            print(f"Protocol: {data.protocol}, Port: {data.port_number}")
+            print(f"Packets sent: {data.packets_sent}, received: {data.packets_received}")
+            print(f"Bytes sent: {data.bytes_sent}, received: {data.bytes_received}")
+            print("="*60)
         
-        # Step 1: Check if network traffic is anomalous using IsolationForest
-        is_anomaly, anomaly_score = detector.predict_network_anomaly(features)
+        # Detect and, if anomalous, classify the threat type
+        result = cached_prediction('network', features)
+        if result is None:
+            result = await network_batcher.submit(features)
+        is_anomaly, anomaly_score, threat_class, confidence = result
         
-        # Step 2: If anomalous, classify the threat type
-        if is_anomaly:
-            threat_class, confidence = detector.classify_network_threat(features)
-        else:
-            threat_class = None
-            confidence = anomaly_score
+        if DEBUG_LOG:
+            print(f"✅ Result → Anomaly: {is_anomaly}, Score: {anomaly_score:.3f}")
+            print(f"   Threat: {threat_class}, Confidence: {confidence:.3f}\n")
         
-        print(f"✅ Result → Anomaly: {is_anomaly}, Score: {anomaly_score:.3f}")
-        print(f"   Threat: {threat_class}, Confidence: {confidence:.3f}\n")
-        
-        return AnomalyPrediction(
-            is_anomaly=bool(is_anomaly),
-            anomaly_score=float(anomaly_score),
-            threat_class=str(threat_class) if threat_class else None,
-            confidence=float(confidence),
-            timestamp=datetime.now(),
-            details=f"Network traffic from {data.source_ip} to {data.destination_ip}"
-        )
+        with stage_timer('response_build', 'network'):
+            return build_prediction(
+                (is_anomaly, anomaly_score, threat_class, confidence),
+                f"Network traffic from {data.source_ip} to {data.destination_ip}"
+            )
         
+    except OverloadedError as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
@@ -91,190 +291,225 @@ async def predict_network(data: NetworkFeatures):
 async def predict_email(data: EmailFeatures):
     """Predict anomaly for email communication"""
     try:
-        features = extract_email_features(data)
-        
-        # DEBUG
-        print("\n" + "="*60)
-        print(f"EMAIL DETECTION")
-        print(f"From: {data.sender_email} → To: {data.receiver_email}")
-        print(f"Recipients: {data.num_recipients}, Size: {data.email_size} bytes")
-        print(f"Subject length: {data.subject_length}, Body length: {data.body_length}")
-        print(f"Attachments: {data.num_attachments}, Has attachment: {data.has_attachment}")
-        print(f"Reply: {data.is_reply}, Forward: {data.is_forward}")
-        print("="*60)
+        observe_since_request_start('validation', 'email')
+        with stage_timer('extract_features', 'email'):
+            features = extract_email_features(data)
+        features = with_velocity(
+            'email', features.reshape(1, -1), [data.sender_email], [data.receiver_email], [wall_seconds(data.timestamp)]
+        )[0]
         
-        # Step 1: Check if email is anomalous using IsolationForest
-        is_anomaly, anomaly_score = detector.predict_email_anomaly(features)
+        if DEBUG_LOG:
+            print("\n" + "="*60)
+            print(f"EMAIL DETECTION")
+            print(f"From: {data.sender_email} → To: {data.receiver_email}")
+            print(f"Recipients: {data.num_recipients}, Size: {data.email_size} bytes")
+            print(f"Subject length: {data.subject_length}, Body length: {data.body_length}")
+            print(f"Attachments: {data.num_attachments}, Has attachment: {data.has_attachment}")
+            print(f"Reply: {data.is_reply}, Forward: {data.is_forward}")
+            print("="*60)
         
-        # Step 2: If anomalous, classify the threat type
-        if is_anomaly:
-            threat_class, confidence = detector.classify_email_threat(features)
-        else:
-            threat_class = None
-            confidence = anomaly_score
+        # Detect and, if anomalous, classify the threat type
+        result = cached_prediction('email', features)
+        if result is None:
+            result = await email_batcher.submit(features)
+        is_anomaly, anomaly_score, threat_class, confidence = result
         
-        print(f"✅ Result → Anomaly: {is_anomaly}, Score: {anomaly_score:.3f}")
-        print(f"   Threat: {threat_class}, Confidence: {confidence:.3f}\n")
+        if DEBUG_LOG:
+            print(f"✅ Result → Anomaly: {is_anomaly}, Score: {anomaly_score:.3f}")
+            print(f"   Threat: {threat_class}, Confidence: {confidence:.3f}\n")
         
-        return AnomalyPrediction(
-            is_anomaly=bool(is_anomaly),
-            anomaly_score=float(anomaly_score),
-            threat_class=str(threat_class) if threat_class else None,
-            confidence=float(confidence),
-            timestamp=datetime.now(),
-            details=f"Email from {data.sender_email} to {data.receiver_email}"
-        )
+        with stage_timer('response_build', 'email'):
+            return build_prediction(
+                (is_anomaly, anomaly_score, threat_class, confidence),
+                f"Email from {data.sender_email} to {data.receiver_email}"
+            )
         
+    except OverloadedError as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
 
-@router.get("/models/status")
-async def model_status():
-    """Check if models are loaded"""
-    return {
-        "network_detector": detector.network_detector is not None,
-        "email_detector": detector.email_detector is not None,
-        "network_threat_classifier": detector.network_threat_classifier is not None,
-        "email_threat_classifier": detector.email_threat_classifier is not None
-    }
-from fastapi import APIRouter, HTTPException
-from app.models.schemas import NetworkFeatures, EmailFeatures, AnomalyPrediction
-from app.models.anomaly_detector import AnomalyDetector
-import numpy as np
-from datetime import datetime
+@router.post("/predict/batch", response_model=List[AnomalyPrediction])
+async def predict_batch(request: BatchPredictionRequest):
+    """Predict anomalies for many items with one vectorized pass per modality"""
+    for i, item in enumerate(request.data):
+        if item.network is None and item.email is None:
+            raise HTTPException(status_code=422, detail=f"Item {i} has neither network nor email features")
 
+    observe_since_request_start('validation', 'batch')
+    try:
+        # Feature extraction and scoring both run on the inference pool
+        return await inference_pool.run(_predict_batch_items, request.data)
 
-router = APIRouter()
+    except OverloadedError as e:
+        raise overloaded(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch prediction error: {str(e)}")
 
-# Initialize and load trained models
-detector = AnomalyDetector()
-detector.load_models()
-
-
-def extract_network_features(data: NetworkFeatures):
-    """Convert NetworkFeatures to numpy array"""
-    return np.array([
-        data.packet_size,
-        data.connection_duration,
-        data.port_number,
-        data.packets_sent,
-        data.packets_received,
-        data.bytes_sent,
-        data.bytes_received,
-        data.timestamp.hour,
-        data.timestamp.weekday(),
-        1 if data.protocol.lower() == 'tcp' else 0,
-        1 if data.protocol.lower() == 'udp' else 0,
-    ])
-
-
-def extract_email_features(data: EmailFeatures):
-    """Convert EmailFeatures to numpy array"""
-    return np.array([
-        data.num_recipients,
-        data.email_size,
-        1 if data.has_attachment else 0,
-        data.num_attachments,
-        data.subject_length,
-        data.body_length,
-        1 if data.is_reply else 0,
-        1 if data.is_forward else 0,
-        data.timestamp.hour,
-        data.timestamp.weekday(),
-        len(data.sender_email.split('@')[1]) if '@' in data.sender_email else 0,
-    ])
 
+def _predict_batch_items(items):
+    """Score a list of CombinedFeatures, one matrix per modality"""
+    network_idx = [i for i, item in enumerate(items) if item.network is not None]
+    email_idx = [i for i, item in enumerate(items) if item.email is not None]
 
-@router.post("/predict/network", response_model=AnomalyPrediction)
-async def predict_network(data: NetworkFeatures):
-    """Predict anomaly for network traffic"""
-    try:
-        features = extract_network_features(data)
-        
-        # DEBUG
-        print("\n" + "="*60)
-        print(f"NETWORK TRAFFIC DETECTION")
-        print(f"Source: {data.source_ip} → Destination: {data.destination_ip}")
-        print(f"Protocol: {data.protocol}, Port: {data.port_number}")
-        print(f"Packets sent: {data.packets_sent}, received: {data.packets_received}")
-        print(f"Bytes sent: {data.bytes_sent}, received: {data.bytes_received}")
-        print("="*60)
-        
-        # Step 1: Check if network traffic is anomalous using IsolationForest
-        is_anomaly, anomaly_score = detector.predict_network_anomaly(features)
-        
-        # Step 2: If anomalous, classify the threat type
-        if is_anomaly:
-            threat_class, confidence = detector.classify_network_threat(features)
+    network_results = {}
+    if network_idx:
+        with stage_timer('extract_features', 'network'):
+            base = np.vstack([extract_network_features(items[i].network) for i in network_idx])
+        flows = [items[i].network for i in network_idx]
+        sources, seconds = [f.source_ip for f in flows], [wall_seconds(f.timestamp) for f in flows]
+        features = with_velocity('network', base, sources, [f.destination_ip for f in flows], seconds)
+        # Baselines track the per-event features; velocity is already a per-key aggregate
+        network_results = _with_baselines('network', items, network_idx, base, score_network_batch(features))
+
+    email_results = {}
+    if email_idx:
+        with stage_timer('extract_features', 'email'):
+            base = np.vstack([extract_email_features(items[i].email) for i in email_idx])
+        emails = [items[i].email for i in email_idx]
+        senders, seconds = [e.sender_email for e in emails], [wall_seconds(e.timestamp) for e in emails]
+        features = with_velocity('email', base, senders, [e.receiver_email for e in emails], seconds)
+        # Baselines track the per-event features; velocity is already a per-key aggregate
+        email_results = _with_baselines('email', items, email_idx, base, score_email_batch(features))
+
+    predictions = []
+    for i, item in enumerate(items):
+        candidates = []
+        if i in network_results:
+            net = item.network
+            candidates.append((*network_results[i], f"Network traffic from {net.source_ip} to {net.destination_ip}"))
+        if i in email_results:
+            mail = item.email
+            candidates.append((*email_results[i], f"Email from {mail.sender_email} to {mail.receiver_email}"))
+
+        # An item carrying both modalities reports its most suspicious one
+        result, baseline, details = max(candidates, key=lambda c: (c[0][0], c[0][1]))
+        predictions.append(build_prediction(result, f"User {item.user_id}: {details}", baseline))
+
+    return predictions
+
+
+def _with_baselines(modality, items, idx, features, results):
+    """
+    Rescore a modality's rows against their users' baselines, if enabled
+    Returns: dict of item index -> (result, (user score percentile, user max z-score))
+    """
+    if user_baselines is None:
+        return {i: (result, (None, None)) for i, result in zip(idx, results)}
+    with stage_timer('user_baseline', modality):
+        results, baselines = user_baselines.rescore(modality, [items[i].user_id for i in idx], features, results)
+    return dict(zip(idx, zip(results, baselines)))
+
+
+class InvalidRowsError(ValueError):
+    """Raised when bulk records fail validation; carries row index -> pydantic errors"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid rows")
+        self.errors = errors
+
+
+def _predict_bulk(body, content_type, modality):
+    """Parse a raw JSON/NDJSON body into feature columns and score it in one pass"""
+    records = parse_records(body, content_type)
+
+    with stage_timer('extract_features', modality):
+        if modality == 'network':
+            features, errors = network_columns(records)
         else:
-            threat_class = None
-            confidence = anomaly_score
-        
-        print(f"✅ Result → Anomaly: {is_anomaly}, Score: {anomaly_score:.3f}")
-        print(f"   Threat: {threat_class}, Confidence: {confidence:.3f}\n")
-        
-        return AnomalyPrediction(
-            is_anomaly=bool(is_anomaly),
-            anomaly_score=float(anomaly_score),
-            threat_class=str(threat_class) if threat_class else None,
-            confidence=float(confidence),
-            timestamp=datetime.now(),
-            details=f"Network traffic from {data.source_ip} to {data.destination_ip}"
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+            features, errors = email_columns(records)
+    if errors:
+        raise InvalidRowsError(errors)
+    if not records:
+        return []
+    features = with_record_velocity(modality, features, records)
 
+    if modality == 'network':
+        results = score_network_batch(features)
+        details = (f"Network traffic from {r['source_ip']} to {r['destination_ip']}" for r in records)
+    else:
+        results = score_email_batch(features)
+        details = (f"Email from {r['sender_email']} to {r['receiver_email']}" for r in records)
 
-@router.post("/predict/email", response_model=AnomalyPrediction)
-async def predict_email(data: EmailFeatures):
-    """Predict anomaly for email communication"""
+    with stage_timer('response_build', modality):
+        return [build_prediction(result, detail) for result, detail in zip(results, details)]
+
+
+async def _bulk_endpoint(request, modality):
+    body = await request.body()
+    observe_since_request_start('validation', modality)
     try:
-        features = extract_email_features(data)
-        
-        # DEBUG
-        print("\n" + "="*60)
-        print(f"EMAIL DETECTION")
-        print(f"From: {data.sender_email} → To: {data.receiver_email}")
-        print(f"Recipients: {data.num_recipients}, Size: {data.email_size} bytes")
-        print(f"Subject length: {data.subject_length}, Body length: {data.body_length}")
-        print(f"Attachments: {data.num_attachments}, Has attachment: {data.has_attachment}")
-        print(f"Reply: {data.is_reply}, Forward: {data.is_forward}")
-        print("="*60)
-        
-        # Step 1: Check if email is anomalous using IsolationForest
-        is_anomaly, anomaly_score = detector.predict_email_anomaly(features)
-        
-        # Step 2: If anomalous, classify the threat type
-        if is_anomaly:
-            threat_class, confidence = detector.classify_email_threat(features)
-        else:
-            threat_class = None
-            confidence = anomaly_score
-        
-        print(f"✅ Result → Anomaly: {is_anomaly}, Score: {anomaly_score:.3f}")
-        print(f"   Threat: {threat_class}, Confidence: {confidence:.3f}\n")
-        
-        return AnomalyPrediction(
-            is_anomaly=bool(is_anomaly),
-            anomaly_score=float(anomaly_score),
-            threat_class=str(threat_class) if threat_class else None,
-            confidence=float(confidence),
-            timestamp=datetime.now(),
-            details=f"Email from {data.sender_email} to {data.receiver_email}"
-        )
-        
+        # Parsing, extraction and scoring all run on the inference pool
+        return await inference_pool.run(_predict_bulk, body, request.headers.get('content-type', ''), modality)
+
+    except InvalidRowsError as e:
+        raise HTTPException(status_code=422, detail=[
+            {"row": row, "errors": errors} for row, errors in sorted(e.errors.items())
+        ])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed request body: {str(e)}")
+    except OverloadedError as e:
+        raise overloaded(e)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Bulk prediction error: {str(e)}")
+
+
+@router.post("/predict/network/bulk", response_model=List[AnomalyPrediction])
+async def predict_network_bulk(request: Request):
+    """
+    Predict anomalies for a JSON array or NDJSON body of network records.
+    Records are decoded straight into feature columns; only rows that do not
+    parse cleanly go through NetworkFeatures validation.
+    """
+    return await _bulk_endpoint(request, 'network')
+
+
+@router.post("/predict/email/bulk", response_model=List[AnomalyPrediction])
+async def predict_email_bulk(request: Request):
+    """
+    Predict anomalies for a JSON array or NDJSON body of email records.
+    Records are decoded straight into feature columns; only rows that do not
+    parse cleanly go through EmailFeatures validation.
+    """
+    return await _bulk_endpoint(request, 'email')
 
 
 @router.get("/models/status")
 async def model_status():
-    """Check if models are loaded"""
+    """Check if models are loaded and which version is serving"""
+    detector = active_models.detector
     return {
-        "network_detector": detector.network_detector is not None,
-        "email_detector": detector.email_detector is not None,
-        "network_threat_classifier": detector.network_threat_classifier is not None,
+        "version": active_models.version,
+        "loaded_at": active_models.loaded_at,
+        "network_detector": detector.network_detector is not None or detector.network_engine is not None
+            or detector.network_online is not None,
+        "email_detector": detector.email_detector is not None or detector.email_engine is not None
+            or detector.email_online is not None,
+        "network_threat_classifier": detector.network_threat_classifier is not None
+            or (detector.network_engine is not None and detector.network_engine.has_classifier),
         "email_threat_classifier": detector.email_threat_classifier is not None
+            or (detector.email_engine is not None and detector.email_engine.has_classifier),
+        "model_format": MODEL_FORMAT,
+        "anomaly_detector": {
+            "network": "half_space_trees" if detector.network_online is not None else "isolation_forest",
+            "email": "half_space_trees" if detector.email_online is not None else "isolation_forest"
+        },
+        "inference_engine": {
+            "network": "compiled" if detector.network_engine is not None else "sklearn",
+            "email": "compiled" if detector.email_engine is not None else "sklearn"
+        },
+        "available_versions": registry.list_versions()
     }
+
+
+@router.post("/models/reload")
+async def reload_models(version: Optional[str] = None):
+    """Load a model version (default: the registry's ACTIVE one) and swap it in"""
+    try:
+        await active_models.reload(version, activate=version is not None)
+        return await model_status()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload error: {str(e)}")
@@ -0,0 +1,205 @@
+import asyncio
+import codecs
+import json
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from app.api.predict import (
+    score_network_batch, score_email_batch, build_prediction, inference_pool, with_record_velocity
+)
+from app.services.features import network_columns, email_columns
+from app.services.inference_pool import OverloadedError
+from app.config import STREAM_MAX_BATCH, STREAM_MAX_PENDING_BATCHES
+
+
+router = APIRouter()
+
+# Delay before a stream retries a batch the saturated inference pool turned away
+OVERLOADED_BACKOFF_SECONDS = 0.01
+
+
+def _modality(record):
+    """'network' or 'email' from an explicit "type", else from the fields present"""
+    kind = record.get('type')
+    if kind in ('network', 'email'):
+        return kind
+    if 'source_ip' in record:
+        return 'network'
+    if 'sender_email' in record:
+        return 'email'
+    return None
+
+
+def score_lines(lines, first_seq=0):
+    """
+    Score a batch of NDJSON lines holding network and/or email records
+    Returns: one NDJSON result line per input line, in input order
+    """
+    outputs = [None] * len(lines)
+    groups = {'network': [], 'email': []}
+
+    for i, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            outputs[i] = {"error": f"Invalid JSON: {e}"}
+            continue
+        modality = _modality(record) if isinstance(record, dict) else None
+        if modality is None:
+            outputs[i] = {"error": "Record is neither network nor email features"}
+            continue
+        groups[modality].append((i, record))
+
+    for modality, columns, score in [
+        ('network', network_columns, score_network_batch),
+        ('email', email_columns, score_email_batch),
+    ]:
+        if not groups[modality]:
+            continue
+        records = [record for _, record in groups[modality]]
+        features, errors = columns(records)
+        for j in errors:
+            i, record = groups[modality][j]
+            outputs[i] = _tagged(record, {"type": modality, "error": errors[j]})
+
+        valid = [j for j in range(len(records)) if j not in errors]
+        if not valid:
+            continue
+        features = with_record_velocity(modality, features[valid], [records[j] for j in valid])
+        results = score(features)
+        for j, result in zip(valid, results):
+            i, record = groups[modality][j]
+            if modality == 'network':
+                details = f"Network traffic from {record['source_ip']} to {record['destination_ip']}"
+            else:
+                details = f"Email from {record['sender_email']} to {record['receiver_email']}"
+            prediction = build_prediction(result, details).model_dump(mode='json')
+            outputs[i] = _tagged(record, {"type": modality, **prediction})
+
+    return [json.dumps({"seq": first_seq + i, **output}) for i, output in enumerate(outputs)]
+
+
+def _tagged(record, output):
+    """Echo the client's own record id, if it sent one"""
+    if 'id' in record:
+        output['id'] = record['id']
+    return output
+
+
+async def _line_batches(chunks, max_batch):
+    """Split an async stream of text chunks into batches of complete, non-empty lines"""
+    pending = ''
+    async for chunk in chunks:
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        lines = [line for line in lines if line.strip()]
+        for start in range(0, len(lines), max_batch):
+            yield lines[start:start + max_batch]
+    if pending.strip():
+        yield [pending]
+
+
+async def _score_when_admitted(lines, first_seq):
+    """Score on the inference pool; a stream waits for a slot instead of failing"""
+    while True:
+        try:
+            return await inference_pool.run(score_lines, lines, first_seq)
+        except OverloadedError:
+            await asyncio.sleep(OVERLOADED_BACKOFF_SECONDS)
+
+
+async def score_stream(chunks):
+    """
+    Score NDJSON arriving as text chunks, yielding result lines in input order.
+
+    A reader task splits the input into batches of at most STREAM_MAX_BATCH
+    lines and parks them on a queue holding STREAM_MAX_PENDING_BATCHES.
+    Batches are scored one after another, so when scoring or the client
+    reading the results falls behind, the queue fills, the reader stops
+    pulling input and the sender is throttled by the transport.
+    """
+    queue = asyncio.Queue(maxsize=STREAM_MAX_PENDING_BATCHES)
+
+    async def read():
+        try:
+            async for lines in _line_batches(chunks, STREAM_MAX_BATCH):
+                await queue.put(lines)
+        finally:
+            await queue.put(None)
+
+    reader = asyncio.create_task(read())
+    seq = 0
+    try:
+        while True:
+            lines = await queue.get()
+            if lines is None:
+                break
+            yield await _score_when_admitted(lines, seq)
+            seq += len(lines)
+        # Surface a failed read (e.g. client disconnect) to the caller
+        await reader
+    finally:
+        reader.cancel()
+
+
+async def _request_text(request):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    async for chunk in request.stream():
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that leaves receive() to the body iterator.
+    The stock one listens for the disconnect on receive() while streaming,
+    which would swallow the request body this endpoint is still reading;
+    here a disconnect surfaces as ClientDisconnect from request.stream().
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+@router.post("/predict/stream")
+async def predict_stream(request: Request):
+    """
+    Score NDJSON network and email records sent over one long-lived (chunked) POST.
+    Each record is a NetworkFeatures or EmailFeatures object, optionally with
+    "type" and "id" keys. Results stream back as NDJSON in input order, one
+    line per record carrying its "seq" number, and invalid records get an
+    "error" line instead of failing the stream.
+    """
+    async def body():
+        async for results in score_stream(_request_text(request)):
+            yield ''.join(f'{line}\n' for line in results)
+
+    return DuplexStreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@router.websocket("/ws/predict")
+async def predict_websocket(websocket: WebSocket):
+    """
+    WebSocket flavour of /predict/stream: every message holds one or more NDJSON
+    records and every scored batch comes back as one NDJSON message, in order.
+    """
+    await websocket.accept()
+
+    async def messages():
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            text = message.get('text')
+            if text is None:
+                text = (message.get('bytes') or b'').decode('utf-8', errors='replace')
+            # A message always ends a line, so its records are scored without waiting for more
+            yield text + '\n'
+
+    try:
+        async for results in score_stream(messages()):
+            await websocket.send_text('\n'.join(results))
+    except (WebSocketDisconnect, RuntimeError):
+        # Client went away while results were still being sent
+        pass
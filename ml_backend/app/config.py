@@ -0,0 +1,117 @@
+import os
+
+
+# Inference backend: "sklearn" (default) or "compiled" array-backed tree engine
+INFERENCE_ENGINE = os.getenv("ML_INFERENCE_ENGINE", "sklearn").lower()
+
+# Model storage: "pickle" (default, sklearn estimators per process) or "mmap"
+# (compiled models mapped read-only and shared by all worker processes)
+MODEL_FORMAT = os.getenv("ML_MODEL_FORMAT", "pickle").lower()
+
+# Versioned model registry; ACTIVE is polled every MODEL_WATCH_SECONDS (0 disables)
+MODEL_REGISTRY_PATH = os.getenv("ML_MODEL_REGISTRY_PATH", "saved_models/registry/")
+MODEL_WATCH_SECONDS = float(os.getenv("ML_MODEL_WATCH_SECONDS", "0"))
+
+# Batches larger than this go to sklearn's Cython path instead of the compiled engine
+ENGINE_MAX_BATCH = int(os.getenv("ML_ENGINE_MAX_BATCH", "256"))
+
+# Micro-batching of concurrent single-row /predict/network and /predict/email calls
+BATCH_MAX_SIZE = int(os.getenv("ML_BATCH_MAX_SIZE", "64"))
+BATCH_MAX_WAIT_MS = float(os.getenv("ML_BATCH_MAX_WAIT_MS", "2"))
+BATCH_MAX_QUEUE = int(os.getenv("ML_BATCH_MAX_QUEUE", "1024"))
+
+# Dedicated inference executor and admission control
+INFERENCE_WORKERS = int(os.getenv("ML_INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+INFERENCE_MAX_PENDING = int(os.getenv("ML_INFERENCE_MAX_PENDING", "64"))
+RETRY_AFTER_SECONDS = int(os.getenv("ML_RETRY_AFTER_SECONDS", "1"))
+
+# Per-request debug banners on stdout; off by default, they cost time on the hot path
+DEBUG_LOG = os.getenv("ML_DEBUG_LOG", "false").lower() in ("1", "true", "yes")
+
+# Optional TTL/LRU cache of scored rows in front of the detector (0 entries disables it).
+# Rows are keyed on their float32 value truncated to PREDICTION_CACHE_MANTISSA_BITS of mantissa
+PREDICTION_CACHE_SIZE = int(os.getenv("ML_PREDICTION_CACHE_SIZE", "0"))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("ML_PREDICTION_CACHE_TTL_SECONDS", "60"))
+PREDICTION_CACHE_MANTISSA_BITS = int(os.getenv("ML_PREDICTION_CACHE_MANTISSA_BITS", "16"))
+
+# Streaming endpoints (/predict/stream, /ws/predict): records scored per batch and
+# batches parsed ahead of scoring before the connection stops being read
+STREAM_MAX_BATCH = int(os.getenv("ML_STREAM_MAX_BATCH", "64"))
+STREAM_MAX_PENDING_BATCHES = int(os.getenv("ML_STREAM_MAX_PENDING_BATCHES", "8"))
+
+# Anomaly detector per modality: "isolation_forest" (default, from the model registry) or
+# "half_space_trees", a streaming detector that learns from every scored row and is
+# checkpointed to ONLINE_MODEL_PATH every ONLINE_CHECKPOINT_SECONDS and on shutdown
+NETWORK_DETECTOR = os.getenv("ML_NETWORK_DETECTOR", "isolation_forest").lower()
+EMAIL_DETECTOR = os.getenv("ML_EMAIL_DETECTOR", "isolation_forest").lower()
+ONLINE_MODEL_PATH = os.getenv("ML_ONLINE_MODEL_PATH", "saved_models/online/")
+ONLINE_CHECKPOINT_SECONDS = float(os.getenv("ML_ONLINE_CHECKPOINT_SECONDS", "300"))
+
+# Per-user baselines rescoring /predict/batch items by user_id (0 users disables them).
+# A user's verdicts are adjusted once they have USER_BASELINE_MIN_EVENTS events: global
+# anomalies below the user's USER_BASELINE_QUANTILE of recent scores are suppressed and
+# rows with a feature USER_BASELINE_ZSCORE standard deviations off the user's mean are flagged.
+# Profiles are snapshotted to USER_BASELINE_PATH every USER_BASELINE_SNAPSHOT_SECONDS and on shutdown
+USER_BASELINE_MAX_USERS = int(os.getenv("ML_USER_BASELINE_MAX_USERS", "0"))
+USER_BASELINE_MIN_EVENTS = int(os.getenv("ML_USER_BASELINE_MIN_EVENTS", "20"))
+USER_BASELINE_HISTORY = int(os.getenv("ML_USER_BASELINE_HISTORY", "32"))
+USER_BASELINE_QUANTILE = float(os.getenv("ML_USER_BASELINE_QUANTILE", "0.9"))
+USER_BASELINE_ZSCORE = float(os.getenv("ML_USER_BASELINE_ZSCORE", "4"))
+USER_BASELINE_PATH = os.getenv("ML_USER_BASELINE_PATH", "saved_models/user_baselines.npz")
+USER_BASELINE_SNAPSHOT_SECONDS = float(os.getenv("ML_USER_BASELINE_SNAPSHOT_SECONDS", "300"))
+
+# Sliding-window velocity features (events, new destinations/recipients per source IP,
+# destination IP and sender over 1m/5m/1h), appended for models trained on the extended
+# schema. Counters are bounded to VELOCITY_MAX_KEYS keys and VELOCITY_MAX_PAIRS key/peer
+# pairs; keys idle for VELOCITY_IDLE_SECONDS of event time are dropped
+VELOCITY_FEATURES = os.getenv("ML_VELOCITY_FEATURES", "false").lower() in ("1", "true", "yes")
+VELOCITY_MAX_KEYS = int(os.getenv("ML_VELOCITY_MAX_KEYS", "100000"))
+VELOCITY_MAX_PAIRS = int(os.getenv("ML_VELOCITY_MAX_PAIRS", "200000"))
+VELOCITY_IDLE_SECONDS = int(os.getenv("ML_VELOCITY_IDLE_SECONDS", "3600"))
+
+# MongoDB holding the scored alerts, i.e. the Node backend's database and collections.
+# One pooled async client per worker, opened in the app lifespan; the timeouts keep a slow
+# or unreachable database from holding requests and pool connections indefinitely
+MONGO_URI = os.getenv("ML_MONGO_URI", "mongodb://localhost:27017/")
+MONGO_DB = os.getenv("ML_MONGO_DB", "anomaly_detection")
+# modality:collection pairs; the defaults are where mongoose stores the NetworkTraffic and
+# EmailCommunication models
+ALERT_COLLECTIONS = dict(
+    item.strip().split(":", 1)
+    for item in os.getenv("ML_ALERT_COLLECTIONS", "network:networktraffics,email:emailcommunications").split(",")
+)
+MONGO_MAX_POOL_SIZE = int(os.getenv("ML_MONGO_MAX_POOL_SIZE", "20"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("ML_MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("ML_MONGO_CONNECT_TIMEOUT_MS", "2000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("ML_MONGO_SERVER_SELECTION_TIMEOUT_MS", "2000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("ML_MONGO_SOCKET_TIMEOUT_MS", "5000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("ML_MONGO_WAIT_QUEUE_TIMEOUT_MS", "1000"))
+
+# Alerts API admission: database operations running at once per worker, and operations
+# queued or running before further alert requests get a 503, so dashboards cannot crowd
+# the predict endpoints off the event loop and out of the connection pool
+ALERTS_MAX_CONCURRENCY = int(os.getenv("ML_ALERTS_MAX_CONCURRENCY", "4"))
+ALERTS_MAX_PENDING = int(os.getenv("ML_ALERTS_MAX_PENDING", "32"))
+
+# GET /api/alerts pages: default and maximum alerts per page, and the server-side
+# time limit of each collection query so a page costs bounded work
+ALERTS_PAGE_SIZE = int(os.getenv("ML_ALERTS_PAGE_SIZE", "50"))
+ALERTS_MAX_PAGE_SIZE = int(os.getenv("ML_ALERTS_MAX_PAGE_SIZE", "500"))
+ALERTS_QUERY_TIMEOUT_MS = int(os.getenv("ML_ALERTS_QUERY_TIMEOUT_MS", "2000"))
+
+# Bulk triage (POST /api/alerts/bulk/review, /api/alerts/bulk/delete): most IDs per request,
+# and IDs per batched write
+ALERTS_MAX_TRIAGE_IDS = int(os.getenv("ML_ALERTS_MAX_TRIAGE_IDS", "10000"))
+ALERTS_TRIAGE_BATCH_SIZE = int(os.getenv("ML_ALERTS_TRIAGE_BATCH_SIZE", "1000"))
+
+# Alert rollups behind GET /api/alerts/stats: counts of the stored anomalies per hour, threat
+# class, modality and reviewed state plus per source IP / sender. Every
+# ALERT_ROLLUP_FLUSH_SECONDS, alerts stored more than ALERT_ROLLUP_LAG_SECONDS ago are counted
+# and triage deltas flushed; at most ALERT_ROLLUP_MAX_PENDING_KEYS per-actor deltas wait in
+# memory while MongoDB is unreachable. The Node backend inserts each event before scoring it
+# (5 s timeout) and flags it afterwards, so the lag must stay well above that window
+ALERT_ROLLUPS = os.getenv("ML_ALERT_ROLLUPS", "true").lower() in ("1", "true", "yes")
+ALERT_ROLLUP_FLUSH_SECONDS = float(os.getenv("ML_ALERT_ROLLUP_FLUSH_SECONDS", "5"))
+ALERT_ROLLUP_LAG_SECONDS = float(os.getenv("ML_ALERT_ROLLUP_LAG_SECONDS", "60"))
+ALERT_ROLLUP_MAX_PENDING_KEYS = int(os.getenv("ML_ALERT_ROLLUP_MAX_PENDING_KEYS", "100000"))
+ALERT_STATS_MAX_DAYS = int(os.getenv("ML_ALERT_STATS_MAX_DAYS", "90"))
@@ -0,0 +1,128 @@
+import asyncio
+from contextlib import asynccontextmanager
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DESCENDING, ASCENDING
+from app.services.inference_pool import OverloadedError
+from app.config import (
+    MONGO_URI, MONGO_DB, ALERT_COLLECTIONS, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    ALERTS_MAX_CONCURRENCY, ALERTS_MAX_PENDING, RETRY_AFTER_SECONDS
+)
+
+
+# Collection holding each modality's alerts, in merge order
+ALERT_COLLECTION_NAMES = {modality: ALERT_COLLECTIONS[modality] for modality in ('network', 'email')}
+
+# Pre-aggregated alert counts, see app/services/alert_rollups.py
+ROLLUP_COLLECTION_NAMES = {'counts': 'alert_rollups', 'keys': 'alert_rollup_keys', 'state': 'alert_rollup_state'}
+ROLLUP_INDEXES = {
+    'counts': [('hour', ASCENDING)],
+    'keys': [('modality', ASCENDING), ('hour', ASCENDING)],
+}
+
+# Alert listings walk the anomalies' (timestamp, _id) newest first, optionally per threat class;
+# is_anomaly leads so normal events, most of each collection, are never scanned
+ALERT_INDEXES = (
+    [('is_anomaly', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+    [('is_anomaly', ASCENDING), ('threat_class', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+)
+
+
+class AlertDatabase:
+    """
+    Async access to the alert collections through one pooled client.
+
+    The client is opened in the app lifespan (connect) and closed on
+    shutdown; driver calls never block the event loop. Every alerts API
+    operation runs inside slot(): at most `max_concurrency` at a time, and
+    beyond `max_pending` queued or running the request fails fast with
+    OverloadedError, so a busy dashboard leaves the loop and the pool to
+    the predict endpoints.
+    """
+
+    def __init__(self, max_concurrency=4, max_pending=32, retry_after=1):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.client = None
+        self.collections = {}
+        self.rollups = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def connect(self, client=None):
+        """
+        Open the pooled client, unless one is already open; pass a client
+        (e.g. mongomock_motor's AsyncMongoMockClient) to use that instead
+        """
+        if self.client is not None:
+            return
+        if client is None:
+            client = AsyncIOMotorClient(
+                MONGO_URI,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            )
+        self.client = client
+        db = client[MONGO_DB]
+        self.collections = {modality: db[name] for modality, name in ALERT_COLLECTION_NAMES.items()}
+        self.rollups = {kind: db[name] for kind, name in ROLLUP_COLLECTION_NAMES.items()}
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.collections = {}
+            self.rollups = {}
+
+    @asynccontextmanager
+    async def slot(self):
+        """Admission for one alerts API operation, or OverloadedError if too many are pending"""
+        if self.client is None:
+            raise RuntimeError("Alert database is not connected")
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise OverloadedError(f"{self.pending} alert queries already pending", self.retry_after)
+
+        self.pending += 1
+        try:
+            async with self._semaphore:
+                yield self.collections
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def ensure_indexes(self):
+        """Create the indexes the alert listing and rollups rely on (no-op when they exist)"""
+        await asyncio.gather(
+            *(collection.create_index(keys) for collection in self.collections.values() for keys in ALERT_INDEXES),
+            *(self.rollups[kind].create_index(keys) for kind, keys in ROLLUP_INDEXES.items())
+        )
+
+    async def for_each_collection(self, operation):
+        """
+        Run operation(collection) against every alert collection concurrently,
+        so an ID is resolved in one round trip instead of one per collection
+        Returns: {modality: result}
+        """
+        results = await asyncio.gather(*(operation(c) for c in self.collections.values()))
+        return dict(zip(self.collections, results))
+
+    def stats(self):
+        return {
+            "connected": self.client is not None,
+            "max_concurrency": self.max_concurrency,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+database = AlertDatabase(ALERTS_MAX_CONCURRENCY, ALERTS_MAX_PENDING, RETRY_AFTER_SECONDS)
@@ -1,13 +1,91 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.models.schemas import NetworkFeatures, EmailFeatures, CombinedFeatures, AnomalyPrediction
-from app.api.predict import router as predict_router
-from app.api.alerts import router as alerts_router  # NEW
+from app.api.predict import (
+    router as predict_router, network_batcher, email_batcher, inference_pool, inference_stats, active_models,
+    user_baselines
+)
+from app.api.stream import router as stream_router
+from app.api.alerts import router as alerts_router, alert_rollups  # NEW
+from app.services.metrics import MetricsMiddleware, REGISTRY
+from app.db.mongodb import database
+from app.config import (
+    MODEL_WATCH_SECONDS, ONLINE_CHECKPOINT_SECONDS, USER_BASELINE_PATH, USER_BASELINE_SNAPSHOT_SECONDS,
+    ALERT_ROLLUP_FLUSH_SECONDS, ALERT_ROLLUP_LAG_SECONDS
+)
+
+
+async def ensure_alert_indexes():
+    """Create the alert listing indexes without holding up startup when MongoDB is unreachable"""
+    try:
+        await database.ensure_indexes()
+    except Exception as e:
+        print(f"⚠️  Could not create alert indexes: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the request coalescers on the server's event loop
+    network_batcher.start()
+    email_batcher.start()
+
+    # One pooled database client per worker for the alerts API
+    database.connect()
+    indexer = asyncio.create_task(ensure_alert_indexes())
+
+    # Newly stored alerts and triage deltas reach the rollups in periodic batches
+    flusher = None
+    if alert_rollups is not None and ALERT_ROLLUP_FLUSH_SECONDS > 0:
+        flusher = asyncio.create_task(alert_rollups.ingest_every(
+            database.collections, database.rollups, ALERT_ROLLUP_FLUSH_SECONDS, ALERT_ROLLUP_LAG_SECONDS
+        ))
+
+    # Pick up newly activated model versions without a restart
+    watcher = asyncio.create_task(active_models.watch(MODEL_WATCH_SECONDS)) if MODEL_WATCH_SECONDS > 0 else None
+
+    # Streaming detectors learn while serving; checkpoint them so a restart resumes
+    checkpointer = None
+    if active_models.online_modalities and ONLINE_CHECKPOINT_SECONDS > 0:
+        checkpointer = asyncio.create_task(active_models.checkpoint_every(ONLINE_CHECKPOINT_SECONDS))
+
+    # Per-user baselines survive restarts through periodic snapshots
+    snapshotter = None
+    if user_baselines is not None and USER_BASELINE_SNAPSHOT_SECONDS > 0:
+        snapshotter = asyncio.create_task(
+            user_baselines.snapshot_every(USER_BASELINE_PATH, USER_BASELINE_SNAPSHOT_SECONDS)
+        )
+    yield
+    indexer.cancel()
+    if flusher is not None:
+        flusher.cancel()
+    if watcher is not None:
+        watcher.cancel()
+    if checkpointer is not None:
+        checkpointer.cancel()
+    if snapshotter is not None:
+        snapshotter.cancel()
+    await network_batcher.stop()
+    await email_batcher.stop()
+    inference_pool.shutdown()
+    if alert_rollups is not None:
+        try:
+            await alert_rollups.flush(database.rollups)
+        except Exception as e:
+            print(f"⚠️  Alert rollups not flushed on shutdown: {e}")
+    database.close()
+    active_models.checkpoint()
+    if user_baselines is not None:
+        user_baselines.save(USER_BASELINE_PATH)
+
 
 app = FastAPI(
     title="Behavioral Anomaly Detection API",
     description="ML Backend for Network and Email Anomaly Detection",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS to allow cross-origin requests
@@ -19,8 +97,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency histograms for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(predict_router, tags=["Predictions"])
+app.include_router(stream_router, tags=["Predictions"])
 app.include_router(alerts_router, tags=["Alerts"])  # NEW
 
 @app.get("/")
@@ -33,4 +115,15 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "inference": inference_stats(),
+        "alerts_db": database.stats(),
+        "alert_rollups": alert_rollups.stats() if alert_rollups is not None else None
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: per-stage latency, throughput, anomaly counts, batch sizes"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -4,6 +4,22 @@ from sklearn.preprocessing import StandardScaler
 import joblib
 import os
 from datetime import datetime
+from app.models.tree_engine import CompiledModel, probe_rows, check_equivalence, is_equivalent
+from app.models import model_store
+from app.models.online_detector import HalfSpaceTrees
+from app.services.metrics import stage_timer, record_batch
+from app.services.velocity import NETWORK_VELOCITY_FEATURE_NAMES, EMAIL_VELOCITY_FEATURE_NAMES
+
+
+# Column order of the feature vectors built in app/api/predict.py
+NETWORK_FEATURE_NAMES = [
+    'packet_size', 'connection_duration', 'port_number', 'packets_sent', 'packets_received',
+    'bytes_sent', 'bytes_received', 'hour', 'weekday', 'is_tcp', 'is_udp',
+]
+EMAIL_FEATURE_NAMES = [
+    'num_recipients', 'email_size', 'has_attachment', 'num_attachments', 'subject_length',
+    'body_length', 'is_reply', 'is_forward', 'hour', 'weekday', 'sender_domain_length',
+]
 
 
 class AnomalyDetector:
@@ -14,51 +30,85 @@ class AnomalyDetector:
         self.email_threat_classifier = None
         self.scaler_network = StandardScaler()
         self.scaler_email = StandardScaler()
+        # Optional compiled inference engines, see compile_models()
+        self.network_engine = None
+        self.email_engine = None
+        self.engine_max_batch = 256
+        # Optional streaming detectors replacing the IsolationForests, see enable_online_detector()
+        self.network_online = None
+        self.email_online = None
 
 
-    def train_network_detector(self, X_train):
-        """Train Isolation Forest for network anomaly detection"""
-        X_scaled = self.scaler_network.fit_transform(X_train)
+    def train_network_detector(self, X_train, n_jobs=None, scaler=None):
+        """
+        Train Isolation Forest for network anomaly detection
+        scaler: optional StandardScaler already fitted on the full dataset (X_train may be a sample of it)
+        """
+        self.network_engine = None
+        if scaler is not None:
+            self.scaler_network = scaler
+            X_scaled = scaler.transform(X_train)
+        else:
+            X_scaled = self.scaler_network.fit_transform(X_train)
         self.network_detector = IsolationForest(
             contamination=0.05,
             random_state=42,
-            n_estimators=100
+            n_estimators=100,
+            n_jobs=n_jobs
         )
         self.network_detector.fit(X_scaled)
+        # Predict single-threaded; the inference pool already runs batches in parallel
+        self.network_detector.set_params(n_jobs=None)
         print("Network anomaly detector trained successfully")
 
 
-    def train_email_detector(self, X_train):
-        """Train Isolation Forest for email anomaly detection"""
-        X_scaled = self.scaler_email.fit_transform(X_train)
+    def train_email_detector(self, X_train, n_jobs=None, scaler=None):
+        """
+        Train Isolation Forest for email anomaly detection
+        scaler: optional StandardScaler already fitted on the full dataset (X_train may be a sample of it)
+        """
+        self.email_engine = None
+        if scaler is not None:
+            self.scaler_email = scaler
+            X_scaled = scaler.transform(X_train)
+        else:
+            X_scaled = self.scaler_email.fit_transform(X_train)
         self.email_detector = IsolationForest(
             contamination=0.05,
             random_state=42,
-            n_estimators=100
+            n_estimators=100,
+            n_jobs=n_jobs
         )
         self.email_detector.fit(X_scaled)
+        self.email_detector.set_params(n_jobs=None)
         print("Email anomaly detector trained successfully")
 
 
-    def train_network_threat_classifier(self, X_train, y_train):
+    def train_network_threat_classifier(self, X_train, y_train, n_jobs=None):
         """Train Random Forest classifier for NETWORK threat classification"""
+        self.network_engine = None
         self.network_threat_classifier = RandomForestClassifier(
             n_estimators=100,
             random_state=42,
-            max_depth=10
+            max_depth=10,
+            n_jobs=n_jobs
         )
         self.network_threat_classifier.fit(X_train, y_train)
+        self.network_threat_classifier.set_params(n_jobs=None)
         print("Network threat classifier trained successfully")
 
 
-    def train_email_threat_classifier(self, X_train, y_train):
+    def train_email_threat_classifier(self, X_train, y_train, n_jobs=None):
         """Train Random Forest classifier for EMAIL threat classification"""
+        self.email_engine = None
         self.email_threat_classifier = RandomForestClassifier(
             n_estimators=100,
             random_state=42,
-            max_depth=10
+            max_depth=10,
+            n_jobs=n_jobs
         )
         self.email_threat_classifier.fit(X_train, y_train)
+        self.email_threat_classifier.set_params(n_jobs=None)
         print("Email threat classifier trained successfully")
 
 
@@ -68,17 +118,8 @@ class AnomalyDetector:
         features: numpy array of network features
         Returns: (is_anomaly, anomaly_score)
         """
-        if self.network_detector is None:
-            raise ValueError("Network detector not trained yet")
-
-        features_scaled = self.scaler_network.transform(features.reshape(1, -1))
-        prediction = self.network_detector.predict(features_scaled)[0]
-        score = self.network_detector.score_samples(features_scaled)[0]
-
-        anomaly_score = 1 / (1 + np.exp(score))
-        is_anomaly = prediction == -1
-
-        return is_anomaly, float(anomaly_score)
+        is_anomaly, anomaly_score = self.predict_network_anomaly_batch(features.reshape(1, -1))
+        return is_anomaly[0], float(anomaly_score[0])
 
 
     def predict_email_anomaly(self, features):
@@ -87,17 +128,52 @@ class AnomalyDetector:
         features: numpy array of email features
         Returns: (is_anomaly, anomaly_score)
         """
-        if self.email_detector is None:
-            raise ValueError("Email detector not trained yet")
+        is_anomaly, anomaly_score = self.predict_email_anomaly_batch(features.reshape(1, -1))
+        return is_anomaly[0], float(anomaly_score[0])
 
-        features_scaled = self.scaler_email.transform(features.reshape(1, -1))
-        prediction = self.email_detector.predict(features_scaled)[0]
-        score = self.email_detector.score_samples(features_scaled)[0]
 
-        anomaly_score = 1 / (1 + np.exp(score))
-        is_anomaly = prediction == -1
+    def predict_network_anomaly_batch(self, features):
+        """
+        Predict anomalies for a batch of network traffic rows
+        features: 2D numpy array (n_samples, n_features)
+        Returns: (is_anomaly array, anomaly_score array)
+        """
+        if self.network_online is not None:
+            with stage_timer('online_detect', 'network'):
+                return self.network_online.predict_and_update(features)
 
-        return is_anomaly, float(anomaly_score)
+        engine = self._engine_for(self.network_engine, self.network_detector, features)
+        if engine is not None:
+            with stage_timer('compiled_traversal', 'network'):
+                is_anomaly, anomaly_score, _, _ = engine.predict(features)
+            return is_anomaly, anomaly_score
+
+        if self.network_detector is None:
+            raise ValueError("Network detector not trained yet")
+
+        return self._score_anomalies(self.network_detector, self.scaler_network, features, 'network')
+
+
+    def predict_email_anomaly_batch(self, features):
+        """
+        Predict anomalies for a batch of emails
+        features: 2D numpy array (n_samples, n_features)
+        Returns: (is_anomaly array, anomaly_score array)
+        """
+        if self.email_online is not None:
+            with stage_timer('online_detect', 'email'):
+                return self.email_online.predict_and_update(features)
+
+        engine = self._engine_for(self.email_engine, self.email_detector, features)
+        if engine is not None:
+            with stage_timer('compiled_traversal', 'email'):
+                is_anomaly, anomaly_score, _, _ = engine.predict(features)
+            return is_anomaly, anomaly_score
+
+        if self.email_detector is None:
+            raise ValueError("Email detector not trained yet")
+
+        return self._score_anomalies(self.email_detector, self.scaler_email, features, 'email')
 
 
     def classify_network_threat(self, features):
@@ -105,14 +181,8 @@ class AnomalyDetector:
         Classify NETWORK threat type
         Returns: (threat_class, confidence)
         """
-        if self.network_threat_classifier is None:
-            return self._classify_network_threat_fallback(features)
-
-        prediction = self.network_threat_classifier.predict(features.reshape(1, -1))[0]
-        probabilities = self.network_threat_classifier.predict_proba(features.reshape(1, -1))[0]
-        confidence = float(max(probabilities))
-
-        return prediction, confidence
+        threat_class, confidence = self.classify_network_threat_batch(features.reshape(1, -1))
+        return threat_class[0], float(confidence[0])
 
 
     def classify_email_threat(self, features):
@@ -120,14 +190,178 @@ class AnomalyDetector:
         Classify EMAIL threat type
         Returns: (threat_class, confidence)
         """
+        threat_class, confidence = self.classify_email_threat_batch(features.reshape(1, -1))
+        return threat_class[0], float(confidence[0])
+
+
+    def classify_network_threat_batch(self, features):
+        """
+        Classify NETWORK threat type for a batch of rows
+        Returns: (threat_class array, confidence array)
+        """
+        engine = self._engine_for(self.network_engine, self.network_threat_classifier, features)
+        if engine is not None and engine.has_classifier:
+            with stage_timer('compiled_traversal', 'network'):
+                _, _, threat_class, probabilities = engine.predict(features)
+            return threat_class, probabilities.max(axis=1)
+
+        if self.network_threat_classifier is None:
+            return self._classify_with_fallback(self._classify_network_threat_fallback, features, 'network')
+
+        return self._classify_threats(self.network_threat_classifier, features, 'network')
+
+
+    def classify_email_threat_batch(self, features):
+        """
+        Classify EMAIL threat type for a batch of rows
+        Returns: (threat_class array, confidence array)
+        """
+        engine = self._engine_for(self.email_engine, self.email_threat_classifier, features)
+        if engine is not None and engine.has_classifier:
+            with stage_timer('compiled_traversal', 'email'):
+                _, _, threat_class, probabilities = engine.predict(features)
+            return threat_class, probabilities.max(axis=1)
+
         if self.email_threat_classifier is None:
-            return self._classify_email_threat_fallback(features)
+            return self._classify_with_fallback(self._classify_email_threat_fallback, features, 'email')
+
+        return self._classify_threats(self.email_threat_classifier, features, 'email')
+
+
+    def score_network_batch(self, features):
+        """
+        Detect and classify a batch of network rows
+        Returns: (is_anomaly, anomaly_score, threat_class, confidence) arrays
+        """
+        # An online detector owns detection; the engine then only classifies the anomalous rows
+        engine = None
+        if self.network_online is None:
+            engine = self._engine_for(self.network_engine, self.network_detector, features)
+        return self._score_and_classify(
+            engine, self.predict_network_anomaly_batch, self.classify_network_threat_batch, features, 'network'
+        )
 
-        prediction = self.email_threat_classifier.predict(features.reshape(1, -1))[0]
-        probabilities = self.email_threat_classifier.predict_proba(features.reshape(1, -1))[0]
-        confidence = float(max(probabilities))
 
-        return prediction, confidence
+    def score_email_batch(self, features):
+        """
+        Detect and classify a batch of emails
+        Returns: (is_anomaly, anomaly_score, threat_class, confidence) arrays
+        """
+        # An online detector owns detection; the engine then only classifies the anomalous rows
+        engine = None
+        if self.email_online is None:
+            engine = self._engine_for(self.email_engine, self.email_detector, features)
+        return self._score_and_classify(
+            engine, self.predict_email_anomaly_batch, self.classify_email_threat_batch, features, 'email'
+        )
+
+
+    @staticmethod
+    def _score_and_classify(engine, predict_batch, classify_batch, features, model):
+        """Classify only the anomalous rows; normal rows keep their anomaly score as confidence"""
+        if engine is not None and engine.has_classifier:
+            # One traversal yields the label, score and class probabilities together
+            with stage_timer('compiled_traversal', model):
+                is_anomaly, anomaly_score, threat_class, probabilities = engine.predict(features)
+            threat_class = np.where(is_anomaly, threat_class, None)
+            confidence = np.where(is_anomaly, probabilities.max(axis=1), anomaly_score)
+            record_batch(model, is_anomaly)
+            return is_anomaly, anomaly_score, threat_class, confidence
+
+        is_anomaly, anomaly_score = predict_batch(features)
+        threat_class = np.full(len(features), None, dtype=object)
+        confidence = anomaly_score.astype(float)
+
+        anomalous = np.flatnonzero(is_anomaly)
+        if len(anomalous):
+            threat_class[anomalous], confidence[anomalous] = classify_batch(features[anomalous])
+
+        record_batch(model, is_anomaly)
+        return is_anomaly, anomaly_score, threat_class, confidence
+
+
+    def _engine_for(self, engine, fitted_model, features):
+        """
+        Pick the compiled engine for this batch, if any. sklearn's Cython
+        traversal wins on large batches, so those go to sklearn when the
+        fitted model is available.
+        """
+        if engine is None:
+            return None
+        if fitted_model is not None and len(features) > self.engine_max_batch:
+            return None
+        return engine
+
+
+    def compile_models(self, verify=True, max_batch=None):
+        """
+        Compile the loaded sklearn models into array-backed inference engines.
+        Each engine is checked against sklearn on synthetic rows and only
+        used if it reproduces the sklearn outputs.
+        max_batch: largest batch served by the engine instead of sklearn
+        """
+        if max_batch is not None:
+            self.engine_max_batch = max_batch
+
+        modalities = [
+            ('network', self.network_detector, self.scaler_network, self.network_threat_classifier),
+            ('email', self.email_detector, self.scaler_email, self.email_threat_classifier),
+        ]
+        for name, detector, scaler, classifier in modalities:
+            setattr(self, f'{name}_engine', None)
+            if detector is None:
+                continue
+
+            engine = CompiledModel.from_sklearn(detector, scaler, classifier)
+            if verify:
+                report = check_equivalence(engine, detector, scaler, classifier,
+                                           probe_rows(scaler, detector.n_features_in_))
+                if not is_equivalent(report):
+                    print(f"⚠️  Compiled {name} engine disagrees with sklearn, not using it: {report}")
+                    continue
+
+            setattr(self, f'{name}_engine', engine)
+            print(f"✅ Compiled {name} inference engine")
+
+
+    @staticmethod
+    def _score_anomalies(detector, scaler, features, model):
+        """Scale and score a feature matrix with one IsolationForest pass"""
+        with stage_timer('scale', model):
+            features_scaled = scaler.transform(features)
+        with stage_timer('detect', model):
+            scores = detector.score_samples(features_scaled)
+
+        # predict() == -1 is exactly score_samples() < offset_, so the
+        # forest only has to be walked once per row
+        is_anomaly = scores < detector.offset_
+        anomaly_score = 1 / (1 + np.exp(scores))
+
+        return is_anomaly, anomaly_score
+
+
+    @staticmethod
+    def _classify_threats(classifier, features, model):
+        """Classify a feature matrix with one RandomForest pass"""
+        with stage_timer('classify', model):
+            probabilities = classifier.predict_proba(features)
+
+        # predict() is the argmax of predict_proba(), so reuse it
+        threat_class = classifier.classes_.take(np.argmax(probabilities, axis=1))
+        confidence = probabilities.max(axis=1)
+
+        return threat_class, confidence
+
+
+    @staticmethod
+    def _classify_with_fallback(fallback, features, model):
+        """Apply a row-wise fallback rule set to a feature matrix"""
+        with stage_timer('classify_rules', model):
+            results = [fallback(row) for row in features]
+        threat_class = np.array([r[0] for r in results], dtype=object)
+        confidence = np.array([r[1] for r in results], dtype=float)
+
+        return threat_class, confidence
 
 
     def _classify_network_threat_fallback(self, features):
@@ -181,6 +415,32 @@ class AnomalyDetector:
         return None, 0.0
 
 
+    def n_features(self, modality):
+        """Width of the feature rows the loaded models of a modality were trained on"""
+        engine = getattr(self, f'{modality}_engine')
+        if engine is not None:
+            return engine.n_features
+        for model in (getattr(self, f'{modality}_detector'), getattr(self, f'{modality}_threat_classifier')):
+            if model is not None:
+                return model.n_features_in_
+        online = getattr(self, f'{modality}_online')
+        if online is not None:
+            return online.n_features
+        return len(NETWORK_FEATURE_NAMES if modality == 'network' else EMAIL_FEATURE_NAMES)
+
+
+    def feature_names(self, modality):
+        """
+        Feature schema of a modality's models
+        Returns: the base feature names, followed by the velocity features for extended-schema models
+        """
+        if modality == 'network':
+            names = NETWORK_FEATURE_NAMES + NETWORK_VELOCITY_FEATURE_NAMES
+        else:
+            names = EMAIL_FEATURE_NAMES + EMAIL_VELOCITY_FEATURE_NAMES
+        return names[:self.n_features(modality)]
+
+
     def save_models(self, path='saved_models/'):
         """Save trained models to disk"""
         os.makedirs(path, exist_ok=True)
@@ -204,6 +464,9 @@ class AnomalyDetector:
 
     def load_models(self, path='saved_models/'):
         """Load trained models from disk"""
+        self.network_engine = None
+        self.email_engine = None
+
         try:
             self.network_detector = joblib.load(f'{path}network_isolation_forest.pkl')
             self.scaler_network = joblib.load(f'{path}network_scaler.pkl')
@@ -229,3 +492,77 @@ class AnomalyDetector:
             print("✅ Email threat classifier loaded")
         except Exception as e:
             print(f"⚠️  Email threat classifier not found - using fallback rules")
+
+
+    def enable_online_detector(self, modality, path='saved_models/online/'):
+        """
+        Serve a modality with a streaming half-space-trees detector that learns
+        from every scored row. Resumes from the checkpoint in path if there is one.
+        """
+        # Same schema as the registry models, so classification sees the same rows
+        n_features = self.n_features(modality)
+        file_path = f'{path}{modality}_half_space_trees.npz'
+        online = HalfSpaceTrees.load(file_path) if os.path.exists(file_path) else None
+        if online is not None and online.n_features == n_features:
+            print(f"✅ {modality.capitalize()} online detector resumed from {file_path}")
+        else:
+            if online is None:
+                print(f"⚠️  No {modality} online detector checkpoint, starting cold")
+            else:
+                print(f"⚠️  {file_path} has {online.n_features} features, the models {n_features} - starting cold")
+            online = HalfSpaceTrees(n_features)
+        setattr(self, f'{modality}_online', online)
+
+
+    def save_online_models(self, path='saved_models/online/'):
+        """Checkpoint the streaming detectors"""
+        os.makedirs(path, exist_ok=True)
+        for modality in ('network', 'email'):
+            online = getattr(self, f'{modality}_online')
+            if online is not None:
+                online.save(f'{path}{modality}_half_space_trees.npz')
+
+
+    def export_compiled_models(self, path='saved_models/'):
+        """Compile the loaded models and write them to one memory-mappable file"""
+        if self.network_engine is None and self.email_engine is None:
+            self.compile_models()
+
+        os.makedirs(path, exist_ok=True)
+        model_store.save_compiled_models(
+            {'network': self.network_engine, 'email': self.email_engine},
+            f'{path}{model_store.COMPILED_MODELS_FILE}'
+        )
+        print(f"Compiled models saved to {path}{model_store.COMPILED_MODELS_FILE}")
+
+
+    def load_compiled_models(self, path='saved_models/'):
+        """
+        Map the compiled models read-only instead of unpickling sklearn estimators.
+        All worker processes share the mapped pages; the file is built from
+        the pickles on first use. A modality whose engine compile_models
+        rejected is not in the file and is served by its pickled estimators.
+        """
+        file_path = f'{path}{model_store.COMPILED_MODELS_FILE}'
+        unpickled = False
+        if not os.path.exists(file_path):
+            print(f"⚠️  {file_path} not found, compiling it from the pickled models")
+            self.load_models(path)
+            self.export_compiled_models(path)
+            unpickled = True
+
+        engines = model_store.load_compiled_models(file_path)
+        if not unpickled and len(engines) < 2:
+            self.load_models(path)
+
+        for name in ('network', 'email'):
+            engine = engines.get(name)
+            setattr(self, f'{name}_engine', engine)
+            if engine is None:
+                if getattr(self, f'{name}_detector') is not None:
+                    print(f"⚠️  No compiled {name} engine in {file_path}, serving the pickled models")
+                continue
+            # Serve from the mapping only; drop any privately unpickled estimators
+            setattr(self, f'{name}_detector', None)
+            setattr(self, f'{name}_threat_classifier', None)
+            print(f"✅ {name.capitalize()} models mapped from {file_path}")
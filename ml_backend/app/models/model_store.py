@@ -0,0 +1,91 @@
+import json
+import os
+import numpy as np
+from app.models.tree_engine import CompiledModel
+
+
+# Single-file layout: magic, header length, JSON header, 64-byte aligned arrays
+MAGIC = b'ADMODEL1'
+ALIGNMENT = 64
+COMPILED_MODELS_FILE = 'compiled_models.bin'
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_compiled_models(engines, path):
+    """
+    Write compiled engines into one memory-mappable file
+    engines: dict of modality name -> CompiledModel
+    """
+    header = {'modalities': {}}
+    blobs = []
+    offset = 0
+
+    for name, engine in engines.items():
+        if engine is None:
+            continue
+        arrays = {}
+        for key, array in engine.arrays.items():
+            array = np.ascontiguousarray(array)
+            offset = _aligned(offset)
+            arrays[key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            blobs.append((offset, array))
+            offset += array.nbytes
+        header['modalities'][name] = {'meta': engine.meta, 'arrays': arrays}
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    # Write next to the target and rename, so readers never map a partial file
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for array_offset, array in blobs:
+            f.seek(data_start + array_offset)
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_compiled_models(path):
+    """
+    Map a compiled model file read-only.
+    Every worker process mapping the same file shares the same physical
+    pages through the OS page cache, so model memory is paid once per host.
+    Returns: dict of modality name -> CompiledModel
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compiled model file")
+        header_length = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_length).decode('utf-8'))
+
+    data_start = _aligned(len(MAGIC) + 8 + header_length)
+    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+
+    engines = {}
+    for name, entry in header['modalities'].items():
+        arrays = {}
+        for key, spec in entry['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape'], dtype=np.int64))
+            start = data_start + spec['offset']
+            view = mapped[start:start + count * dtype.itemsize]
+            arrays[key] = np.ndarray(spec['shape'], dtype=dtype, buffer=view)
+        engines[name] = CompiledModel(arrays, entry['meta'])
+
+    return engines
+
+
+if __name__ == "__main__":
+    # Build saved_models/compiled_models.bin from the pickled sklearn models
+    from app.models.anomaly_detector import AnomalyDetector
+
+    detector = AnomalyDetector()
+    detector.load_models()
+    detector.export_compiled_models()
@@ -0,0 +1,276 @@
+import os
+import threading
+import numpy as np
+
+
+class RunningScaler:
+    """
+    Per-feature mean and standard deviation updated batch by batch
+    (Chan et al. pairwise update of Welford's statistics), so scaling
+    follows the traffic without keeping any of it around.
+    """
+
+    def __init__(self, n_features):
+        self.count = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+
+    def partial_fit(self, X):
+        n = len(X)
+        if n == 0:
+            return self
+        batch_mean = X.mean(axis=0)
+        batch_m2 = ((X - batch_mean) ** 2).sum(axis=0)
+
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        return self
+
+    @property
+    def scale(self):
+        if self.count == 0:
+            return np.ones_like(self.mean)
+        std = np.sqrt(self.m2 / self.count)
+        # Constant features are left unscaled, as StandardScaler does
+        return np.where(std > 0, std, 1.0)
+
+    def transform(self, X):
+        return (X - self.mean) / self.scale
+
+
+class HalfSpaceTrees:
+    """
+    Streaming anomaly detector (Tan, Ting & Liu, "Fast Anomaly Detection
+    for Streaming Data", IJCAI 2011).
+
+    Every tree is a complete binary tree of random axis-aligned half-space
+    splits over the running-scaled features squashed into [0, 1]. Trees
+    count how many events fall in each node during the current window;
+    when a window of `window_size` events closes, its counts become the
+    reference masses used for scoring. A row in a sparsely populated region
+    ends in a low-mass node and scores low. Scoring and updating walk
+    n_trees x max_depth nodes per event, however long the stream runs.
+
+    The anomaly threshold is the `contamination` quantile of recent scores,
+    refreshed once per window, mirroring IsolationForest(contamination=...).
+    Until the first window closes there is no reference yet and no row is
+    flagged.
+    """
+
+    def __init__(self, n_features, n_trees=25, max_depth=10, window_size=250, size_limit=None,
+                 contamination=0.05, score_history=4096, seed=42):
+        self.n_features = n_features
+        self.n_trees = n_trees
+        self.max_depth = max_depth
+        self.window_size = window_size
+        self.size_limit = size_limit if size_limit is not None else max(1, window_size // 10)
+        self.contamination = contamination
+        self.scaler = RunningScaler(n_features)
+
+        self.split_feature, self.split_value = self._build_trees(np.random.default_rng(seed))
+        n_nodes = 2 ** (max_depth + 1) - 1
+        self.reference_mass = np.zeros((n_trees, n_nodes), dtype=np.int32)
+        self.latest_mass = np.zeros((n_trees, n_nodes), dtype=np.int32)
+
+        self.window_fill = 0
+        self.windows_completed = 0
+        self.threshold = 0.0
+        self.score_history = np.zeros(score_history)
+        self.history_size = 0
+        self.history_next = 0
+        self._lock = threading.Lock()
+
+    def _build_trees(self, rng):
+        """Random split feature and the midpoint of the node's workspace along it, per internal node"""
+        n_internal = 2 ** self.max_depth - 1
+        split_feature = rng.integers(0, self.n_features, size=(self.n_trees, n_internal))
+        split_value = np.zeros((self.n_trees, n_internal))
+
+        # Per-tree random workspace enclosing [0, 1], as in the paper
+        s = rng.random((self.n_trees, self.n_features))
+        radius = 2 * np.maximum(s, 1 - s)
+        low, high = s - radius, s + radius
+
+        for t in range(self.n_trees):
+            bounds = [(low[t].copy(), high[t].copy())]
+            for node in range(n_internal):
+                node_low, node_high = bounds[node]
+                q = split_feature[t, node]
+                mid = (node_low[q] + node_high[q]) / 2
+                split_value[t, node] = mid
+                left_high = node_high.copy()
+                left_high[q] = mid
+                right_low = node_low.copy()
+                right_low[q] = mid
+                bounds.append((node_low, left_high))
+                bounds.append((right_low, node_high))
+        return split_feature, split_value
+
+    def _unit(self, X):
+        """Running z-scores squashed into [0, 1]"""
+        return 1 / (1 + np.exp(-self.scaler.transform(X)))
+
+    def _paths(self, U):
+        """Node index per (depth, row, tree) from the root down to the leaf"""
+        n = len(U)
+        n_internal = self.split_value.shape[1]
+        tree_offset = np.arange(self.n_trees) * n_internal
+        row_offset = (np.arange(n) * self.n_features)[:, None]
+        split_feature, split_value, values = self.split_feature.ravel(), self.split_value.ravel(), U.ravel()
+
+        paths = np.zeros((self.max_depth + 1, n, self.n_trees), dtype=np.int64)
+        node = paths[0]
+        for depth in range(self.max_depth):
+            index = tree_offset + node
+            go_right = values.take(row_offset + split_feature.take(index)) > split_value.take(index)
+            node = paths[depth + 1] = 2 * node + 1 + go_right
+        return paths
+
+    def _mass_scores(self, paths):
+        """Sum over trees of r * 2^k at the first node on the path with mass below size_limit (or the leaf)"""
+        mass = self.reference_mass.ravel().take(np.arange(self.n_trees) * self.reference_mass.shape[1] + paths)
+        below = mass < self.size_limit
+        below[-1] = True
+        terminal = np.argmax(below, axis=0)
+        terminal_mass = np.take_along_axis(mass, terminal[None], axis=0)[0]
+        return (terminal_mass * 2.0 ** terminal).sum(axis=1)
+
+    def _count(self, paths):
+        """Add one event to every node on every path"""
+        flat = (np.arange(self.n_trees) * self.latest_mass.shape[1] + paths).ravel()
+        counts = self.latest_mass.reshape(-1)
+        if len(flat) < counts.size // 8:
+            np.add.at(counts, flat, 1)
+        else:
+            counts += np.bincount(flat, minlength=counts.size).astype(np.int32)
+
+    def _close_window(self):
+        self.reference_mass, self.latest_mass = self.latest_mass, self.reference_mass
+        self.latest_mass[:] = 0
+        self.window_fill = 0
+        self.windows_completed += 1
+        if self.history_size:
+            self.threshold = float(np.quantile(self.score_history[:self.history_size], self.contamination))
+
+    def _remember(self, scores):
+        for start in range(0, len(scores), len(self.score_history)):
+            chunk = scores[start:start + len(self.score_history)]
+            idx = (self.history_next + np.arange(len(chunk))) % len(self.score_history)
+            self.score_history[idx] = chunk
+            self.history_next = (self.history_next + len(chunk)) % len(self.score_history)
+            self.history_size = min(self.history_size + len(chunk), len(self.score_history))
+
+    def _segments(self, n):
+        """Split n rows at window boundaries so each window closes exactly on time"""
+        start = 0
+        while start < n:
+            end = min(n, start + self.window_size - self.window_fill)
+            yield start, end
+            start = end
+
+    def partial_fit(self, X):
+        """Learn from rows without scoring them, e.g. to seed the detector from history"""
+        X = np.asarray(X, dtype=np.float64)
+        with self._lock:
+            for start, end in self._segments(len(X)):
+                segment = X[start:end]
+                self.scaler.partial_fit(segment)
+                paths = self._paths(self._unit(segment))
+                if self.windows_completed:
+                    self._remember(self._mass_scores(paths))
+                self._count(paths)
+                self.window_fill += end - start
+                if self.window_fill == self.window_size:
+                    self._close_window()
+        return self
+
+    def score_samples(self, X):
+        """Raw mass scores against the current reference window; lower is more anomalous"""
+        X = np.asarray(X, dtype=np.float64)
+        with self._lock:
+            return self._mass_scores(self._paths(self._unit(X)))
+
+    def predict_and_update(self, X):
+        """
+        Score rows against the current reference, then learn from them
+        Returns: (is_anomaly array, anomaly_score array in (0, 1), 0.5 at the threshold)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        scores = np.zeros(len(X))
+        ready = np.zeros(len(X), dtype=bool)
+
+        with self._lock:
+            for start, end in self._segments(len(X)):
+                segment = X[start:end]
+                paths = self._paths(self._unit(segment))
+                if self.windows_completed:
+                    scores[start:end] = self._mass_scores(paths)
+                    ready[start:end] = True
+                    self._remember(scores[start:end])
+                self.scaler.partial_fit(segment)
+                self._count(paths)
+                self.window_fill += end - start
+                if self.window_fill == self.window_size:
+                    self._close_window()
+            threshold = self.threshold
+
+        is_anomaly = ready & (scores < threshold)
+        anomaly_score = np.where(ready, (threshold + 1) / (threshold + scores + 2), 0.0)
+        return is_anomaly, anomaly_score
+
+    def save(self, file_path):
+        """Checkpoint the full detector state to one .npz file, replaced atomically"""
+        with self._lock:
+            state = {
+                'params': np.array([self.n_features, self.n_trees, self.max_depth, self.window_size,
+                                    self.size_limit, self.window_fill, self.windows_completed,
+                                    self.history_size, self.history_next]),
+                'contamination': np.array(self.contamination),
+                'threshold': np.array(self.threshold),
+                'split_feature': self.split_feature,
+                'split_value': self.split_value,
+                'reference_mass': self.reference_mass,
+                'latest_mass': self.latest_mass,
+                'score_history': self.score_history,
+                'scaler': np.array([self.scaler.count]),
+                'scaler_mean': self.scaler.mean,
+                'scaler_m2': self.scaler.m2,
+            }
+            tmp_path = f'{file_path}.tmp-{os.getpid()}'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **state)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as state:
+            (n_features, n_trees, max_depth, window_size, size_limit, window_fill,
+             windows_completed, history_size, history_next) = (int(v) for v in state['params'])
+            detector = cls.__new__(cls)
+            detector.n_features = n_features
+            detector.n_trees = n_trees
+            detector.max_depth = max_depth
+            detector.window_size = window_size
+            detector.size_limit = size_limit
+            detector.contamination = float(state['contamination'])
+            detector.threshold = float(state['threshold'])
+            detector.split_feature = state['split_feature']
+            detector.split_value = state['split_value']
+            detector.reference_mass = state['reference_mass']
+            detector.latest_mass = state['latest_mass']
+            detector.score_history = state['score_history']
+            detector.window_fill = window_fill
+            detector.windows_completed = windows_completed
+            detector.history_size = history_size
+            detector.history_next = history_next
+            detector.scaler = RunningScaler(n_features)
+            detector.scaler.count = int(state['scaler'][0])
+            detector.scaler.mean = state['scaler_mean']
+            detector.scaler.m2 = state['scaler_m2']
+            detector._lock = threading.Lock()
+        return detector
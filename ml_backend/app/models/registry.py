@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+from app.models.anomaly_detector import AnomalyDetector, NETWORK_FEATURE_NAMES, EMAIL_FEATURE_NAMES
+from app.models.tree_engine import probe_rows
+
+
+MANIFEST_FILE = 'manifest.json'
+ACTIVE_FILE = 'ACTIVE'
+LEGACY_VERSION = 'legacy'
+
+
+def _sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(file_path, text):
+    """Replace a small text file in one rename so readers never see half of it"""
+    tmp_path = f'{file_path}.tmp-{os.getpid()}-{threading.get_ident()}'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+class ModelRegistry:
+    """
+    Versioned model storage under saved_models/registry/.
+
+    Every version is a directory with the model files and a manifest
+    (version, checksums, feature schema, training metadata). Versions are
+    written to a temporary directory and renamed into place, and the
+    ACTIVE file naming the served version is replaced atomically.
+    """
+
+    def __init__(self, root='saved_models/registry/', legacy_path='saved_models/'):
+        self.root = root if root.endswith('/') else f'{root}/'
+        self.legacy_path = legacy_path
+
+    def version_path(self, version):
+        if version == LEGACY_VERSION:
+            return self.legacy_path
+        return f'{self.root}{version}/'
+
+    def list_versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(f'{self.root}{name}/{MANIFEST_FILE}')
+        )
+
+    def active_version(self):
+        """Version named by the ACTIVE file, or 'legacy' for the flat saved_models/ layout"""
+        try:
+            with open(f'{self.root}{ACTIVE_FILE}') as f:
+                return f.read().strip() or LEGACY_VERSION
+        except FileNotFoundError:
+            return LEGACY_VERSION
+
+    def manifest(self, version):
+        if version == LEGACY_VERSION:
+            return {'version': LEGACY_VERSION}
+        with open(f'{self.root}{version}/{MANIFEST_FILE}') as f:
+            return json.load(f)
+
+    def publish(self, detector, training_metadata=None, activate=True):
+        """Save a trained detector as a new version and optionally activate it"""
+        os.makedirs(self.root, exist_ok=True)
+        version = datetime.now().strftime('v%Y%m%d-%H%M%S')
+        suffix = 1
+        while os.path.exists(self.version_path(version)):
+            suffix += 1
+            version = f"{datetime.now().strftime('v%Y%m%d-%H%M%S')}-{suffix}"
+
+        tmp_path = f'{self.root}.tmp-{version}/'
+        detector.save_models(tmp_path)
+        # Written now rather than on the first mmap load, so the checksums cover it
+        detector.export_compiled_models(tmp_path)
+
+        manifest = {
+            'version': version,
+            'created_at': datetime.now().isoformat(),
+            'files': {
+                name: _sha256(f'{tmp_path}{name}')
+                for name in sorted(os.listdir(tmp_path))
+            },
+            'feature_schema': {
+                'network': detector.feature_names('network'),
+                'email': detector.feature_names('email'),
+            },
+            'training': training_metadata or {},
+        }
+        with open(f'{tmp_path}{MANIFEST_FILE}', 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        os.rename(tmp_path, self.version_path(version))
+        print(f"Published model version {version}")
+
+        if activate:
+            self.activate(version)
+        return version
+
+    def check_version(self, version):
+        if version != LEGACY_VERSION and version not in self.list_versions():
+            raise ValueError(f"Unknown model version: {version}")
+
+    def activate(self, version):
+        """Point ACTIVE at an existing version"""
+        self.check_version(version)
+        os.makedirs(self.root, exist_ok=True)
+        _write_atomic(f'{self.root}{ACTIVE_FILE}', version)
+
+    def verify(self, version):
+        """Check every file of a version against its manifest checksums"""
+        if version == LEGACY_VERSION:
+            return
+        path = self.version_path(version)
+        for name, checksum in self.manifest(version)['files'].items():
+            if _sha256(f'{path}{name}') != checksum:
+                raise ValueError(f"Checksum mismatch for {name} in model version {version}")
+
+    def remove(self, version):
+        if version == self.active_version():
+            raise ValueError("Cannot remove the active model version")
+        shutil.rmtree(self.version_path(version))
+
+
+class ActiveModels:
+    """
+    Holds the detector serving requests and swaps it atomically on reload.
+
+    Request paths read `detector` once per batch, so in-flight work keeps
+    the version it started with while new work picks up the new one.
+    """
+
+    def __init__(self, registry, model_format='pickle', inference_engine='sklearn', engine_max_batch=256,
+                 online_modalities=(), online_path='saved_models/online/', velocity=False):
+        self.registry = registry
+        self.model_format = model_format
+        self.inference_engine = inference_engine
+        self.engine_max_batch = engine_max_batch
+        # Modalities detected by streaming detectors, which outlive model versions
+        self.online_modalities = tuple(online_modalities)
+        self.online_path = online_path
+        # Whether request paths append the velocity features extended-schema models need
+        self.velocity = velocity
+        self.detector = None
+        self.version = None
+        self.loaded_at = None
+        self.on_swap = []
+        self._reload_lock = asyncio.Lock()
+
+    def _build(self, version):
+        """Load, verify and warm up one version; runs off the event loop"""
+        self.registry.verify(version)
+        path = self.registry.version_path(version)
+
+        detector = AnomalyDetector()
+        if self.model_format == 'mmap':
+            # Every uvicorn worker maps the same read-only model file
+            detector.load_compiled_models(path)
+        else:
+            detector.load_models(path)
+            if self.inference_engine == 'compiled':
+                detector.compile_models(max_batch=self.engine_max_batch)
+
+        if not self.velocity and (detector.n_features('network') > len(NETWORK_FEATURE_NAMES)
+                                  or detector.n_features('email') > len(EMAIL_FEATURE_NAMES)):
+            raise ValueError(f"Model version {version} uses velocity features; set ML_VELOCITY_FEATURES=true")
+
+        for modality in self.online_modalities:
+            previous = getattr(self.detector, f'{modality}_online', None)
+            if previous is not None:
+                # Keep learning where the serving detector left off
+                setattr(detector, f'{modality}_online', previous)
+            else:
+                detector.enable_online_detector(modality, self.online_path)
+
+        self._warm_up(detector)
+        return detector
+
+    @staticmethod
+    def _warm_up(detector):
+        """
+        Score a few synthetic rows so the first real request is not the slow one.
+        The estimators are called directly: score_*_batch would count these
+        rows in the prediction metrics and stage latencies.
+        """
+        for scaler, engine, model, classifier, online in [
+            (detector.scaler_network, detector.network_engine, detector.network_detector,
+             detector.network_threat_classifier, detector.network_online),
+            (detector.scaler_email, detector.email_engine, detector.email_detector,
+             detector.email_threat_classifier, detector.email_online),
+        ]:
+            # Online detectors learn from what they score, so they never see synthetic rows
+            if (engine is None and model is None) or online is not None:
+                continue
+            n_features = engine.n_features if engine is not None else model.n_features_in_
+            rows = probe_rows(scaler if model is not None else None, n_features, n_samples=64)
+            for batch in (rows[:1], rows):
+                if engine is not None:
+                    engine.predict(batch)
+                    continue
+                model.score_samples(scaler.transform(batch))
+                if classifier is not None:
+                    classifier.predict_proba(batch)
+
+    def load(self, version=None):
+        """Blocking load used at startup"""
+        version = version or self.registry.active_version()
+        self._swap(self._build(version), version)
+
+    async def reload(self, version=None, activate=False):
+        """
+        Load a version in the background, warm it up, then swap it in.
+        With activate, ACTIVE is pointed at the version only once it is
+        serving, so a version that fails to verify or load is never recorded.
+        """
+        async with self._reload_lock:
+            version = version or self.registry.active_version()
+            if activate:
+                self.registry.check_version(version)
+            detector = await asyncio.to_thread(self._build, version)
+            self._swap(detector, version)
+            if activate:
+                self.registry.activate(version)
+        return self.version
+
+    def _swap(self, detector, version):
+        # Readers that need both take version first: a new detector under the
+        # old version label is harmless, the other way round is not
+        self.detector = detector
+        self.version = version
+        self.loaded_at = datetime.now()
+        for callback in self.on_swap:
+            callback(version)
+        print(f"✅ Serving model version {version}")
+
+    def checkpoint(self):
+        """Save the streaming detectors' state next to the model versions"""
+        if self.online_modalities and self.detector is not None:
+            self.detector.save_online_models(self.online_path)
+
+    async def checkpoint_every(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.checkpoint)
+            except Exception as e:
+                print(f"⚠️  Online detector checkpoint failed: {e}")
+
+    async def watch(self, interval):
+        """Reload whenever the registry's ACTIVE version changes"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.registry.active_version() != self.version:
+                    await self.reload()
+            except Exception as e:
+                print(f"⚠️  Model reload failed, still serving {self.version}: {e}")
@@ -45,7 +45,24 @@ class AnomalyPrediction(BaseModel):
     confidence: float
     timestamp: datetime
     details: Optional[str] = None
+    # Per-user baseline context (/predict/batch with user baselines enabled, once the user has enough history)
+    user_score_percentile: Optional[float] = None
+    user_max_zscore: Optional[float] = None
 
 # Batch Prediction Request
 class BatchPredictionRequest(BaseModel):
     data: List[CombinedFeatures]
+
+# Alerts selected for bulk triage: those matching every given field
+class AlertFilter(BaseModel):
+    threat_class: Optional[str] = None
+    source_ip: Optional[str] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    score_below: Optional[float] = None
+    reviewed: Optional[bool] = None
+
+# Bulk triage request: either explicit alert IDs or a filter
+class BulkTriageRequest(BaseModel):
+    ids: Optional[List[str]] = None
+    filter: Optional[AlertFilter] = None
@@ -0,0 +1,273 @@
+import numpy as np
+
+
+# Rows walked at once; bounds the (rows x trees) index arrays
+CHUNK_SIZE = 4096
+
+
+def _average_path_length(n_samples):
+    """Average path length of an unsuccessful BST search (same as sklearn's iForest)"""
+    n_samples = np.asarray(n_samples, dtype=float)
+    path_length = np.zeros_like(n_samples)
+
+    path_length[n_samples == 2] = 1.0
+    deep = n_samples > 2
+    path_length[deep] = (
+        2.0 * (np.log(n_samples[deep] - 1.0) + np.euler_gamma)
+        - 2.0 * (n_samples[deep] - 1.0) / n_samples[deep]
+    )
+    return path_length
+
+
+def _scaler_params(scaler, n_features):
+    """Return (mean, scale) of a fitted StandardScaler, identity if unused"""
+    mean = getattr(scaler, 'mean_', None) if scaler is not None else None
+    scale = getattr(scaler, 'scale_', None) if scaler is not None else None
+    mean = np.zeros(n_features) if mean is None else np.asarray(mean, dtype=float)
+    scale = np.ones(n_features) if scale is None else np.asarray(scale, dtype=float)
+    return mean, scale
+
+
+class _NodeArrays:
+    """Accumulates the nodes of several trees into one flat array set"""
+
+    def __init__(self):
+        self.feature = []
+        self.threshold = []
+        self.left = []
+        self.right = []
+        self.roots = []
+        self.max_depth = 0
+        self.n_nodes = 0
+
+    def add_tree(self, tree, feature_map, mean, scale, column_offset):
+        """
+        Append one sklearn tree_ structure
+        feature_map: tree feature index -> input column
+        mean, scale: StandardScaler parameters folded into the thresholds
+        column_offset: which copy of the input matrix the tree reads
+        """
+        offset = self.n_nodes
+        n_nodes = tree.node_count
+        is_leaf = tree.children_left == -1
+        node_ids = np.arange(n_nodes) + offset
+
+        feature = np.where(is_leaf, 0, feature_map[np.maximum(tree.feature, 0)])
+        # Split on raw values: (x - mean) / scale <= t  <=>  x <= t * scale + mean
+        threshold = tree.threshold * scale[feature] + mean[feature]
+
+        # Leaves point at themselves with an always-true split, so every tree
+        # can be walked for the same number of steps
+        self.feature.append(feature + column_offset)
+        self.threshold.append(np.where(is_leaf, np.inf, threshold))
+        self.left.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+        self.right.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+        self.roots.append(offset)
+
+        self.max_depth = max(self.max_depth, tree.max_depth)
+        self.n_nodes += n_nodes
+        return offset
+
+    def finish(self):
+        """Concatenate everything into contiguous NumPy arrays"""
+        # Interleaved (left, right) pairs so one gather picks the next node
+        children = np.column_stack([np.concatenate(self.left), np.concatenate(self.right)])
+        return {
+            'feature': np.concatenate(self.feature).astype(np.int64),
+            'threshold': np.concatenate(self.threshold).astype(np.float64),
+            'children': children.ravel().astype(np.int64),
+            'roots': np.asarray(self.roots, dtype=np.int64),
+        }
+
+
+def _node_depths(tree):
+    """Depth of every node of an sklearn tree_ structure"""
+    depth = np.zeros(tree.node_count, dtype=float)
+    for node in range(tree.node_count):
+        for child in (tree.children_left[node], tree.children_right[node]):
+            if child != -1:
+                depth[child] = depth[node] + 1
+    return depth
+
+
+class CompiledModel:
+    """
+    Array-backed inference engine for one modality.
+
+    Compiles a fitted IsolationForest (with its StandardScaler folded into the
+    split thresholds) and an optional RandomForestClassifier into flat node
+    arrays, so that the anomaly label, anomaly score and class probabilities
+    all come out of a single walk over every tree.
+    """
+
+    def __init__(self, arrays, meta):
+        # Arrays are only ever read, so they may be read-only memory maps
+        self.arrays = arrays
+        self.meta = meta
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.children = arrays['children']
+        self.roots = arrays['roots']
+        self.path_length = arrays['path_length']
+        self.proba = arrays.get('proba')
+
+        self.n_features = meta['n_features']
+        self.n_detector_trees = meta['n_detector_trees']
+        self.max_depth = meta['max_depth']
+        self.score_denominator = meta['score_denominator']
+        self.offset = meta['offset']
+        self.proba_offset = meta.get('proba_offset', 0)
+        self.classes = np.asarray(meta['classes'], dtype=object) if meta.get('classes') is not None else None
+
+    @classmethod
+    def from_sklearn(cls, detector, scaler, classifier=None):
+        """Compile fitted sklearn estimators into a CompiledModel"""
+        n_features = detector.n_features_in_
+        mean, scale = _scaler_params(scaler, n_features)
+        nodes = _NodeArrays()
+        path_length = []
+
+        # sklearn only re-indexes columns when each tree saw a feature subset
+        max_features = getattr(detector, '_max_features', n_features)
+        identity = np.arange(n_features)
+        for tree, features in zip(detector.estimators_, detector.estimators_features_):
+            feature_map = np.asarray(features) if max_features != n_features else identity
+            nodes.add_tree(tree.tree_, feature_map, mean, scale, column_offset=0)
+
+            # Path length credited to a row that ends in each leaf
+            n_samples = tree.tree_.n_node_samples
+            path_length.append(_node_depths(tree.tree_) + _average_path_length(n_samples))
+
+        meta = {
+            'n_features': n_features,
+            'n_detector_trees': len(detector.estimators_),
+            'score_denominator': float(len(detector.estimators_) * _average_path_length([detector.max_samples_])[0]),
+            'offset': float(detector.offset_),
+        }
+
+        proba = None
+        if classifier is not None:
+            meta['proba_offset'] = nodes.n_nodes
+            meta['classes'] = [c.item() if hasattr(c, 'item') else c for c in classifier.classes_]
+            proba = []
+            no_scaling = (np.zeros(n_features), np.ones(n_features))
+            for tree in classifier.estimators_:
+                # The classifier is trained on unscaled features, read from the
+                # float32-rounded copy of the input like sklearn does
+                nodes.add_tree(tree.tree_, identity, *no_scaling, column_offset=n_features)
+                value = tree.tree_.value[:, 0, :]
+                proba.append(value / np.maximum(value.sum(axis=1, keepdims=True), 1e-300))
+                path_length.append(np.zeros(tree.tree_.node_count))
+            proba = np.concatenate(proba)
+
+        arrays = nodes.finish()
+        arrays['path_length'] = np.concatenate(path_length)
+        if proba is not None:
+            arrays['proba'] = proba
+        meta['max_depth'] = nodes.max_depth
+        return cls(arrays, meta)
+
+    @property
+    def has_classifier(self):
+        return self.proba is not None
+
+    def _walk(self, features):
+        """Walk every tree in lockstep; returns the leaf index per (row, tree)"""
+        X = features
+        if self.has_classifier:
+            X = np.hstack([X, X.astype(np.float32).astype(np.float64)])
+
+        # Flat gathers with take() are much cheaper than 2D fancy indexing
+        values = X.ravel()
+        row_base = (np.arange(len(X)) * X.shape[1])[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.max_depth):
+            go_right = values.take(row_base + self.feature.take(nodes)) > self.threshold.take(nodes)
+            nodes = self.children.take(2 * nodes + go_right)
+        return nodes
+
+    def predict(self, features):
+        """
+        Score one row or a batch in a single traversal
+        Returns: (is_anomaly, anomaly_score, threat_class, probabilities)
+        threat_class and probabilities are None without a classifier
+        """
+        features = np.asarray(features, dtype=np.float64).reshape(-1, self.n_features)
+        if len(features) <= CHUNK_SIZE:
+            return self._predict_chunk(features)
+
+        # Bound the (rows x trees) working arrays on large batches
+        parts = [self._predict_chunk(features[i:i + CHUNK_SIZE]) for i in range(0, len(features), CHUNK_SIZE)]
+        return tuple(
+            np.concatenate(column) if column[0] is not None else None
+            for column in zip(*parts)
+        )
+
+    def _predict_chunk(self, features):
+        leaves = self._walk(features)
+        detector_leaves = leaves[:, :self.n_detector_trees]
+
+        depths = self.path_length[detector_leaves].sum(axis=1)
+        if self.score_denominator:
+            scores = -(2 ** (-depths / self.score_denominator))
+        else:
+            scores = -np.ones(len(leaves))
+
+        is_anomaly = scores < self.offset
+        anomaly_score = 1 / (1 + np.exp(scores))
+
+        threat_class = probabilities = None
+        if self.has_classifier:
+            classifier_leaves = leaves[:, self.n_detector_trees:] - self.proba_offset
+            probabilities = self.proba[classifier_leaves].mean(axis=1)
+            threat_class = self.classes.take(np.argmax(probabilities, axis=1))
+
+        return is_anomaly, anomaly_score, threat_class, probabilities
+
+
+def probe_rows(scaler, n_features, n_samples=2000, seed=0):
+    """Synthetic rows spread around the training distribution"""
+    rng = np.random.default_rng(seed)
+    mean, scale = _scaler_params(scaler, n_features)
+    X = mean + scale * rng.standard_normal((n_samples, n_features)) * 3
+    # Integer-valued columns are common (ports, counts), include exact values
+    X[: n_samples // 2] = np.round(X[: n_samples // 2])
+    return X
+
+
+def check_equivalence(model, detector, scaler, classifier, features):
+    """
+    Compare a CompiledModel against the sklearn estimators it came from
+    Returns: dict of agreement rates and maximum absolute differences
+    """
+    is_anomaly, anomaly_score, threat_class, probabilities = model.predict(features)
+
+    features_scaled = scaler.transform(features)
+    expected_score = detector.score_samples(features_scaled)
+    expected_anomaly = detector.predict(features_scaled) == -1
+
+    report = {
+        'label_agreement': float(np.mean(is_anomaly == expected_anomaly)),
+        'max_score_diff': float(np.max(np.abs(anomaly_score - 1 / (1 + np.exp(expected_score))))),
+    }
+
+    if classifier is not None:
+        expected_proba = classifier.predict_proba(features)
+        report['class_agreement'] = float(np.mean(threat_class == classifier.predict(features)))
+        report['max_proba_diff'] = float(np.max(np.abs(probabilities - expected_proba)))
+
+    return report
+
+
+def is_equivalent(report, min_agreement=0.999, tolerance=1e-6):
+    """
+    Decide whether an equivalence report is good enough to serve from.
+    Folding the scaler into the thresholds can flip a row that sits exactly
+    on a split, hence agreement rather than bit-exactness on the labels.
+    tolerance: largest anomaly score and class probability difference allowed
+    """
+    if report['label_agreement'] < min_agreement or report['max_score_diff'] > tolerance:
+        return False
+    if 'class_agreement' in report:
+        return report['class_agreement'] >= min_agreement and report['max_proba_diff'] <= tolerance
+    return True
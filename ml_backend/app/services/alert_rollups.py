@@ -0,0 +1,244 @@
+import asyncio
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from app.services.metrics import REGISTRY, Counter
+
+
+ROLLUP_FLUSHES = REGISTRY.register(Counter(
+    'ml_alert_rollup_flushes_total', 'Alert rollup flushes to MongoDB, by outcome', ('outcome',)))
+
+# Field naming the actor an alert is attributed to in the top-N lists
+ROLLUP_KEYS = {'network': 'source_ip', 'email': 'sender_email'}
+
+# Alert fields the rollups are computed from
+ROLLUP_FIELDS = ('timestamp', 'is_anomaly', 'threat_class', 'reviewed', 'source_ip', 'sender_email')
+
+# Only stored alerts the detector flagged are counted
+COUNTED = {'is_anomaly': True}
+
+# Rollups of alerts the classifier gave no threat class
+UNCLASSIFIED = 'unclassified'
+
+_EPOCH = datetime(1970, 1, 1)
+_HOUR = 3600
+
+
+def hour_bucket(seconds):
+    """Start of the hour holding a wall-clock time in seconds since 1970-01-01"""
+    return _EPOCH + timedelta(seconds=int(seconds) // _HOUR * _HOUR)
+
+
+def document_seconds(timestamp):
+    """Seconds since 1970-01-01 of a stored alert's timestamp (BSON dates come back as naive UTC)"""
+    return (timestamp.replace(tzinfo=None) - _EPOCH) // timedelta(seconds=1)
+
+
+class AlertRollups:
+    """
+    Counts of the stored anomalies (is_anomaly: true) pre-aggregated per
+    hour bucket, so dashboard statistics cost depends on the time range
+    shown rather than on the alert history.
+
+    Three MongoDB collections hold the rollups:
+    - counts: one document per (modality, hour, threat class, reviewed state)
+    - keys: one document per (modality, hour, source IP or sender)
+    - state: per modality, the _id up to which stored alerts are counted
+    ingest() counts alerts the Node backend stored since that _id, and
+    triage records signed deltas for alerts already counted; deltas wait
+    in memory (from any thread) until flush() folds them in with one
+    unordered batch of $inc upserts per collection, so several workers can
+    share the rollups. Deltas that cannot be flushed are kept, the
+    per-actor ones up to `max_pending_keys`.
+    """
+
+    def __init__(self, max_pending_keys=100000):
+        self.max_pending_keys = max_pending_keys
+        self.dropped_keys = 0
+        self._counts = defaultdict(int)
+        self._keys = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, modality, alerts, sign=1):
+        """Count alerts given as (seconds, threat class, actor key, reviewed); sign=-1 takes them back out"""
+        with self._lock:
+            for seconds, threat_class, key, reviewed in alerts:
+                hour = hour_bucket(seconds)
+                self._counts[modality, hour, str(threat_class) if threat_class else UNCLASSIFIED, bool(reviewed)] += sign
+                if key is None:
+                    continue
+                if (modality, hour, key) not in self._keys and len(self._keys) >= self.max_pending_keys:
+                    self.dropped_keys += 1
+                    continue
+                self._keys[modality, hour, key] += sign
+
+    def add_documents(self, modality, alerts, sign=1, reviewed=None):
+        """
+        add() for stored alert documents (ROLLUP_FIELDS), optionally as if their reviewed
+        state were `reviewed`; documents that are not anomalies are skipped
+        """
+        key = ROLLUP_KEYS[modality]
+        self.add(modality, [
+            (document_seconds(alert['timestamp']), alert.get('threat_class'), alert.get(key),
+             alert.get('reviewed') is True if reviewed is None else reviewed)
+            for alert in alerts if alert.get('is_anomaly') is True
+        ], sign)
+
+    def pending(self):
+        return len(self._counts) + len(self._keys)
+
+    async def flush(self, collections):
+        """Fold the pending deltas into the rollup collections ({'counts': ..., 'keys': ...})"""
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+            keys, self._keys = self._keys, defaultdict(int)
+
+        count_writes = [
+            UpdateOne(
+                {'_id': f'{modality}|{hour:%Y-%m-%dT%H}|{threat_class}|{int(reviewed)}'},
+                {'$inc': {'count': delta}, '$setOnInsert': {
+                    'modality': modality, 'hour': hour, 'threat_class': threat_class, 'reviewed': reviewed
+                }},
+                upsert=True
+            )
+            for (modality, hour, threat_class, reviewed), delta in counts.items() if delta
+        ]
+        key_writes = [
+            UpdateOne(
+                {'_id': f'{modality}|{hour:%Y-%m-%dT%H}|{key}'},
+                {'$inc': {'count': delta}, '$setOnInsert': {'modality': modality, 'hour': hour, 'key': key}},
+                upsert=True
+            )
+            for (modality, hour, key), delta in keys.items() if delta
+        ]
+        try:
+            await asyncio.gather(*(
+                collections[name].bulk_write(writes, ordered=False)
+                for name, writes in (('counts', count_writes), ('keys', key_writes)) if writes
+            ))
+        except Exception:
+            # Unordered $inc upserts are not idempotent; keep the deltas and let the backfill
+            # job repair the rollups if a partially applied batch is ever retried
+            with self._lock:
+                for key, delta in counts.items():
+                    self._counts[key] += delta
+                for key, delta in keys.items():
+                    if key in self._keys or len(self._keys) < self.max_pending_keys:
+                        self._keys[key] += delta
+                    else:
+                        self.dropped_keys += 1
+            ROLLUP_FLUSHES.inc(1, 'failed')
+            raise
+        ROLLUP_FLUSHES.inc(1, 'ok')
+        return len(count_writes) + len(key_writes)
+
+    @staticmethod
+    async def counted_upto(collections, modality):
+        """_id up to which a modality's stored alerts are counted, or None before the first ingest"""
+        state = await collections['state'].find_one({'_id': modality})
+        return state['after'] if state else None
+
+    @staticmethod
+    async def _claim(state, modality, after, upto):
+        """Move a modality's watermark from `after` to `upto`; False if another worker moved it first"""
+        if after is None:
+            try:
+                await state.insert_one({'_id': modality, 'after': upto})
+                return True
+            except DuplicateKeyError:
+                return False
+        result = await state.update_one({'_id': modality, 'after': after}, {'$set': {'after': upto}})
+        return result.matched_count == 1
+
+    async def ingest(self, alerts, collections, lag=60, batch_rows=10000):
+        """
+        Count the anomalies stored in the alert collections ({modality: collection})
+        since the last ingest, at most `batch_rows` per modality, then flush.
+        Alerts are walked in _id order up to `lag` seconds ago: the Node
+        backend inserts an event before scoring it and sets is_anomaly
+        afterwards, so the lag must outlast that round trip. Each
+        range is claimed by moving the watermark with a compare-and-set, so
+        workers ingesting at once never count an alert twice.
+        Returns: {modality: alerts counted}
+        """
+        upto = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=lag))
+        counted = dict.fromkeys(alerts, 0)
+        for modality, collection in alerts.items():
+            after = await self.counted_upto(collections, modality)
+            if after is not None and after >= upto:
+                continue
+            window = {'$lt': upto} if after is None else {'$gt': after, '$lt': upto}
+            batch = await collection.find({'_id': window, **COUNTED}, list(ROLLUP_FIELDS)) \
+                .sort('_id', 1).limit(batch_rows).to_list(length=batch_rows)
+            # A full batch may not be the end of the range: resume after its last alert
+            end = batch[-1]['_id'] if len(batch) == batch_rows else upto
+            if await self._claim(collections['state'], modality, after, end):
+                self.add_documents(modality, batch)
+                counted[modality] = len(batch)
+        await self.flush(collections)
+        return counted
+
+    async def ingest_every(self, alerts, collections, interval, lag=60):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.ingest(alerts, collections, lag)
+            except Exception as e:
+                print(f"⚠️  Alert rollup update failed: {e}")
+
+    @staticmethod
+    async def summary(collections, since, until, top=10):
+        """
+        Dashboard statistics over the hour buckets overlapping [since, until)
+        Returns: dict of totals per modality, threat class, reviewed state and
+        hour, and the `top` source IPs and senders
+        """
+        window = {'hour': {'$gte': hour_bucket(document_seconds(since)), '$lt': until}}
+        rows = await collections['counts'].find(window, {'_id': 0}).to_list(length=None)
+
+        async def top_keys(modality):
+            pipeline = [
+                {'$match': {'modality': modality, **window}},
+                {'$group': {'_id': '$key', 'count': {'$sum': '$count'}}},
+                {'$match': {'count': {'$gt': 0}}},
+                {'$sort': {'count': -1, '_id': 1}},
+                {'$limit': top},
+            ]
+            groups = await collections['keys'].aggregate(pipeline).to_list(length=top)
+            return [{"key": group['_id'], "count": group['count']} for group in groups]
+
+        sources, senders = await asyncio.gather(top_keys('network'), top_keys('email'))
+
+        by_modality, by_threat_class, by_hour = defaultdict(int), defaultdict(int), defaultdict(int)
+        by_reviewed = {"reviewed": 0, "unreviewed": 0}
+        for row in rows:
+            count = row['count']
+            if not count:
+                continue
+            by_modality[row['modality']] += count
+            by_threat_class[row['threat_class']] += count
+            by_reviewed["reviewed" if row['reviewed'] else "unreviewed"] += count
+            by_hour[row['hour']] += count
+
+        return {
+            "since": since,
+            "until": until,
+            "total": sum(by_modality.values()),
+            "by_modality": dict(by_modality),
+            "by_threat_class": dict(sorted(by_threat_class.items(), key=lambda item: -item[1])),
+            "by_reviewed": by_reviewed,
+            "by_hour": [{"hour": hour, "count": count} for hour, count in sorted(by_hour.items())],
+            "top_source_ips": sources,
+            "top_senders": senders,
+        }
+
+    def stats(self):
+        return {
+            "pending": self.pending(),
+            "dropped_keys": self.dropped_keys,
+            "flushes": ROLLUP_FLUSHES.value('ok'),
+            "failed_flushes": ROLLUP_FLUSHES.value('failed'),
+        }
@@ -0,0 +1,145 @@
+import asyncio
+import time
+import numpy as np
+from app.services.inference_pool import OverloadedError
+from app.services.metrics import STAGE_LATENCY
+
+
+class QueueFullError(OverloadedError):
+    """Raised when a batcher has no room left for another request"""
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-row predictions into one feature matrix.
+
+    Requests are queued until either max_batch_size rows are waiting or
+    max_wait_ms has passed since the first one arrived; the batch is then
+    scored in one call and every caller gets back its own row.
+
+    With an InferencePool, batches are scored on the pool and up to one
+    batch per pool worker is in flight; while all of them are busy the
+    queue absorbs the burst and then sheds load with QueueFullError.
+    """
+
+    def __init__(self, score_batch, max_batch_size=64, max_wait_ms=2.0, max_queue=1024, pool=None, name='model'):
+        self.score_batch = score_batch
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.pool = pool
+        self.rejected = 0
+        self._queue = None
+        self._worker = None
+        self._slots = None
+        self._in_flight = set()
+
+    def start(self):
+        """Start the background worker on the running event loop"""
+        if self._worker is not None and not self._worker.done():
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._slots = asyncio.Semaphore(self.pool.workers if self.pool is not None else 1)
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the worker and fail whatever is still queued"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        # Let batches already handed to the pool finish
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped"))
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, features):
+        """Queue one feature row and wait for its prediction"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((features, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            retry_after = self.pool.retry_after if self.pool is not None else 1
+            raise QueueFullError(f"{self.max_queue} predictions already queued", retry_after)
+        return await future
+
+    async def _collect(self):
+        """Wait for the first request, then gather more until the batch is full or the window closes"""
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+
+            # Callers that gave up (client disconnect) are not scored
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            await self._slots.acquire()
+            task = asyncio.get_running_loop().create_task(self._score(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _score(self, batch):
+        dispatched = time.perf_counter()
+        for _, _, enqueued in batch:
+            STAGE_LATENCY.observe(dispatched - enqueued, 'queue_wait', self.name)
+
+        try:
+            features = np.vstack([features for features, _, _ in batch])
+            if self.pool is not None:
+                results = await self.pool.run(self.score_batch, features)
+            else:
+                results = self.score_batch(features)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "batches_in_flight": len(self._in_flight),
+            "rejected": self.rejected,
+        }
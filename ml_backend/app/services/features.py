@@ -0,0 +1,307 @@
+import json
+import re
+from operator import itemgetter
+import numpy as np
+from datetime import datetime
+from pydantic import TypeAdapter, ValidationError
+from app.models.schemas import NetworkFeatures, EmailFeatures
+
+
+# Bodies of at most this many rows are validated row by row with pydantic, which is
+# faster than the columnar path's fixed per-block cost at that size
+PYDANTIC_MAX_ROWS = 32
+
+# ISO 8601 timestamps the columnar path decodes itself; anything else goes through pydantic.
+# ASCII only: \d would also match other scripts' digits, which pydantic rejects
+_ISO_DATETIME = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?\Z', re.ASCII)
+_EPOCH = '1970-01-01T00:00:00'
+_EPOCH_DATETIME = datetime(1970, 1, 1)
+_DATETIME = TypeAdapter(datetime)
+_ZERO = ord('0')
+_MONTH_LENGTHS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+# JSON values the columnar path converts itself; strings and the rest go through pydantic
+_NUMBER_TYPES = (int, float, bool)
+
+# Numeric fields in feature-matrix order, with how pydantic would read them
+NETWORK_NUMBERS = (
+    ('packet_size', 'float'), ('connection_duration', 'float'), ('port_number', 'int'),
+    ('packets_sent', 'int'), ('packets_received', 'int'), ('bytes_sent', 'float'), ('bytes_received', 'float'),
+)
+EMAIL_NUMBERS = (
+    ('num_recipients', 'int'), ('email_size', 'float'), ('has_attachment', 'bool'), ('num_attachments', 'int'),
+    ('subject_length', 'int'), ('body_length', 'int'), ('is_reply', 'bool'), ('is_forward', 'bool'),
+)
+
+
+def extract_network_features(data: NetworkFeatures):
+    """Convert NetworkFeatures to numpy array"""
+    return np.array([
+        data.packet_size,
+        data.connection_duration,
+        data.port_number,
+        data.packets_sent,
+        data.packets_received,
+        data.bytes_sent,
+        data.bytes_received,
+        data.timestamp.hour,
+        data.timestamp.weekday(),
+        1 if data.protocol.lower() == 'tcp' else 0,
+        1 if data.protocol.lower() == 'udp' else 0,
+    ])
+
+
+def extract_email_features(data: EmailFeatures):
+    """Convert EmailFeatures to numpy array"""
+    return np.array([
+        data.num_recipients,
+        data.email_size,
+        1 if data.has_attachment else 0,
+        data.num_attachments,
+        data.subject_length,
+        data.body_length,
+        1 if data.is_reply else 0,
+        1 if data.is_forward else 0,
+        data.timestamp.hour,
+        data.timestamp.weekday(),
+        len(data.sender_email.split('@')[1]) if '@' in data.sender_email else 0,
+    ])
+
+
+def parse_records(body, content_type=''):
+    """
+    Parse a JSON array or NDJSON body into a list of records
+    NDJSON lines that are not valid JSON become None and fail validation as their own row
+    """
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+    if 'ndjson' not in content_type and text.lstrip().startswith('['):
+        records = json.loads(text)
+        if not isinstance(records, list):
+            raise ValueError("Expected a JSON array of records")
+        return records
+
+    records = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            records.append(None)
+    return records
+
+
+def _number_block(rows, fields, invalid):
+    """
+    Numeric columns for (key, kind) fields, kind one of 'float', 'int' or 'bool'.
+    All fields are pulled per record with one itemgetter and converted in a
+    single numpy call; rows with a value pydantic might treat differently
+    (null, string, fractional count, non 0/1 flag) are marked invalid.
+    """
+    getter = itemgetter(*(key for key, _ in fields))
+    try:
+        block = np.array(list(map(getter, rows)))
+    except (KeyError, TypeError, ValueError):
+        block = None
+    if block is None or block.dtype.kind not in 'biuf':
+        # Some row is missing a field or holds something other than a JSON number or boolean;
+        # numpy would read numeric strings like "1e3" or " 12 " that pydantic rejects
+        block = np.zeros((len(rows), len(fields)))
+        for i, row in enumerate(rows):
+            try:
+                values = getter(row)
+            except KeyError:
+                invalid[i] = True
+                continue
+            if all(type(value) in _NUMBER_TYPES for value in values):
+                block[i] = values
+            else:
+                invalid[i] = True
+    else:
+        block = block.astype(np.float64, copy=False)
+
+    with np.errstate(invalid='ignore'):
+        invalid |= np.isnan(block).any(axis=1)
+        for i, (_, kind) in enumerate(fields):
+            column = block[:, i]
+            if kind == 'int':
+                # pydantic reads integral floats as int64 only
+                invalid |= ~np.isfinite(column) | (column != np.floor(column)) | (np.abs(column) >= 2.0 ** 63)
+            elif kind == 'bool':
+                invalid |= (column != 0) & (column != 1)
+    return block
+
+
+def _string_block(rows, keys, invalid):
+    """Required string fields as lists; rows where one is missing or not a string are marked invalid"""
+    try:
+        columns = [list(column) for column in zip(*map(itemgetter(*keys), rows))]
+    except KeyError:
+        columns = [[row.get(key) for row in rows] for key in keys]
+
+    for i, column in enumerate(columns):
+        if set(map(type, column)) != {str}:
+            invalid |= np.array([type(value) is not str for value in column], dtype=bool)
+            columns[i] = [value if type(value) is str else '' for value in column]
+    return columns
+
+
+def _codes(strings, width=None):
+    """Code points of a string column as an (n, width) array, zero padded"""
+    array = np.array(strings, dtype=f'U{width}' if width else str)
+    return array.view(np.uint32).reshape(len(strings), array.dtype.itemsize // 4).astype(np.int64)
+
+
+def _equals_ascii_lower(codes, word):
+    """Rows equal to word after lower-casing ASCII letters"""
+    if codes.shape[1] < len(word):
+        return np.zeros(len(codes), dtype=bool)
+    head = codes[:, :len(word)]
+    head = np.where((head >= ord('A')) & (head <= ord('Z')), head + 32, head)
+    match = (head == [ord(c) for c in word]).all(axis=1)
+    if codes.shape[1] > len(word):
+        match &= codes[:, len(word)] == 0
+    return match
+
+
+def _parse_stamps(stamps, invalid):
+    """
+    Wall-clock fields of ISO 8601 strings, validated as pydantic would
+    Returns: (hour, seconds into the day, days since 1970-01-01) arrays
+    """
+    n = len(stamps)
+    matched = np.fromiter(map(bool, map(_ISO_DATETIME.match, stamps)), dtype=bool, count=n)
+    if not matched.all():
+        invalid |= ~matched
+        stamps = [stamp if ok else _EPOCH for stamp, ok in zip(stamps, matched)]
+
+    # Code points of 'YYYY-MM-DDTHH:MM:SS', zero padded when seconds are missing
+    codes = _codes(stamps, 19) - _ZERO
+    hour = codes[:, 11] * 10 + codes[:, 12]
+    minute = codes[:, 14] * 10 + codes[:, 15]
+    has_seconds = codes[:, 16] == ord(':') - _ZERO
+    second = np.where(has_seconds, codes[:, 17] * 10 + codes[:, 18], 0)
+    invalid |= (hour > 23) | (minute > 59) | (second > 59)
+
+    year = codes[:, 0] * 1000 + codes[:, 1] * 100 + codes[:, 2] * 10 + codes[:, 3]
+    month = codes[:, 5] * 10 + codes[:, 6]
+    day = codes[:, 8] * 10 + codes[:, 9]
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_length = _MONTH_LENGTHS[np.clip(month, 1, 12) - 1] + ((month == 2) & leap)
+    invalid |= (year < 1) | (month < 1) | (month > 12) | (day < 1) | (day > month_length)
+
+    # Days since 1970-01-01 for the proleptic Gregorian calendar (days_from_civil)
+    y = year - (month <= 2)
+    era = y // 400
+    year_of_era = y - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    days = era * 146097 + year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year - 719468
+
+    return hour, hour * 3600 + minute * 60 + second, days
+
+
+def _hour_and_weekday(stamps, invalid):
+    """
+    Hour and weekday straight from ISO 8601 strings, as datetime.hour and
+    datetime.weekday() would give for the parsed timestamp
+    """
+    hour, _, days = _parse_stamps(stamps, invalid)
+    # 1970-01-01 was a Thursday (weekday 3)
+    return hour, (days + 3) % 7
+
+
+def wall_seconds(timestamp):
+    """Seconds since 1970-01-01 of a datetime's wall-clock time, ignoring any UTC offset like hour/weekday do"""
+    return (timestamp.replace(tzinfo=None) - _EPOCH_DATETIME).total_seconds()
+
+
+def event_seconds(records):
+    """
+    Wall-clock event time of validated records, see wall_seconds()
+    Returns: float64 array; timestamps that are not ISO 8601 strings are parsed by pydantic
+    """
+    stamps = [record['timestamp'] for record in records]
+    invalid = np.fromiter((type(stamp) is not str for stamp in stamps), dtype=bool, count=len(stamps))
+    _, seconds, days = _parse_stamps([stamp if type(stamp) is str else _EPOCH for stamp in stamps], invalid)
+    result = days * 86400.0 + seconds
+    for i in np.flatnonzero(invalid):
+        result[i] = wall_seconds(_DATETIME.validate_python(stamps[i]))
+    return result
+
+
+def _domain_length(emails):
+    """Length of the text between the first and second '@', as len(split('@')[1]) gives"""
+    codes = _codes(emails)
+    at = codes == ord('@')
+    seen = np.cumsum(at, axis=1)
+    return ((seen == 1) & ~at & (codes != 0)).sum(axis=1)
+
+
+def _prepare(records):
+    """Swap non-object records for empty dicts so column building never raises"""
+    invalid = np.fromiter((type(record) is not dict for record in records), dtype=bool, count=len(records))
+    if invalid.any():
+        records = [record if type(record) is dict else {} for record in records]
+    return records, invalid
+
+
+def _validate_invalid_rows(records, invalid, model, extract, features):
+    """Run the rows marked invalid (rejected by the columnar path) through pydantic; returns row index -> errors"""
+    errors = {}
+    for i in np.flatnonzero(invalid):
+        try:
+            features[i] = extract(model.model_validate(records[i]))
+        except ValidationError as e:
+            errors[int(i)] = e.errors(include_url=False, include_context=False)
+    return errors
+
+
+def network_columns(records):
+    """
+    Build the network feature matrix straight from parsed JSON records,
+    one vectorized column block at a time; bodies of at most
+    PYDANTIC_MAX_ROWS rows are validated row by row instead.
+    Returns: (float32 matrix of shape (n, 11), dict of row index -> validation errors)
+    """
+    n = len(records)
+    features = np.empty((n, 11), dtype=np.float32)
+    if n == 0:
+        return features, {}
+    if n <= PYDANTIC_MAX_ROWS:
+        return features, _validate_invalid_rows(records, np.ones(n, dtype=bool), NetworkFeatures, extract_network_features, features)
+
+    rows, invalid = _prepare(records)
+    features[:, :7] = _number_block(rows, NETWORK_NUMBERS, invalid)
+
+    timestamp, protocol, _, _ = _string_block(rows, ('timestamp', 'protocol', 'source_ip', 'destination_ip'), invalid)
+    features[:, 7], features[:, 8] = _hour_and_weekday(timestamp, invalid)
+    protocol = _codes(protocol)
+    features[:, 9] = _equals_ascii_lower(protocol, 'tcp')
+    features[:, 10] = _equals_ascii_lower(protocol, 'udp')
+
+    errors = _validate_invalid_rows(records, invalid, NetworkFeatures, extract_network_features, features)
+    return features, errors
+
+
+def email_columns(records):
+    """
+    Build the email feature matrix straight from parsed JSON records,
+    one vectorized column block at a time; bodies of at most
+    PYDANTIC_MAX_ROWS rows are validated row by row instead.
+    Returns: (float32 matrix of shape (n, 11), dict of row index -> validation errors)
+    """
+    n = len(records)
+    features = np.empty((n, 11), dtype=np.float32)
+    if n == 0:
+        return features, {}
+    if n <= PYDANTIC_MAX_ROWS:
+        return features, _validate_invalid_rows(records, np.ones(n, dtype=bool), EmailFeatures, extract_email_features, features)
+
+    rows, invalid = _prepare(records)
+    features[:, :8] = _number_block(rows, EMAIL_NUMBERS, invalid)
+
+    timestamp, sender, _ = _string_block(rows, ('timestamp', 'sender_email', 'receiver_email'), invalid)
+    features[:, 8], features[:, 9] = _hour_and_weekday(timestamp, invalid)
+    features[:, 10] = _domain_length(sender)
+
+    errors = _validate_invalid_rows(records, invalid, EmailFeatures, extract_email_features, features)
+    return features, errors
@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class OverloadedError(Exception):
+    """Raised when inference work is shed instead of queued"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """
+    Dedicated executor for CPU-bound model calls with bounded admission.
+
+    Keeps sklearn/NumPy work off the event loop so /health and other
+    requests stay responsive. At most max_pending jobs may be queued or
+    running; beyond that run() fails fast with OverloadedError. A thread
+    pool is used because the tree traversals and NumPy kernels release
+    the GIL and the loaded models are shared without copying.
+    """
+
+    def __init__(self, workers=4, max_pending=64, retry_after=1):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    @property
+    def saturated(self):
+        return self.pending >= self.max_pending
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the pool, or raise OverloadedError if the queue is full"""
+        if self.saturated:
+            self.rejected += 1
+            raise OverloadedError(f"{self.pending} inference jobs already pending", self.retry_after)
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
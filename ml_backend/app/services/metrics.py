@@ -0,0 +1,212 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# Latency buckets in seconds, from 50us up to 5s
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Monotonic counter, optionally split by labels"""
+    kind = 'counter'
+
+    def inc(self, amount=1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Gauge or counter whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name, documentation, labelnames=(), callback=None, kind='gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def render(self):
+        lines = self._header()
+        for labelvalues, value in sorted(self.callback().items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram, optionally split by labels"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                # Per-bucket counts (+Inf last), sum, count
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._values.items())
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'ml_stage_latency_seconds', 'Latency of each predict pipeline stage', ('stage', 'model')))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'ml_http_request_duration_seconds', 'End-to-end HTTP request latency', ('method', 'path', 'status')))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    'ml_batch_size', 'Rows scored per model call', ('model',), BATCH_SIZE_BUCKETS))
+PREDICTIONS = REGISTRY.register(Counter(
+    'ml_predictions_total', 'Rows scored', ('model',)))
+ANOMALIES = REGISTRY.register(Counter(
+    'ml_anomalies_total', 'Rows flagged as anomalous', ('model',)))
+
+
+# perf_counter() at which the current HTTP request entered the app
+_request_start = contextvars.ContextVar('request_start', default=None)
+
+
+@contextmanager
+def stage_timer(stage, model):
+    """Record the wall time of a block as one pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage, model)
+
+
+def record_batch(model, is_anomaly):
+    """Count one scored batch: size, throughput and anomalies"""
+    n = len(is_anomaly)
+    BATCH_SIZE.observe(n, model)
+    PREDICTIONS.inc(n, model)
+    ANOMALIES.inc(int(is_anomaly.sum()), model)
+
+
+def observe_since_request_start(stage, model):
+    """Record the time from the request entering the app until now (body read, parsing, validation)"""
+    start = _request_start.get()
+    if start is not None:
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage, model)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template"""
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = {}
+
+    def _route_path(self, scope):
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        path = self._paths.get(endpoint)
+        if path is None:
+            path = next(
+                (route.path for route in scope['app'].routes if getattr(route, 'endpoint', None) is endpoint),
+                'unmatched'
+            )
+            self._paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        token = _request_start.set(start)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_start.reset(token)
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start, scope['method'], self._route_path(scope), status[0]
+            )
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from app.services.metrics import REGISTRY, Counter, CallbackMetric
+
+
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'ml_prediction_cache_requests_total', 'Prediction cache lookups', ('model', 'result')))
+
+
+class PredictionCache:
+    """
+    Bounded TTL + LRU cache of scored rows.
+
+    Keys are the feature row quantized to `mantissa_bits` bits of float32
+    mantissa, plus the modality and model version, so near-identical rows
+    (a flow resubmitted with the same counters, the same sender again)
+    share one entry and a new model version never sees old results.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=60.0, mantissa_bits=16):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.mantissa_bits = mantissa_bits
+        self._mask = np.uint32((0xFFFFFFFF << (23 - mantissa_bits)) & 0xFFFFFFFF)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def keys(self, modality, version, features):
+        """One hashable key per feature row"""
+        quantized = np.ascontiguousarray(features, dtype=np.float32).view(np.uint32) & self._mask
+        return [(modality, version, row.tobytes()) for row in quantized.reshape(len(quantized), -1)]
+
+    def get_many(self, modality, keys):
+        """Cached results for keys, None where missing or expired"""
+        now = time.monotonic()
+        results = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    results.append(entry[1])
+                else:
+                    if entry is not None:
+                        del self._entries[key]
+                    results.append(None)
+
+        hits = sum(result is not None for result in results)
+        CACHE_REQUESTS.inc(hits, modality, 'hit')
+        CACHE_REQUESTS.inc(len(results) - hits, modality, 'miss')
+        return results
+
+    def put_many(self, keys, values):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        hits = sum(CACHE_REQUESTS.value(model, 'hit') for model in ('network', 'email'))
+        misses = sum(CACHE_REQUESTS.value(model, 'miss') for model in ('network', 'email'))
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "evictions": self.evictions,
+        }
+
+
+def register_metrics(cache):
+    """Expose a cache's size and evictions on /metrics"""
+    REGISTRY.register(CallbackMetric(
+        'ml_prediction_cache_entries', 'Rows held in the prediction cache', (),
+        lambda: {(): len(cache)}
+    ))
+    REGISTRY.register(CallbackMetric(
+        'ml_prediction_cache_evictions_total', 'Entries evicted from the prediction cache to stay bounded', (),
+        lambda: {(): cache.evictions},
+        kind='counter'
+    ))
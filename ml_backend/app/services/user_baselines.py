@@ -0,0 +1,271 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.services.metrics import REGISTRY, Counter, CallbackMetric
+
+
+BASELINE_ADJUSTMENTS = REGISTRY.register(Counter(
+    'ml_user_baseline_adjustments_total', 'Global verdicts changed by a per-user baseline',
+    ('model', 'action')))
+
+# Label for rows only the per-user baseline flags; the threat classifier only ever sees global anomalies
+BASELINE_DEVIATION = 'baseline_deviation'
+
+_MODALITIES = ('network', 'email')
+
+
+class _Profiles:
+    """
+    Fixed-size per-modality slab: row `slot` holds one user's running feature
+    statistics (Welford count / mean / M2) and a ring of the global model's
+    recent anomaly scores for that user, which serves as a quantile sketch.
+    """
+
+    def __init__(self, max_users, n_features, history):
+        self.count = np.zeros(max_users, dtype=np.int64)
+        self.mean = np.zeros((max_users, n_features))
+        self.m2 = np.zeros((max_users, n_features))
+        self.scores = np.zeros((max_users, history), dtype=np.float32)
+        # Population statistics over every event, used to floor a user's spread
+        self.population = np.zeros(1, dtype=np.int64)
+        self.population_mean = np.zeros(n_features)
+        self.population_m2 = np.zeros(n_features)
+
+    def reset(self, slot):
+        self.count[slot] = 0
+        self.mean[slot] = 0
+        self.m2[slot] = 0
+
+
+def _merge(count, mean, m2, n, batch_mean, batch_m2):
+    """Chan et al. pairwise update of running (count, mean, M2) with a batch's statistics"""
+    count, n = np.asarray(count), np.asarray(n)
+    total = count + n
+    delta = batch_mean - mean
+    mean = mean + delta * (n / total)[..., None]
+    m2 = m2 + batch_m2 + delta ** 2 * (count * n / total)[..., None]
+    return total, mean, m2
+
+
+class UserBaselineStore:
+    """
+    Per-user behavioral baselines layered on top of the global models.
+
+    Every user gets one slot in fixed-size arrays, so memory is bounded by
+    `max_users` whatever the number of users; the least recently seen user
+    is evicted when a new one needs a slot. An event is scored against its
+    user's history before being folded in, at constant cost per event.
+
+    Once a user has `min_events` events of a modality:
+    - a global anomaly is suppressed when its score is below the user's own
+      `quantile` of recent scores (ordinary for this heavy user), and
+    - a row the global model passes is flagged when one of its features is
+      `zscore` or more of the user's standard deviations from the user's mean
+      (a sudden spike from a quiet user).
+    """
+
+    def __init__(self, max_users=50000, min_events=20, history=32, quantile=0.9, zscore=4.0,
+                 population_floor=0.1, n_features=11):
+        self.max_users = max_users
+        self.min_events = min_events
+        self.history = history
+        self.quantile = quantile
+        self.zscore = zscore
+        # A user's spread never counts as less than this fraction of the population's
+        self.population_floor = population_floor
+        self.n_features = n_features
+
+        self._slots = OrderedDict()
+        self._free = list(range(max_users - 1, -1, -1))
+        self._profiles = {modality: _Profiles(max_users, n_features, history) for modality in _MODALITIES}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _slot(self, user_id):
+        slot = self._slots.get(user_id)
+        if slot is not None:
+            self._slots.move_to_end(user_id)
+            return slot
+
+        if self._free:
+            slot = self._free.pop()
+        else:
+            _, slot = self._slots.popitem(last=False)
+            for profiles in self._profiles.values():
+                profiles.reset(slot)
+            self.evictions += 1
+        self._slots[user_id] = slot
+        return slot
+
+    def rescore(self, modality, user_ids, features, results):
+        """
+        Adjust globally scored rows by each user's baseline, then learn from them
+        Returns: (adjusted results, list of (score percentile, max |z|) per row, None while warming up)
+        """
+        adjusted, baselines = [], []
+        # No batch chunk touches more users than there are slots, so none is evicted mid-chunk
+        for start in range(0, len(results), self.max_users):
+            end = start + self.max_users
+            chunk = self._rescore(modality, user_ids[start:end], features[start:end], results[start:end])
+            adjusted.extend(chunk[0])
+            baselines.extend(chunk[1])
+        return adjusted, baselines
+
+    def _rescore(self, modality, user_ids, features, results):
+        features = np.asarray(features, dtype=np.float64)
+        scores = np.array([result[1] for result in results], dtype=np.float64)
+        profiles = self._profiles[modality]
+
+        with self._lock:
+            slots = np.fromiter(map(self._slot, user_ids), dtype=np.int64, count=len(user_ids))
+            count = profiles.count[slots]
+            percentile, zscore = self._deviation(profiles, slots, count, features, scores)
+            self._learn(profiles, slots, count, features, scores)
+
+        adjusted, baselines = [], []
+        suppressed = raised = 0
+        for i, result in enumerate(results):
+            if count[i] < self.min_events:
+                adjusted.append(result)
+                baselines.append((None, None))
+                continue
+
+            is_anomaly, anomaly_score, threat_class, confidence = result
+            if is_anomaly and percentile[i] < self.quantile:
+                result = (False, anomaly_score, None, anomaly_score)
+                suppressed += 1
+            elif not is_anomaly and zscore[i] >= self.zscore:
+                result = (True, anomaly_score, BASELINE_DEVIATION, 1 - self.zscore / (2 * zscore[i]))
+                raised += 1
+            adjusted.append(result)
+            baselines.append((float(percentile[i]), float(zscore[i])))
+
+        BASELINE_ADJUSTMENTS.inc(suppressed, modality, 'suppressed')
+        BASELINE_ADJUSTMENTS.inc(raised, modality, 'raised')
+        return adjusted, baselines
+
+    def _deviation(self, profiles, slots, count, features, scores):
+        """Each row's score percentile within its user's recent scores, and its largest per-feature |z|"""
+        filled = np.minimum(count, self.history)
+        recent = profiles.scores[slots]
+        valid = np.arange(self.history) < filled[:, None]
+        # Mid-rank, so a user whose score never changes sits at the median of their own history
+        current = scores.astype(np.float32)[:, None]
+        below = ((recent < current) & valid).sum(axis=1)
+        equal = ((recent == current) & valid).sum(axis=1)
+        percentile = (below + 0.5 * equal) / np.maximum(filled, 1)
+
+        std = np.sqrt(profiles.m2[slots] / np.maximum(count, 1)[:, None])
+        population_std = np.sqrt(profiles.population_m2 / max(int(profiles.population[0]), 1))
+        scale = np.maximum(std, self.population_floor * population_std)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.abs(features - profiles.mean[slots]) / scale
+        # Features that never varied anywhere carry no signal
+        zscore = np.where(scale > 0, z, 0.0).max(axis=1)
+        return percentile, zscore
+
+    def _learn(self, profiles, slots, count, features, scores):
+        """Fold a batch into the per-user and population statistics; repeated users are merged per group"""
+        users, group = np.unique(slots, return_inverse=True)
+        n = np.bincount(group).astype(np.int64)
+        batch_mean = np.zeros((len(users), self.n_features))
+        np.add.at(batch_mean, group, features)
+        batch_mean /= n[:, None]
+        batch_m2 = np.zeros((len(users), self.n_features))
+        np.add.at(batch_m2, group, (features - batch_mean[group]) ** 2)
+
+        (profiles.count[users], profiles.mean[users], profiles.m2[users]) = _merge(
+            profiles.count[users], profiles.mean[users], profiles.m2[users], n, batch_mean, batch_m2)
+
+        total, profiles.population_mean, profiles.population_m2 = _merge(
+            int(profiles.population[0]), profiles.population_mean, profiles.population_m2,
+            len(features), features.mean(axis=0), ((features - features.mean(axis=0)) ** 2).sum(axis=0))
+        profiles.population[0] = total
+
+        # Ring position of each row: its user's event count plus its rank among that user's rows in the batch
+        order = np.argsort(group, kind='stable')
+        first = np.concatenate([[0], np.flatnonzero(np.diff(group[order])) + 1])
+        rank = np.empty(len(slots), dtype=np.int64)
+        rank[order] = np.arange(len(slots)) - np.repeat(first, np.diff(np.append(first, len(slots))))
+        profiles.scores[slots, (count + rank) % self.history] = scores
+
+    def __len__(self):
+        return len(self._slots)
+
+    def stats(self):
+        return {
+            "users": len(self),
+            "max_users": self.max_users,
+            "evictions": self.evictions,
+            "suppressed": sum(BASELINE_ADJUSTMENTS.value(m, 'suppressed') for m in _MODALITIES),
+            "raised": sum(BASELINE_ADJUSTMENTS.value(m, 'raised') for m in _MODALITIES),
+        }
+
+    def save(self, file_path):
+        """Snapshot every profile to one .npz file, replaced atomically"""
+        with self._lock:
+            state = {
+                'users': np.array(list(self._slots), dtype=str),
+                'slots': np.fromiter(self._slots.values(), dtype=np.int64, count=len(self._slots)),
+                'evictions': np.array(self.evictions),
+            }
+            for modality, profiles in self._profiles.items():
+                for name in ('count', 'mean', 'm2', 'scores', 'population', 'population_mean', 'population_m2'):
+                    state[f'{modality}_{name}'] = getattr(profiles, name)
+
+            os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+            tmp_path = f'{file_path}.tmp-{os.getpid()}'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **state)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+
+    def load(self, file_path):
+        """
+        Restore a snapshot written by save() into this (empty) store, leaving
+        out the least recently seen users if it holds fewer users
+        Returns: number of users restored
+        """
+        with np.load(file_path) as state:
+            if state['network_scores'].shape[1] != self.history or state['network_mean'].shape[1] != self.n_features:
+                raise ValueError(f"{file_path} was saved with a different history length or feature count")
+
+            users, slots = list(state['users']), state['slots']
+            keep = slice(max(0, len(users) - self.max_users), None)
+            users, slots = users[keep], slots[keep]
+
+            with self._lock:
+                self._slots = OrderedDict((str(user), slot) for slot, user in enumerate(users))
+                self._free = list(range(self.max_users - 1, len(users) - 1, -1))
+                self.evictions = int(state['evictions'])
+                for modality, profiles in self._profiles.items():
+                    for name in ('count', 'mean', 'm2', 'scores'):
+                        getattr(profiles, name)[:len(users)] = state[f'{modality}_{name}'][slots]
+                    profiles.population[:] = state[f'{modality}_population']
+                    profiles.population_mean = state[f'{modality}_population_mean']
+                    profiles.population_m2 = state[f'{modality}_population_m2']
+        return len(users)
+
+    async def snapshot_every(self, file_path, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.save, file_path)
+            except Exception as e:
+                print(f"⚠️  User baseline snapshot failed: {e}")
+
+
+def register_metrics(store):
+    """Expose a store's size and evictions on /metrics"""
+    REGISTRY.register(CallbackMetric(
+        'ml_user_baselines', 'Users with a baseline in memory', (),
+        lambda: {(): len(store)}
+    ))
+    REGISTRY.register(CallbackMetric(
+        'ml_user_baseline_evictions_total', 'Least recently seen users dropped to stay within the store size', (),
+        lambda: {(): store.evictions},
+        kind='counter'
+    ))
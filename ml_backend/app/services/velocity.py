@@ -0,0 +1,185 @@
+import threading
+from array import array
+from collections import OrderedDict
+import numpy as np
+from app.services.metrics import REGISTRY, Counter
+
+
+VELOCITY_EVICTIONS = REGISTRY.register(Counter(
+    'ml_velocity_evictions_total', 'Velocity counters dropped, by reason', ('reason',)))
+
+# Sliding windows as (suffix, length in seconds, buckets). Each window is a ring of
+# equal-width buckets, so its count is exact up to one bucket at the old end
+WINDOWS = (('1m', 60, 6), ('5m', 300, 10), ('1h', 3600, 12))
+
+# A destination or recipient counts as new when the key has not used it for this long
+NOVELTY_SECONDS = 3600
+
+NETWORK_VELOCITY_FEATURE_NAMES = (
+    [f'src_events_{suffix}' for suffix, _, _ in WINDOWS]
+    + [f'src_new_destinations_{suffix}' for suffix, _, _ in WINDOWS]
+    + [f'dst_events_{suffix}' for suffix, _, _ in WINDOWS]
+)
+EMAIL_VELOCITY_FEATURE_NAMES = (
+    [f'sender_events_{suffix}' for suffix, _, _ in WINDOWS]
+    + [f'sender_new_recipients_{suffix}' for suffix, _, _ in WINDOWS]
+)
+
+# Counter layout per key, one int64 array: [last_seen, then per window: head bucket,
+# event sum, new sum, ring of (events, new) per bucket]
+_LAYOUT = []
+_SIZE = 1
+for _, _length, _buckets in WINDOWS:
+    _LAYOUT.append((_length // _buckets, _buckets, _SIZE, _SIZE + 1, _SIZE + 3))
+    _SIZE += 3 + 2 * _buckets
+_NEVER = -(1 << 62)
+_ZEROS = {buckets: array('q', [0]) * (2 * buckets) for _, _, buckets in WINDOWS}
+
+
+class VelocityStore:
+    """
+    Per-key sliding-window counters feeding the velocity features.
+
+    Keys are source IPs, destination IPs and senders; each holds event counts
+    and new-destination (new-recipient) counts over the WINDOWS in one small
+    ring-buffer array, so updating and reading a key is O(1). Time is the
+    event's own timestamp, which lets training replay history through the
+    same code. Keys idle for longer than `idle_seconds` of event time are
+    evicted, and beyond `max_keys` keys (or `max_pairs` key/peer pairs) the
+    least recently seen ones go first.
+    """
+
+    def __init__(self, max_keys=100000, max_pairs=200000, idle_seconds=3600):
+        self.max_keys = max_keys
+        self.max_pairs = max_pairs
+        self.idle_seconds = max(idle_seconds, WINDOWS[-1][1], NOVELTY_SECONDS)
+        self._keys = OrderedDict()
+        self._pairs = OrderedDict()
+        self._clock = _NEVER
+        self._lock = threading.Lock()
+
+    def _counters(self, key, t):
+        counters = self._keys.get(key)
+        if counters is None:
+            counters = self._keys[key] = array('q', [0]) * _SIZE
+            for _, _, head_at, _, _ in _LAYOUT:
+                counters[head_at] = _NEVER
+        else:
+            self._keys.move_to_end(key)
+        counters[0] = max(counters[0], t)
+        return counters
+
+    def _is_new(self, pair, t):
+        """Whether a key/peer pair was idle for NOVELTY_SECONDS, and mark it seen"""
+        last = self._pairs.get(pair)
+        if last is None:
+            self._pairs[pair] = t
+            return True
+        self._pairs.move_to_end(pair)
+        self._pairs[pair] = max(last, t)
+        return t - last > NOVELTY_SECONDS
+
+    @staticmethod
+    def _add(counters, t, new):
+        """
+        Count one event at time t
+        Returns: (event count per window, new count per window)
+        """
+        events, news = [], []
+        for width, n, head_at, sum_at, ring_at in _LAYOUT:
+            bucket = t // width
+            head = counters[head_at]
+            if bucket - head >= n:
+                # The whole window slid by since the key was last seen
+                counters[ring_at:ring_at + 2 * n] = _ZEROS[n]
+                counters[sum_at] = counters[sum_at + 1] = 0
+                counters[head_at] = head = bucket
+            elif bucket > head:
+                # Buckets that slid out of the window leave the sums
+                for b in range(head + 1, bucket + 1):
+                    slot = ring_at + 2 * (b % n)
+                    counters[sum_at] -= counters[slot]
+                    counters[sum_at + 1] -= counters[slot + 1]
+                    counters[slot] = counters[slot + 1] = 0
+                counters[head_at] = head = bucket
+            if head - bucket < n:
+                # Late events still count while their bucket is in the ring
+                slot = ring_at + 2 * (bucket % n)
+                counters[slot] += 1
+                counters[sum_at] += 1
+                if new:
+                    counters[slot + 1] += 1
+                    counters[sum_at + 1] += 1
+            events.append(counters[sum_at])
+            news.append(counters[sum_at + 1])
+        return events, news
+
+    def _evict(self):
+        """Drop idle keys and pairs, then the least recently seen ones beyond the caps"""
+        horizon = self._clock - self.idle_seconds
+        idle = capacity = 0
+        for entries, cap, last_seen in (
+            (self._keys, self.max_keys, lambda counters: counters[0]),
+            (self._pairs, self.max_pairs, lambda t: t),
+        ):
+            while entries:
+                key, value = next(iter(entries.items()))
+                if last_seen(value) < horizon:
+                    idle += 1
+                elif len(entries) > cap:
+                    capacity += 1
+                else:
+                    break
+                del entries[key]
+        if idle:
+            VELOCITY_EVICTIONS.inc(idle, 'idle')
+        if capacity:
+            VELOCITY_EVICTIONS.inc(capacity, 'capacity')
+
+    def network_rows(self, sources, destinations, seconds):
+        """
+        Count a batch of flows, in order
+        Returns: float32 matrix of NETWORK_VELOCITY_FEATURE_NAMES, one row per flow
+        """
+        rows = []
+        with self._lock:
+            for source, destination, t in zip(sources, destinations, seconds):
+                t = int(t)
+                self._clock = max(self._clock, t)
+                new = self._is_new(('flow', source, destination), t)
+                events, news = self._add(self._counters(('src', source), t), t, new)
+                fan_in, _ = self._add(self._counters(('dst', destination), t), t, False)
+                rows.append(events + news + fan_in)
+            self._evict()
+        return np.array(rows, dtype=np.float32).reshape(len(rows), len(NETWORK_VELOCITY_FEATURE_NAMES))
+
+    def email_rows(self, senders, receivers, seconds):
+        """
+        Count a batch of emails, in order
+        Returns: float32 matrix of EMAIL_VELOCITY_FEATURE_NAMES, one row per email
+        """
+        rows = []
+        with self._lock:
+            for sender, receiver, t in zip(senders, receivers, seconds):
+                t = int(t)
+                self._clock = max(self._clock, t)
+                new = self._is_new(('mail', sender, receiver), t)
+                events, news = self._add(self._counters(('sender', sender), t), t, new)
+                rows.append(events + news)
+            self._evict()
+        return np.array(rows, dtype=np.float32).reshape(len(rows), len(EMAIL_VELOCITY_FEATURE_NAMES))
+
+    def rows(self, modality, keys, peers, seconds):
+        if modality == 'network':
+            return self.network_rows(keys, peers, seconds)
+        return self.email_rows(keys, peers, seconds)
+
+    def stats(self):
+        return {
+            "keys": len(self._keys),
+            "max_keys": self.max_keys,
+            "pairs": len(self._pairs),
+            "max_pairs": self.max_pairs,
+            "evicted_idle": VELOCITY_EVICTIONS.value('idle'),
+            "evicted_capacity": VELOCITY_EVICTIONS.value('capacity'),
+        }
@@ -0,0 +1,47 @@
+import argparse
+import asyncio
+from app.db.mongodb import database
+from app.services.alert_rollups import AlertRollups
+
+
+# Alerts read per batch and collection; the rollups are flushed after every batch, which bounds memory
+BATCH_ROWS = 10000
+
+
+async def backfill_rollups(db=database, batch_rows=BATCH_ROWS):
+    """
+    Rebuild the alert rollups from scratch out of the stored anomalies, by
+    resetting them and ingesting every stored alert again. Run it once after
+    enabling rollups, or to repair them; alerts triaged while it runs may be
+    miscounted, so pause triage meanwhile.
+    Returns: {modality: alerts counted}
+    """
+    await asyncio.gather(*(collection.delete_many({}) for collection in db.rollups.values()))
+    rollups = AlertRollups(max_pending_keys=2 * batch_rows)
+    totals = dict.fromkeys(db.collections, 0)
+    while True:
+        counted = await rollups.ingest(db.collections, db.rollups, batch_rows=batch_rows)
+        for modality, n in counted.items():
+            totals[modality] += n
+        if not any(counted.values()):
+            break
+    for modality, total in totals.items():
+        print(f"✅ {modality}: {total} alerts rolled up")
+    return totals
+
+
+async def main(batch_rows):
+    database.connect()
+    try:
+        await database.ensure_indexes()
+        await backfill_rollups(database, batch_rows)
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the alert rollups behind /api/alerts/stats")
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS, help='alerts read per batch')
+    args = parser.parse_args()
+
+    asyncio.run(main(args.batch_rows))
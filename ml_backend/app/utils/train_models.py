@@ -1,6 +1,31 @@
+import argparse
+import hashlib
+import json
+import os
+import resource
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
 from app.models.anomaly_detector import AnomalyDetector
+from app.models.registry import ModelRegistry
+from app.config import MODEL_REGISTRY_PATH
+from app.utils.training_data import (
+    DATA_PATH, CHUNK_ROWS, DETECTOR_SAMPLE_ROWS, CLASSIFIER_ROWS_PER_CLASS, load_training_data
+)
+
+
+CHECKPOINT_PATH = 'saved_models/checkpoints/'
+
+# Pipeline stages: name -> (AnomalyDetector training method, takes labels)
+STAGES = {
+    'network_detector': ('train_network_detector', False),
+    'email_detector': ('train_email_detector', False),
+    'network_threat_classifier': ('train_network_threat_classifier', True),
+    'email_threat_classifier': ('train_email_threat_classifier', True),
+}
+
 
 def generate_sample_data():
     """
@@ -8,50 +33,247 @@ def generate_sample_data():
     In production, you'll use real data
     """
     np.random.seed(42)
-    
+
     # Generate normal network traffic data
     n_samples = 1000
     network_data = np.random.randn(n_samples, 11)  # 11 features
-    
+
     # Generate normal email data
     email_data = np.random.randn(n_samples, 11)  # 11 features
-    
-    # Generate threat classification data
-    threat_features = np.random.randn(n_samples, 11)
-    threat_labels = np.random.choice(
-        ['normal', 'phishing', 'data_leakage', 'unauthorized_access'], 
+
+    # Generate threat classification data, one label set per modality
+    network_threat_features = np.random.randn(n_samples, 11)
+    network_threat_labels = np.random.choice(
+        ['normal', 'ddos', 'port_scan', 'data_exfiltration'],
+        size=n_samples
+    )
+    email_threat_features = np.random.randn(n_samples, 11)
+    email_threat_labels = np.random.choice(
+        ['normal', 'phishing', 'spam', 'data_leakage', 'malware'],
         size=n_samples
     )
-    
-    return network_data, email_data, threat_features, threat_labels
 
-def train_all_models():
-    """Train all ML models"""
-    print("Starting model training...")
-    
-    # Generate sample data
-    network_data, email_data, threat_features, threat_labels = generate_sample_data()
-    
-    # Initialize detector
+    return (network_data, email_data, network_threat_features, network_threat_labels,
+            email_threat_features, email_threat_labels)
+
+
+def _fingerprint(stage_data, scalers):
+    """Hash of the training inputs, so a checkpoint is only resumed for the same data"""
+    digest = hashlib.sha256()
+    for name in sorted(stage_data):
+        X, y = stage_data[name]
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(X, dtype=np.float64).tobytes())
+        if y is not None:
+            digest.update(np.asarray(y).astype(str).tobytes())
+        if name in scalers:
+            digest.update(scalers[name].mean_.tobytes())
+            digest.update(scalers[name].scale_.tobytes())
+    return digest.hexdigest()
+
+
+def _train_stage(stage, X, y, n_jobs, checkpoint_path, scaler=None):
+    """
+    Train one model in a worker process and checkpoint its files
+    Returns: stage report (wall time, peak memory, files)
+    """
+    start = time.perf_counter()
+    method, _ = STAGES[stage]
+
+    detector = AnomalyDetector()
+    if y is None:
+        getattr(detector, method)(X, n_jobs=n_jobs, scaler=scaler)
+    else:
+        getattr(detector, method)(X, y, n_jobs=n_jobs)
+
+    # Files land in the checkpoint directory before the stage counts as done
+    stage_path = f'{checkpoint_path}.{stage}-{os.getpid()}/'
+    detector.save_models(stage_path)
+    files = sorted(os.listdir(stage_path))
+    for name in files:
+        os.replace(f'{stage_path}{name}', f'{checkpoint_path}{name}')
+    os.rmdir(stage_path)
+
+    report = {
+        'stage': stage,
+        'wall_seconds': round(time.perf_counter() - start, 3),
+        # ru_maxrss is in KiB on Linux; each stage runs in a fresh process
+        'peak_memory_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'files': files,
+    }
+    with open(f'{checkpoint_path}{stage}.done', 'w') as f:
+        json.dump(report, f)
+    return report
+
+
+def _load_run(checkpoint_path, fingerprint, resume):
+    """Completed stage reports of an earlier run on the same data, or none"""
+    run_file = f'{checkpoint_path}run.json'
+    if resume and os.path.exists(run_file):
+        with open(run_file) as f:
+            if json.load(f).get('fingerprint') == fingerprint:
+                reports = {}
+                for stage in STAGES:
+                    if os.path.exists(f'{checkpoint_path}{stage}.done'):
+                        with open(f'{checkpoint_path}{stage}.done') as stage_file:
+                            reports[stage] = json.load(stage_file)
+                return reports
+
+    shutil.rmtree(checkpoint_path, ignore_errors=True)
+    os.makedirs(checkpoint_path)
+    with open(run_file, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'started_at': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+    return {}
+
+
+def run_pipeline(stage_data, metadata, workers=None, n_jobs=None, checkpoint_path=CHECKPOINT_PATH,
+                 resume=True, publish=True, scalers=None):
+    """
+    Train the four models concurrently, one process per stage.
+    stage_data: dict of stage name -> (X, y or None)
+    scalers: optional dict of detector stage name -> StandardScaler fitted on the full data
+    Every finished stage is checkpointed under checkpoint_path; a failed or
+    interrupted run on the same data picks up where it stopped.
+    Returns: (AnomalyDetector, list of stage reports)
+    """
+    started = time.perf_counter()
+    workers = workers or min(len(stage_data), os.cpu_count() or 1)
+    n_jobs = n_jobs or max(1, (os.cpu_count() or 1) // workers)
+    scalers = scalers or {}
+
+    reports = _load_run(checkpoint_path, _fingerprint(stage_data, scalers), resume)
+    for stage in reports:
+        print(f"↩️  {stage}: resumed from checkpoint")
+
+    pending = [stage for stage in stage_data if stage not in reports]
+    if pending:
+        print(f"Training {len(pending)} models on {workers} processes x {n_jobs} threads...")
+        # A fresh process per stage keeps peak memory per stage and frees it afterwards
+        with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+            futures = {
+                pool.submit(_train_stage, stage, *stage_data[stage], n_jobs, checkpoint_path,
+                            scalers.get(stage)): stage
+                for stage in pending
+            }
+            for future in as_completed(futures):
+                report = future.result()
+                reports[report['stage']] = report
+                print(f"✅ {report['stage']}: {report['wall_seconds']:.2f}s, peak {report['peak_memory_mb']:.0f} MB")
+
     detector = AnomalyDetector()
-    
-    # Train models
-    print("\n1. Training network anomaly detector...")
-    detector.train_network_detector(network_data)
-    
-    print("\n2. Training email anomaly detector...")
-    detector.train_email_detector(email_data)
-    
-    print("\n3. Training threat classifier...")
-    detector.train_threat_classifier(threat_features, threat_labels)
-    
-    # Save models
-    print("\n4. Saving models...")
-    detector.save_models()
-    
+    detector.load_models(checkpoint_path)
+
+    stage_reports = [dict(reports[stage], resumed=stage not in pending) for stage in stage_data]
+    wall_seconds = round(time.perf_counter() - started, 3)
+    print(f"\n{'stage':<28}{'wall s':>9}{'peak MB':>10}")
+    for report in stage_reports:
+        suffix = '  (resumed)' if report['resumed'] else ''
+        print(f"{report['stage']:<28}{report['wall_seconds']:>9.2f}{report['peak_memory_mb']:>10.0f}{suffix}")
+    print(f"{'total':<28}{wall_seconds:>9.2f}")
+
+    if publish:
+        # Publish models as a new registry version; running services pick it up
+        # through /models/reload or the ACTIVE file watch
+        ModelRegistry(MODEL_REGISTRY_PATH).publish(detector, dict(metadata, stages=stage_reports, wall_seconds=wall_seconds))
+        shutil.rmtree(checkpoint_path, ignore_errors=True)
+
+    return detector, stage_reports
+
+
+def dataset_stages(scans, data_path=DATA_PATH):
+    """
+    Pipeline inputs from load_training_data() scans
+    Returns: (stage_data, scalers, metadata)
+    """
+    stage_data, scalers, metadata = {}, {}, {"data_source": data_path}
+    for modality, scan in scans.items():
+        stage_data[f'{modality}_detector'] = (scan['detector_sample'], None)
+        scalers[f'{modality}_detector'] = scan['scaler']
+        metadata[f'n_{modality}_samples'] = scan['rows']
+        metadata[f'n_{modality}_detector_sample'] = len(scan['detector_sample'])
+
+        X, y = scan['classifier_sample']
+        if len(set(y)) >= 2:
+            stage_data[f'{modality}_threat_classifier'] = (X, y)
+            metadata[f'n_{modality}_threat_samples'] = len(y)
+            metadata[f'{modality}_threat_classes'] = scan['class_counts']
+        else:
+            print(f"⚠️  Fewer than two labelled {modality} threat classes - "
+                  f"the {modality} classifier falls back to rules")
+    return stage_data, scalers, metadata
+
+
+def sample_stages():
+    """
+    Pipeline inputs from generate_sample_data()
+    Returns: (stage_data, scalers, metadata)
+    """
+    (network_data, email_data, network_threat_features, network_threat_labels,
+     email_threat_features, email_threat_labels) = generate_sample_data()
+
+    stage_data = {
+        'network_detector': (network_data, None),
+        'email_detector': (email_data, None),
+        'network_threat_classifier': (network_threat_features, network_threat_labels),
+        'email_threat_classifier': (email_threat_features, email_threat_labels),
+    }
+    metadata = {
+        "data_source": "generate_sample_data",
+        "n_network_samples": len(network_data),
+        "n_email_samples": len(email_data),
+        "n_network_threat_samples": len(network_threat_features),
+        "n_email_threat_samples": len(email_threat_features),
+    }
+    return stage_data, {}, metadata
+
+
+def train_all_models(workers=None, n_jobs=None, resume=True, data_path=DATA_PATH, velocity=False, **sampling):
+    """
+    Train all ML models
+    Trains on the CSV/Parquet files under data_path when there are any,
+    otherwise on generated sample data.
+    velocity: train on the extended schema with the sliding-window velocity features
+    sampling: chunk_rows / sample_rows / rows_per_class for load_training_data()
+    """
+    print("Starting model training...")
+
+    scans = load_training_data(data_path, velocity=velocity, **sampling)
+    if scans:
+        missing = {'network', 'email'} - set(scans)
+        if missing:
+            print(f"⚠️  No {' or '.join(sorted(missing))} data under {data_path}; "
+                  f"the published version will not include those models")
+        stage_data, scalers, metadata = dataset_stages(scans, data_path)
+        metadata["velocity_features"] = velocity
+    else:
+        print(f"⚠️  No training data under {data_path} - using generated sample data")
+        if velocity:
+            print("⚠️  Sample data has no IPs or senders to count, training without velocity features")
+        stage_data, scalers, metadata = sample_stages()
+
+    detector, _ = run_pipeline(stage_data, metadata, workers=workers, n_jobs=n_jobs, resume=resume,
+                               scalers=scalers)
+
     print("\n✅ All models trained and saved successfully!")
-    
+
     return detector
 
+
 if __name__ == "__main__":
-    train_all_models()
+    parser = argparse.ArgumentParser(description="Train and publish the anomaly detection models")
+    parser.add_argument('--workers', type=int, help='training processes (default: one per model, up to the CPU count)')
+    parser.add_argument('--n-jobs', type=int, help='threads per model (default: CPUs / workers)')
+    parser.add_argument('--no-resume', action='store_true', help='ignore checkpoints of an earlier run')
+    parser.add_argument('--data', default=DATA_PATH, help='directory with network/ and email/ CSV or Parquet files')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='rows read per chunk')
+    parser.add_argument('--sample-rows', type=int, default=DETECTOR_SAMPLE_ROWS,
+                        help='reservoir sample size for each IsolationForest')
+    parser.add_argument('--class-rows', type=int, default=CLASSIFIER_ROWS_PER_CLASS,
+                        help='rows kept per threat class for each RandomForest')
+    parser.add_argument('--velocity', action='store_true',
+                        help='add the sliding-window velocity features (serve with ML_VELOCITY_FEATURES=true)')
+    args = parser.parse_args()
+
+    train_all_models(workers=args.workers, n_jobs=args.n_jobs, resume=not args.no_resume, data_path=args.data,
+                     velocity=args.velocity, chunk_rows=args.chunk_rows, sample_rows=args.sample_rows,
+                     rows_per_class=args.class_rows)
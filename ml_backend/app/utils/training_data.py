@@ -0,0 +1,213 @@
+import glob
+import os
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from app.services.features import network_columns, email_columns, event_seconds
+from app.services.velocity import VelocityStore, NETWORK_VELOCITY_FEATURE_NAMES, EMAIL_VELOCITY_FEATURE_NAMES
+from app.config import VELOCITY_MAX_KEYS, VELOCITY_MAX_PAIRS, VELOCITY_IDLE_SECONDS
+
+
+DATA_PATH = 'data/'
+
+# Column holding the threat class of a labelled row ('normal', 'ddos', 'phishing', ...)
+LABEL_COLUMN = 'threat_type'
+
+# Memory bounds: rows per chunk read, rows kept for the IsolationForest,
+# rows kept per threat class for the RandomForest
+CHUNK_ROWS = 50000
+DETECTOR_SAMPLE_ROWS = 100000
+CLASSIFIER_ROWS_PER_CLASS = 20000
+
+_COLUMNS = {'network': network_columns, 'email': email_columns}
+_VELOCITY_KEYS = {
+    'network': ('source_ip', 'destination_ip', len(NETWORK_VELOCITY_FEATURE_NAMES)),
+    'email': ('sender_email', 'receiver_email', len(EMAIL_VELOCITY_FEATURE_NAMES)),
+}
+
+
+class Reservoir:
+    """
+    Uniform random sample of at most `capacity` rows from a stream of
+    unknown length (Vitter's Algorithm R), vectorized per chunk.
+    """
+
+    def __init__(self, capacity, n_features, rng):
+        self.capacity = capacity
+        self.rows = np.empty((capacity, n_features), dtype=np.float32)
+        self.size = 0
+        self.seen = 0
+        self.rng = rng
+
+    def add(self, X):
+        fill = min(len(X), self.capacity - self.size)
+        self.rows[self.size:self.size + fill] = X[:fill]
+        self.size += fill
+        self.seen += fill
+
+        rest = X[fill:]
+        if len(rest):
+            # Row i of the stream replaces a random slot with probability capacity / (i + 1)
+            slots = self.rng.integers(0, self.seen + np.arange(len(rest)) + 1)
+            keep = np.flatnonzero(slots < self.capacity)
+            # When two rows of a chunk pick the same slot the later one wins, as it would one by one
+            _, last = np.unique(slots[keep][::-1], return_index=True)
+            keep = keep[len(keep) - 1 - last]
+            self.rows[slots[keep]] = rest[keep]
+            self.seen += len(rest)
+
+    def sample(self):
+        return self.rows[:self.size]
+
+
+class StratifiedReservoir:
+    """One Reservoir per label, so rare threat classes survive next to a flood of normal rows"""
+
+    def __init__(self, rows_per_class, n_features, rng):
+        self.rows_per_class = rows_per_class
+        self.n_features = n_features
+        self.rng = rng
+        self.classes = {}
+
+    def add(self, X, labels):
+        for label in np.unique(labels):
+            if label not in self.classes:
+                self.classes[label] = Reservoir(self.rows_per_class, self.n_features, self.rng)
+            self.classes[label].add(X[labels == label])
+
+    def sample(self):
+        """
+        Returns: (X, y) with every class's rows, in sorted label order
+        """
+        labels = sorted(self.classes)
+        X = np.concatenate([self.classes[label].sample() for label in labels]) if labels \
+            else np.empty((0, self.n_features), dtype=np.float32)
+        y = np.concatenate([np.full(self.classes[label].size, label, dtype=object) for label in labels]) if labels \
+            else np.empty(0, dtype=object)
+        return X, y
+
+    def counts(self):
+        return {str(label): int(reservoir.seen) for label, reservoir in sorted(self.classes.items())}
+
+
+def data_files(path):
+    """CSV (optionally gzipped) and Parquet files under path, in name order"""
+    patterns = ('*.csv', '*.csv.gz', '*.parquet')
+    return sorted(f for pattern in patterns for f in glob.glob(os.path.join(path, '**', pattern), recursive=True))
+
+
+def read_chunks(file_path, chunk_rows=CHUNK_ROWS):
+    """Yield a file as DataFrames of at most chunk_rows rows"""
+    if file_path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(f"Reading {file_path} needs pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        # Addresses stay strings; flags and counters are left to type inference
+        dtype = {'source_ip': str, 'destination_ip': str, 'protocol': str,
+                 'sender_email': str, 'receiver_email': str, 'timestamp': str, LABEL_COLUMN: str}
+        yield from pd.read_csv(file_path, chunksize=chunk_rows, dtype=dtype)
+
+
+def _records(frame):
+    """DataFrame chunk -> JSON-like records, as the API would receive them"""
+    names = list(frame.columns)
+    columns = []
+    for name in names:
+        column = frame[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            column = column.map(lambda t: t.isoformat(), na_action='ignore')
+        if column.hasnans:
+            # Empty cells become None rather than NaN so they fail validation like a missing field
+            column = column.astype(object).where(column.notna(), None)
+        columns.append(column.tolist())
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def _replay_velocity(store, modality, records):
+    """Velocity columns for a chunk of records, counted in event-time order as serving would have"""
+    key, peer, _ = _VELOCITY_KEYS[modality]
+    seconds = event_seconds(records)
+    order = np.argsort(seconds, kind='stable')
+    rows = store.rows(modality, [records[i][key] for i in order], [records[i][peer] for i in order], seconds[order])
+    columns = np.empty_like(rows)
+    columns[order] = rows
+    return columns
+
+
+def scan_modality(modality, path, chunk_rows=CHUNK_ROWS, sample_rows=DETECTOR_SAMPLE_ROWS,
+                  rows_per_class=CLASSIFIER_ROWS_PER_CLASS, seed=42, velocity=False):
+    """
+    One streaming pass over every file of a modality. The scaler sees every
+    row through partial_fit, while only bounded samples are kept, so memory
+    depends on chunk_rows and the sample sizes, not on the amount of data.
+    velocity: append the velocity features (extended schema), replaying the
+    files through a VelocityStore; files should be in time order by name.
+    Returns: dict with the fitted scaler, the IsolationForest sample, the
+    stratified classifier sample (X, y) and row counts
+    """
+    columns = _COLUMNS[modality]
+    rng = np.random.default_rng(seed)
+    scaler = StandardScaler()
+    store = VelocityStore(VELOCITY_MAX_KEYS, VELOCITY_MAX_PAIRS, VELOCITY_IDLE_SECONDS) if velocity else None
+    n_features = 11 + (_VELOCITY_KEYS[modality][2] if velocity else 0)
+    detector_sample = Reservoir(sample_rows, n_features, rng)
+    classifier_sample = StratifiedReservoir(rows_per_class, n_features, rng)
+    invalid = 0
+
+    files = data_files(path)
+    for file_path in files:
+        for frame in read_chunks(file_path, chunk_rows):
+            records = _records(frame)
+            features, errors = columns(records)
+            valid = np.ones(len(records), dtype=bool)
+            valid[list(errors)] = False
+            invalid += len(errors)
+            features = features[valid]
+            if not len(features):
+                continue
+            if store is not None:
+                features = np.hstack([features, _replay_velocity(store, modality, [
+                    records[i] for i in np.flatnonzero(valid)
+                ])])
+
+            scaler.partial_fit(features)
+            detector_sample.add(features)
+
+            if LABEL_COLUMN in frame:
+                labels = frame[LABEL_COLUMN].to_numpy(dtype=object)[valid]
+                labelled = np.array([isinstance(label, str) and label != '' for label in labels], dtype=bool)
+                if labelled.any():
+                    classifier_sample.add(features[labelled], labels[labelled])
+
+    return {
+        'files': files,
+        'rows': detector_sample.seen,
+        'invalid_rows': invalid,
+        'scaler': scaler,
+        'detector_sample': detector_sample.sample(),
+        'classifier_sample': classifier_sample.sample(),
+        'class_counts': classifier_sample.counts(),
+    }
+
+
+def load_training_data(path=DATA_PATH, **kwargs):
+    """
+    Scan path/network/ and path/email/ (CSV or Parquet records shaped like
+    the /predict payloads, plus an optional threat_type column)
+    Returns: dict of modality -> scan_modality() result, for modalities with data
+    """
+    scans = {}
+    for modality in ('network', 'email'):
+        modality_path = os.path.join(path, modality)
+        if not data_files(modality_path):
+            continue
+        print(f"Scanning {modality} data in {modality_path}...")
+        scans[modality] = scan_modality(modality, modality_path, **kwargs)
+        scan = scans[modality]
+        print(f"✅ {modality}: {scan['rows']} rows from {len(scan['files'])} files "
+              f"({scan['invalid_rows']} invalid skipped), classes {scan['class_counts']}")
+    return scans
@@ -0,0 +1,338 @@
+"""
+Microbenchmarks for the ML backend hot path.
+
+Run from ml_backend/:
+    python -m benchmarks.bench_hot_path                  # run and compare with the baseline
+    python -m benchmarks.bench_hot_path --save-baseline  # record a new baseline
+    python -m benchmarks.bench_hot_path --only extract,asgi --sizes 1,256
+
+Inputs are synthetic, derived from generate_sample_data() so runs are
+reproducible. Every case reports ops/sec, rows/sec and p50/p99 latency;
+with a baseline present, cases whose p50 got slower than --threshold
+are flagged and the exit code is 1.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import warnings
+from datetime import datetime, timedelta
+
+import numpy as np
+
+warnings.filterwarnings("ignore")
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_SIZES = (1, 64, 1024)
+
+
+def synthetic_inputs(n):
+    """Build n NetworkFeatures and n EmailFeatures from the training data generator"""
+    from app.models.schemas import NetworkFeatures, EmailFeatures
+    from app.utils.train_models import generate_sample_data
+
+    network_data, email_data = generate_sample_data()[:2]
+    rows = np.resize(np.arange(len(network_data)), n)
+    net, mail = np.abs(network_data[rows]), np.abs(email_data[rows])
+    start = datetime(2025, 1, 6)
+    protocols = ('tcp', 'udp', 'icmp')
+
+    network = [
+        NetworkFeatures(
+            timestamp=start + timedelta(minutes=int(i * 7)),
+            source_ip=f"10.0.{i % 256}.{(i * 7) % 256}",
+            destination_ip=f"192.168.{(i * 3) % 256}.{i % 256}",
+            protocol=protocols[i % 3],
+            packet_size=float(40 + x[0] * 500),
+            connection_duration=float(x[1] * 30),
+            port_number=int(x[2] * 4000) % 65536,
+            packets_sent=int(1 + x[3] * 100),
+            packets_received=int(x[4] * 100),
+            bytes_sent=float(x[5] * 50000),
+            bytes_received=float(x[6] * 50000),
+        )
+        for i, x in enumerate(net)
+    ]
+    email = [
+        EmailFeatures(
+            timestamp=start + timedelta(minutes=int(i * 11)),
+            sender_email=f"user{i % 97}@example{i % 5}.com",
+            receiver_email=f"peer{i % 89}@example.org",
+            num_recipients=int(1 + x[0] * 5),
+            email_size=float(x[1] * 20000),
+            has_attachment=bool(x[2] > 1),
+            num_attachments=int(x[3] * 2) if x[2] > 1 else 0,
+            subject_length=int(5 + x[4] * 30),
+            body_length=int(x[5] * 2000),
+            is_reply=bool(x[6] > 1),
+            is_forward=bool(x[7] > 1.5),
+        )
+        for i, x in enumerate(mail)
+    ]
+    return network, email
+
+
+def measure(fn, rows=1, min_time=0.5, max_iterations=10000, warmup=3):
+    """Time repeated calls of fn; returns ops/sec, rows/sec and latency percentiles"""
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < max_iterations and (len(samples) < 5 or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    samples = np.asarray(samples)
+    mean = samples.mean()
+    return {
+        'iterations': len(samples),
+        'ops_per_sec': 1 / mean,
+        'rows_per_sec': rows / mean,
+        'p50_ms': float(np.percentile(samples, 50) * 1e3),
+        'p99_ms': float(np.percentile(samples, 99) * 1e3),
+    }
+
+
+def measure_async(make_call, rows=1, min_time=0.5, max_iterations=2000, warmup=3):
+    """Like measure(), for coroutines run on one long-lived event loop"""
+    loop = asyncio.new_event_loop()
+    try:
+        return measure(lambda: loop.run_until_complete(make_call()), rows, min_time, max_iterations, warmup)
+    finally:
+        loop.close()
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallow the model loading banners"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def bench_extract(network, email, sizes, min_time):
+    from app.services.features import (
+        extract_network_features, extract_email_features, parse_records, network_columns, email_columns
+    )
+
+    network_body = '[' + ','.join(d.model_dump_json() for d in network) + ']'
+    email_body = '[' + ','.join(d.model_dump_json() for d in email) + ']'
+    network_records, email_records = parse_records(network_body), parse_records(email_body)
+
+    results = {}
+    for n in sizes:
+        results[f'extract_network_features[{n}]'] = measure(
+            lambda: np.vstack([extract_network_features(d) for d in network[:n]]), n, min_time)
+        results[f'extract_email_features[{n}]'] = measure(
+            lambda: np.vstack([extract_email_features(d) for d in email[:n]]), n, min_time)
+        results[f'network_columns[{n}]'] = measure(lambda: network_columns(network_records[:n]), n, min_time)
+        results[f'email_columns[{n}]'] = measure(lambda: email_columns(email_records[:n]), n, min_time)
+    results['parse_records[network body]'] = measure(lambda: parse_records(network_body), len(network), min_time)
+    return results
+
+
+def bench_detector(network, email, sizes, min_time):
+    from app.services.features import extract_network_features, extract_email_features
+    from app.models.anomaly_detector import AnomalyDetector
+
+    with quiet():
+        detector = AnomalyDetector()
+        detector.load_models()
+
+    X_net = np.vstack([extract_network_features(d) for d in network])
+    X_mail = np.vstack([extract_email_features(d) for d in email])
+    one_net, one_mail = X_net[0], X_mail[0]
+
+    results = {}
+    engines = [('sklearn', False)]
+    if detector.network_detector is not None:
+        engines.append(('compiled', True))
+
+    for engine_name, compiled in engines:
+        with quiet():
+            if compiled:
+                detector.compile_models()
+            else:
+                detector.network_engine = detector.email_engine = None
+
+        tag = f'@{engine_name}'
+        if detector.network_detector is not None:
+            results[f'predict_network_anomaly{tag}'] = measure(lambda: detector.predict_network_anomaly(one_net), 1, min_time)
+            results[f'classify_network_threat{tag}'] = measure(lambda: detector.classify_network_threat(one_net), 1, min_time)
+        if detector.email_detector is not None:
+            results[f'predict_email_anomaly{tag}'] = measure(lambda: detector.predict_email_anomaly(one_mail), 1, min_time)
+            results[f'classify_email_threat{tag}'] = measure(lambda: detector.classify_email_threat(one_mail), 1, min_time)
+
+        for n in sizes:
+            if detector.network_detector is not None:
+                results[f'predict_network_anomaly_batch[{n}]{tag}'] = measure(
+                    lambda: detector.predict_network_anomaly_batch(X_net[:n]), n, min_time)
+                results[f'classify_network_threat_batch[{n}]{tag}'] = measure(
+                    lambda: detector.classify_network_threat_batch(X_net[:n]), n, min_time)
+                results[f'score_network_batch[{n}]{tag}'] = measure(
+                    lambda: detector.score_network_batch(X_net[:n]), n, min_time)
+            if detector.email_detector is not None:
+                results[f'predict_email_anomaly_batch[{n}]{tag}'] = measure(
+                    lambda: detector.predict_email_anomaly_batch(X_mail[:n]), n, min_time)
+                results[f'classify_email_threat_batch[{n}]{tag}'] = measure(
+                    lambda: detector.classify_email_threat_batch(X_mail[:n]), n, min_time)
+                results[f'score_email_batch[{n}]{tag}'] = measure(
+                    lambda: detector.score_email_batch(X_mail[:n]), n, min_time)
+
+    return results
+
+
+def bench_load(min_time):
+    from app.models.anomaly_detector import AnomalyDetector
+
+    def load():
+        with quiet():
+            AnomalyDetector().load_models()
+
+    return {'load_models': measure(load, 1, min_time, max_iterations=20, warmup=1)}
+
+
+def bench_asgi(network, email, sizes, min_time):
+    try:
+        import httpx
+    except ImportError:
+        print("httpx is not installed, skipping the ASGI benchmarks (pip install httpx)")
+        return {}
+
+    with quiet():
+        from app.main import app, lifespan
+
+    net_json = [json.loads(d.model_dump_json()) for d in network]
+    mail_json = [json.loads(d.model_dump_json()) for d in email]
+    results = {}
+
+    async def run_all():
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+                async def post(path, payload):
+                    response = await client.post(path, json=payload)
+                    response.raise_for_status()
+
+                loop = asyncio.get_running_loop()
+
+                async def timed(make_call, rows, max_iterations=2000):
+                    samples = []
+                    for _ in range(3):
+                        await make_call()
+                    deadline = loop.time() + min_time
+                    while len(samples) < max_iterations and (len(samples) < 5 or loop.time() < deadline):
+                        start = time.perf_counter()
+                        await make_call()
+                        samples.append(time.perf_counter() - start)
+                    samples = np.asarray(samples)
+                    return {
+                        'iterations': len(samples),
+                        'ops_per_sec': 1 / samples.mean(),
+                        'rows_per_sec': rows / samples.mean(),
+                        'p50_ms': float(np.percentile(samples, 50) * 1e3),
+                        'p99_ms': float(np.percentile(samples, 99) * 1e3),
+                    }
+
+                results['asgi POST /predict/network'] = await timed(lambda: post('/predict/network', net_json[0]), 1)
+                results['asgi POST /predict/email'] = await timed(lambda: post('/predict/email', mail_json[0]), 1)
+                for n in sizes:
+                    body = {'data': [{'network': d, 'user_id': 'bench'} for d in net_json[:n]]}
+                    results[f'asgi POST /predict/batch[{n}]'] = await timed(lambda: post('/predict/batch', body), n)
+
+                # Concurrent single-row requests exercise the micro-batcher
+                for n in sizes:
+                    if n > 1:
+                        results[f'asgi POST /predict/network x{n} concurrent'] = await timed(
+                            lambda: asyncio.gather(*[post('/predict/network', d) for d in net_json[:n]]), n)
+
+    with quiet():
+        asyncio.run(run_all())
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the cases whose p50 latency regressed by more than threshold"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        change = result['p50_ms'] / base['p50_ms'] - 1 if base['p50_ms'] else 0.0
+        result['p50_change'] = change
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def print_report(results, regressions):
+    width = max(len(name) for name in results) if results else 10
+    print(f"\n{'case'.ljust(width)}  {'ops/s':>10}  {'rows/s':>12}  {'p50 ms':>9}  {'p99 ms':>9}  {'vs base':>8}")
+    for name, r in results.items():
+        change = f"{r['p50_change']:+.0%}" if 'p50_change' in r else ''
+        flag = '  << REGRESSION' if name in regressions else ''
+        print(f"{name.ljust(width)}  {r['ops_per_sec']:>10.1f}  {r['rows_per_sec']:>12.1f}  "
+              f"{r['p50_ms']:>9.3f}  {r['p99_ms']:>9.3f}  {change:>8}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='batch sizes, comma separated')
+    parser.add_argument('--only', default='extract,detector,load,asgi', help='groups to run, comma separated')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds to spend per case')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p50 slowdown flagged as a regression')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    groups = set(args.only.split(','))
+    network, email = synthetic_inputs(max(sizes))
+
+    results = {}
+    if 'extract' in groups:
+        results.update(bench_extract(network, email, sizes, args.min_time))
+    if 'detector' in groups:
+        results.update(bench_detector(network, email, sizes, args.min_time))
+    if 'load' in groups:
+        results.update(bench_load(args.min_time))
+    if 'asgi' in groups:
+        results.update(bench_asgi(network, email, sizes, args.min_time))
+
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    print_report(results, regressions)
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"\n⚠️  {len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
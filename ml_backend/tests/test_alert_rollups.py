@@ -0,0 +1,129 @@
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+from app.db.mongodb import AlertDatabase
+from app.services.alert_rollups import AlertRollups
+from app.api.alerts import triage
+from app.utils.backfill_rollups import backfill_rollups
+
+
+NOW = datetime.now(timezone.utc)
+
+
+def object_id(seconds_ago):
+    """A unique ObjectId generated `seconds_ago`"""
+    generated = ObjectId.from_datetime(NOW - timedelta(seconds=seconds_ago))
+    return ObjectId(generated.binary[:4] + os.urandom(8))
+
+
+def alert(seconds_ago, modality, is_anomaly=True, threat_class='ddos', reviewed=None, actor='10.0.0.1'):
+    document = {
+        '_id': object_id(seconds_ago),
+        'timestamp': (NOW - timedelta(seconds=seconds_ago)).replace(tzinfo=None),
+        'is_anomaly': is_anomaly,
+        'threat_class': threat_class,
+        'source_ip' if modality == 'network' else 'sender_email': actor,
+    }
+    if reviewed is not None:
+        document['reviewed'] = reviewed
+    return document
+
+
+def connect():
+    db = AlertDatabase()
+    db.connect(AsyncMongoMockClient())
+    return db
+
+
+async def seed(db, recent=0):
+    """Stored alerts an hour old and, optionally, `recent` ones younger than the ingest lag"""
+    network = [alert(3600 + i, 'network', is_anomaly=i % 3 != 0, threat_class=('ddos', 'port_scan')[i % 2],
+                     actor=f'10.0.0.{i % 4}') for i in range(20)]
+    email = [alert(3600 + i, 'email', is_anomaly=i % 2 == 0, threat_class=None, reviewed=i % 4 == 0,
+                   actor=f'user{i % 3}@example.com') for i in range(10)]
+    network += [alert(1, 'network', actor='10.9.9.9') for _ in range(recent)]
+    await db.collections['network'].insert_many(network)
+    await db.collections['email'].insert_many(email)
+
+
+async def stored_counts(db):
+    """What the rollups should hold: anomalies by modality, threat class and reviewed state"""
+    counts = Counter()
+    for modality, collection in db.collections.items():
+        async for document in collection.find({'is_anomaly': True}):
+            counts[modality, document.get('threat_class') or 'unclassified', document.get('reviewed') is True] += 1
+    return counts
+
+
+async def rollup_counts(db):
+    counts = Counter()
+    async for row in db.rollups['counts'].find({}):
+        if row['count']:
+            counts[row['modality'], row['threat_class'], row['reviewed']] += row['count']
+    return counts
+
+
+def test_ingest_counts_stored_anomalies_once_across_workers():
+    async def run():
+        db = connect()
+        await seed(db, recent=3)
+        workers = [AlertRollups(), AlertRollups()]
+        # Small batches and two workers claiming the same ranges at once
+        for _ in range(10):
+            await asyncio.gather(*(rollups.ingest(db.collections, db.rollups, batch_rows=3) for rollups in workers))
+
+        expected = await stored_counts(db)
+        # Alerts younger than the lag are left for a later ingest
+        expected['network', 'ddos', False] -= 3
+        assert await rollup_counts(db) == expected
+
+        counted = await workers[0].ingest(db.collections, db.rollups, lag=0)
+        assert counted == {'network': 3, 'email': 0}
+        assert await rollup_counts(db) == await stored_counts(db)
+
+    asyncio.run(run())
+
+
+def test_triage_moves_only_counted_alerts_and_matches_backfill():
+    async def run():
+        db = connect()
+        await seed(db, recent=2)
+        rollups = AlertRollups()
+        await rollups.ingest(db.collections, db.rollups)
+
+        # Review the recent network alerts (not counted yet) and the counted ddos ones, delete some email
+        await triage(db.collections, 'review', filters={'source_ip': '10.9.9.9'}, rollups=rollups,
+                     rollup_collections=db.rollups)
+        await triage(db.collections, 'review', filters={'threat_class': 'ddos'}, rollups=rollups,
+                     rollup_collections=db.rollups)
+        email_ids = [document['_id'] async for document in db.collections['email'].find({})][:5]
+        await triage(db.collections, 'delete', ids=email_ids, rollups=rollups, rollup_collections=db.rollups)
+        await rollups.ingest(db.collections, db.rollups, lag=0)
+
+        live = await rollup_counts(db)
+        assert live == await stored_counts(db)
+
+        await backfill_rollups(db, batch_rows=4)
+        # As after live counting, the youngest alerts are left to the next ingest
+        await AlertRollups().ingest(db.collections, db.rollups, lag=0)
+        assert await rollup_counts(db) == live
+
+    asyncio.run(run())
+
+
+def test_summary_reports_the_rolled_up_window():
+    async def run():
+        db = connect()
+        await seed(db)
+        await AlertRollups().ingest(db.collections, db.rollups)
+
+        until = NOW.replace(tzinfo=None)
+        summary = await AlertRollups.summary(db.rollups, until - timedelta(days=1), until, top=2)
+        assert summary['total'] == sum((await stored_counts(db)).values())
+        assert summary['by_modality'] == {'network': 13, 'email': 5}
+        assert len(summary['top_source_ips']) == 2
+
+    asyncio.run(run())
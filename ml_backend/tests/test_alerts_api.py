@@ -0,0 +1,162 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+from app.db.mongodb import database
+from app.main import app
+
+
+START = datetime(2026, 1, 1)
+
+
+@pytest.fixture(scope="module")
+def client():
+    database.close()
+    database.connect(AsyncMongoMockClient())
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def store(client):
+    """Empty alert collections; call store(modality, documents) to insert alerts"""
+    for collection in database.collections.values():
+        asyncio.run(collection.delete_many({}))
+
+    def insert(modality, documents):
+        asyncio.run(database.collections[modality].insert_many(documents))
+        return [document['_id'] for document in documents]
+    return insert
+
+
+def alerts(modality, n, **fields):
+    """n alerts (or, with is_anomaly=False, normal events) a minute apart from START, every third timestamp shared by two"""
+    return [
+        {
+            '_id': ObjectId(),
+            'timestamp': START + timedelta(minutes=i - i % 3 // 2),
+            'is_anomaly': True,
+            'threat_class': ('ddos', 'port_scan')[i % 2],
+            'source_ip' if modality == 'network' else 'sender_email': f'actor{i % 5}',
+            **fields,
+        }
+        for i in range(n)
+    ]
+
+
+def test_pages_cover_every_alert_once_newest_first(client, store):
+    store('network', alerts('network', 70) + alerts('network', 30, is_anomaly=False))
+    store('email', alerts('email', 45) + alerts('email', 10, is_anomaly=False))
+
+    seen, cursor = [], None
+    while True:
+        page = client.get('/api/alerts', params={'limit': 20, **({'cursor': cursor} if cursor else {})}).json()
+        seen += page['alerts']
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert len(seen) == 115
+    assert len({alert['_id'] for alert in seen}) == 115
+    keys = [(alert['timestamp'], alert['_id']) for alert in seen]
+    assert keys == sorted(keys, reverse=True)
+    assert {alert['modality'] for alert in seen} == {'network', 'email'}
+
+
+def test_filters_select_matching_alerts(client, store):
+    store('network', alerts('network', 30) + alerts('network', 10, is_anomaly=False, reviewed=False))
+    store('email', alerts('email', 30, reviewed=True))
+
+    page = client.get('/api/alerts', params={'limit': 500, 'threat_class': 'ddos', 'reviewed': 'false'}).json()
+    assert len(page['alerts']) == 15
+    assert all(alert['modality'] == 'network' and alert['threat_class'] == 'ddos' for alert in page['alerts'])
+
+    since = (START + timedelta(minutes=10)).isoformat()
+    page = client.get('/api/alerts', params={'limit': 500, 'since': since}).json()
+    assert len(page['alerts']) == 40
+    assert all(alert['timestamp'] >= since for alert in page['alerts'])
+
+
+def test_bad_paging_parameters_are_rejected(client, store):
+    assert client.get('/api/alerts', params={'cursor': 'not-a-cursor'}).status_code == 400
+    assert client.get('/api/alerts', params={'limit': 100000}).status_code == 422
+
+
+def test_review_and_delete_by_id(client, store):
+    network_ids = store('network', alerts('network', 2))
+    email_ids = store('email', alerts('email', 1))
+
+    assert client.patch(f'/api/alerts/{network_ids[0]}/review').status_code == 200
+    assert client.delete(f'/api/alerts/{email_ids[0]}').status_code == 200
+
+    remaining = client.get('/api/alerts').json()['alerts']
+    assert [(alert['_id'], alert.get('reviewed')) for alert in remaining] == [
+        (str(network_ids[1]), None), (str(network_ids[0]), True)
+    ]
+    assert client.delete(f'/api/alerts/{email_ids[0]}').status_code == 404
+    assert client.patch(f'/api/alerts/{ObjectId()}/review').status_code == 404
+    assert client.delete('/api/alerts/not-an-id').status_code == 400
+
+
+def test_requests_beyond_max_pending_get_503(client, store, monkeypatch):
+    monkeypatch.setattr(database, 'max_pending', 0)
+    response = client.get('/api/alerts')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(database.retry_after)
+
+    monkeypatch.undo()
+    stats = client.get('/health').json()['alerts_db']
+    assert stats['connected'] and stats['rejected'] >= 1
+
+
+def test_bulk_review_by_ids_counts_already_reviewed(client, store, monkeypatch):
+    # Batches smaller than the request, so the IDs go out in several writes
+    monkeypatch.setattr('app.api.alerts.ALERTS_TRIAGE_BATCH_SIZE', 3)
+    network_ids = store('network', alerts('network', 5))
+    email_ids = store('email', alerts('email', 4, reviewed=True))
+
+    ids = [str(_id) for _id in network_ids + email_ids]
+    response = client.post('/api/alerts/bulk/review', json={'ids': ids + ids[:2]}).json()
+    assert (response['matched'], response['modified']) == (9, 5)
+    assert response['collections'] == {
+        'network': {'matched': 5, 'modified': 5}, 'email': {'matched': 4, 'modified': 0}
+    }
+
+
+def test_bulk_delete_by_filter_skips_collections_without_the_field(client, store):
+    store('network', alerts('network', 10, source_ip='10.0.0.9'))
+    store('email', alerts('email', 10))
+
+    response = client.post('/api/alerts/bulk/delete', json={'filter': {'source_ip': '10.0.0.9'}}).json()
+    assert response['matched'] == response['modified'] == 10
+    assert set(response['collections']) == {'network'}
+
+    remaining = client.get('/api/alerts').json()['alerts']
+    assert len(remaining) == 10
+    assert {alert['modality'] for alert in remaining} == {'email'}
+
+
+def test_bulk_delete_by_filter_leaves_normal_events(client, store):
+    network_ids = store('network', alerts('network', 6, anomaly_score=0.2))
+    normal_ids = store('network', alerts('network', 6, is_anomaly=False, anomaly_score=0.2))
+    store('email', alerts('email', 4, is_anomaly=False, anomaly_score=0.1))
+
+    response = client.post('/api/alerts/bulk/delete', json={'filter': {'score_below': 0.5}}).json()
+    assert response['matched'] == response['modified'] == 6
+
+    remaining = asyncio.run(database.collections['network'].find({}).to_list(None))
+    assert sorted(document['_id'] for document in remaining) == sorted(normal_ids)
+    assert not set(network_ids) & {document['_id'] for document in remaining}
+    assert asyncio.run(database.collections['email'].count_documents({})) == 4
+
+
+@pytest.mark.parametrize('body', [
+    {},
+    {'ids': [], 'filter': {'reviewed': True}},
+    {'filter': {}},
+    {'ids': ['not-an-id']},
+])
+def test_bulk_requests_need_ids_or_a_filter(client, store, body):
+    assert client.post('/api/alerts/bulk/review', json=body).status_code == 400
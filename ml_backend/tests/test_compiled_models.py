@@ -0,0 +1,77 @@
+import json
+import numpy as np
+from sklearn.ensemble import IsolationForest, RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+from app.models import model_store
+from app.models.anomaly_detector import AnomalyDetector, NETWORK_FEATURE_NAMES, EMAIL_FEATURE_NAMES
+from app.models.registry import ModelRegistry, MANIFEST_FILE
+from app.models.tree_engine import CompiledModel, probe_rows, check_equivalence, is_equivalent
+
+
+def fitted(n_features, seed):
+    """A small scaler, IsolationForest and RandomForest fitted on random rows"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(100, 30, (300, n_features))
+    labels = np.array(['ddos', 'port_scan', 'phishing'])[rng.integers(0, 3, 300)]
+    scaler = StandardScaler().fit(X)
+    detector = IsolationForest(n_estimators=20, random_state=seed).fit(scaler.transform(X))
+    classifier = RandomForestClassifier(n_estimators=10, max_depth=6, random_state=seed).fit(X, labels)
+    return scaler, detector, classifier
+
+
+def trained_detector():
+    detector = AnomalyDetector()
+    detector.scaler_network, detector.network_detector, detector.network_threat_classifier = \
+        fitted(len(NETWORK_FEATURE_NAMES), 0)
+    detector.scaler_email, detector.email_detector, detector.email_threat_classifier = \
+        fitted(len(EMAIL_FEATURE_NAMES), 1)
+    return detector
+
+
+def test_compiled_engine_reproduces_sklearn():
+    for n_features, seed in ((len(NETWORK_FEATURE_NAMES), 0), (len(EMAIL_FEATURE_NAMES), 1)):
+        scaler, detector, classifier = fitted(n_features, seed)
+        engine = CompiledModel.from_sklearn(detector, scaler, classifier)
+        rows = probe_rows(scaler, n_features, seed=seed)
+
+        is_anomaly, anomaly_score, threat_class, probabilities = engine.predict(rows)
+        scaled = scaler.transform(rows)
+        assert (is_anomaly == (detector.predict(scaled) == -1)).all()
+        assert (threat_class == classifier.predict(rows)).all()
+        assert np.abs(anomaly_score - 1 / (1 + np.exp(detector.score_samples(scaled)))).max() <= 1e-12
+        assert np.abs(probabilities - classifier.predict_proba(rows)).max() <= 1e-12
+        assert is_equivalent(check_equivalence(engine, detector, scaler, classifier, rows))
+
+
+def test_equivalence_tolerance_bounds_scores_and_probabilities():
+    report = {'label_agreement': 1.0, 'max_score_diff': 1e-5, 'class_agreement': 1.0, 'max_proba_diff': 0.0}
+    assert not is_equivalent(report)
+    assert is_equivalent(report, tolerance=1e-4)
+    assert not is_equivalent(dict(report, max_score_diff=0.0, max_proba_diff=1e-5))
+
+
+def test_modalities_without_a_compiled_engine_keep_their_pickled_models(tmp_path):
+    path = f'{tmp_path}/'
+    detector = trained_detector()
+    detector.save_models(path)
+    detector.compile_models()
+    # As if compile_models had rejected the email engine
+    model_store.save_compiled_models({'network': detector.network_engine, 'email': None},
+                                     f'{path}{model_store.COMPILED_MODELS_FILE}')
+
+    served = AnomalyDetector()
+    served.load_compiled_models(path)
+    assert served.network_engine is not None and served.network_detector is None
+    assert served.email_engine is None and served.email_detector is not None
+
+    rows = detector.scaler_email.mean_ + np.zeros((3, len(EMAIL_FEATURE_NAMES)))
+    assert served.score_email_batch(rows)[0].tolist() == detector.score_email_batch(rows)[0].tolist()
+
+
+def test_published_versions_cover_the_compiled_models_file(tmp_path):
+    registry = ModelRegistry(f'{tmp_path}/registry/', legacy_path=f'{tmp_path}/')
+    version = registry.publish(trained_detector())
+
+    with open(f'{registry.version_path(version)}{MANIFEST_FILE}') as f:
+        assert model_store.COMPILED_MODELS_FILE in json.load(f)['files']
+    registry.verify(version)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from pydantic import ValidationError
+from app.models.schemas import NetworkFeatures, EmailFeatures
+from app.services import features
+from app.services.features import network_columns, email_columns, extract_network_features, extract_email_features
+
+
+NETWORK = {
+    'timestamp': '2026-03-01T12:30:05Z', 'source_ip': '10.0.0.1', 'destination_ip': '10.0.0.2', 'protocol': 'TCP',
+    'packet_size': 512.5, 'connection_duration': 1.25, 'port_number': 443, 'packets_sent': 12,
+    'packets_received': 10, 'bytes_sent': 4096, 'bytes_received': 2048.0,
+}
+EMAIL = {
+    'timestamp': '2026-03-01 08:00', 'sender_email': 'alice@example.com', 'receiver_email': 'bob@example.com',
+    'num_recipients': 2, 'email_size': 20480, 'has_attachment': True, 'num_attachments': 1,
+    'subject_length': 30, 'body_length': 800, 'is_reply': False, 'is_forward': 0,
+}
+
+# Values the two decoders could read differently, per field
+NETWORK_VARIANTS = {
+    'port_number': ['1e3', ' 12 ', '12', '١٢', 12.0, 12.5, True, None, 1e20, [12], float('nan')],
+    'packet_size': [' 12 ', '1e3', '١٢', '12', 'inf', False, {'v': 1}, 2 ** 70],
+    'timestamp': [
+        '٢٠٢٦-03-01T12:30:05', '2026-03-01T24:00:00', '2026-02-29T00:00:00', '2024-02-29T00:00:00',
+        '2026-03-01T12:30:05.123456789', '2026-03-01T12:30:05+0530', '2026-03-01t12:30', '2026-03-01',
+        '2026-03-01T12:30:60', '1999-12-31T23:59:59-2359', 1700000000, None,
+    ],
+    'protocol': ['udp', 'Tcp', 'tcp ', 6, None],
+}
+EMAIL_VARIANTS = {
+    'has_attachment': ['true', 'yes', 1, 1.0, 2, 0.5, None],
+    'num_recipients': ['3', ' 3', '3.0', '1e1', 3.0, False],
+    'email_size': ['20480', '2.5e3', ' 1 ', '١'],
+    'sender_email': ['a@b@c', 'no-at-sign', 'ü@exämple.com', 7],
+}
+
+
+def bodies(base, variants):
+    body = [dict(base, **{field: value}) for field, values in variants.items() for value in values]
+    return body + [base, None, [], {k: v for k, v in base.items() if k != 'timestamp'}]
+
+
+def pydantic_decode(records, model, extract):
+    """The reference: every row through the pydantic model"""
+    rows, errors = {}, set()
+    for i, record in enumerate(records):
+        try:
+            rows[i] = extract(model.model_validate(record)).astype(np.float32)
+        except ValidationError:
+            errors.add(i)
+    return rows, errors
+
+
+@pytest.mark.parametrize('base, variants, columns, model, extract', [
+    (NETWORK, NETWORK_VARIANTS, network_columns, NetworkFeatures, extract_network_features),
+    (EMAIL, EMAIL_VARIANTS, email_columns, EmailFeatures, extract_email_features),
+])
+def test_columnar_decoder_matches_pydantic(monkeypatch, base, variants, columns, model, extract):
+    records = bodies(base, variants)
+    expected_rows, expected_errors = pydantic_decode(records, model, extract)
+
+    for max_rows in (0, len(records)):
+        # Columnar, then the small-body path, over the same records
+        monkeypatch.setattr(features, 'PYDANTIC_MAX_ROWS', max_rows)
+        matrix, errors = columns(records)
+        assert set(errors) == expected_errors
+        for i, row in expected_rows.items():
+            assert matrix[i].tolist() == row.tolist(), records[i]
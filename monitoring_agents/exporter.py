@@ -0,0 +1,240 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+# Responses worth another attempt: rate limiting and server-side trouble
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _retry_after(response):
+    """Seconds the server asked to wait, if it sent a numeric Retry-After"""
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+class Exporter:
+    """
+    Ships agent events to the ML backend and the Node backend off the
+    caller's thread, shared by the network and email agents.
+
+    submit() puts an event on a bounded queue and never blocks; when the
+    queue is full the event is dropped and counted. A sender thread takes
+    up to `batch_size` events (waiting at most `max_wait` seconds for a
+    batch to fill), scores them with one request to the ML backend's bulk
+    endpoint, and saves each scored event to the Node backend with
+    `save_workers` requests in flight. Everything goes over one
+    requests.Session, so connections are pooled and kept alive instead of
+    paying a TCP/TLS handshake per call. Failed requests are retried
+    `retries` times with exponential backoff (honouring Retry-After).
+
+    enrich(event, context, prediction) turns a scored event into the
+    record saved to the Node backend (or None to skip saving it); it is
+    where an agent applies its own decision logic and logging. With
+    `drop_when_full=False`, submit() waits for room instead, which suits
+    replays that must not lose events.
+    """
+
+    def __init__(self, ml_url, api_url, token, enrich, max_queue=10000, batch_size=100, max_wait=1.0,
+                 save_workers=4, retries=3, backoff=0.5, timeout=10, drop_when_full=True):
+        self.ml_url = ml_url
+        self.api_url = api_url
+        self.enrich = enrich
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.drop_when_full = drop_when_full
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=save_workers + 1)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._savers = ThreadPoolExecutor(max_workers=save_workers, thread_name_prefix="exporter-save")
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(("submitted", "dropped", "scored", "saved", "failed", "retries", "batches"), 0)
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+    def submit(self, event, context=None):
+        """
+        Queue one event (a /predict record) for export; context travels with it to enrich()
+        Returns: False if the queue was full and the event was dropped
+        """
+        try:
+            self._queue.put((event, context), block=not self.drop_when_full)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("submitted")
+        return True
+
+    def start(self, report_every=None):
+        self._thread = threading.Thread(target=self._run, args=(report_every,), name="exporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=30):
+        """Send what is still queued (for up to `timeout` seconds), then release the connections"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._savers.shutdown(wait=True)
+        self.session.close()
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and not self._stopping.is_set():
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, report_every):
+        last_report = time.monotonic()
+        while True:
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._export(batch)
+                except Exception as e:
+                    self._count("failed", len(batch))
+                    print(f"⚠️  Export failed for {len(batch)} events: {e}")
+            elif self._stopping.is_set():
+                return
+            if report_every and time.monotonic() - last_report >= report_every:
+                last_report = time.monotonic()
+                print(f"📊 Exporter: {self.stats()}")
+
+    def _post(self, url, payload):
+        """POST with retries on connection errors and RETRY_STATUSES; returns the last response"""
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+                delay = _retry_after(response) or self.backoff * 2 ** attempt
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+            self._count("retries")
+            time.sleep(delay)
+
+    def _score(self, events):
+        """
+        Score a batch with one bulk request; rows the backend rejects are dropped
+        Returns: list of (index into events, prediction)
+        """
+        rows = list(range(len(events)))
+        response = self._post(self.ml_url, [events[i] for i in rows])
+        if response.status_code == 422 and isinstance(response.json().get("detail"), list):
+            invalid = {rows[item["row"]] for item in response.json()["detail"] if "row" in item}
+            print(f"⚠️  ML backend rejected {len(invalid)} events: {response.json()['detail'][:3]}")
+            self._count("failed", len(invalid))
+            rows = [i for i in rows if i not in invalid]
+            if not rows:
+                return []
+            response = self._post(self.ml_url, [events[i] for i in rows])
+        if response.status_code != 200:
+            raise RuntimeError(f"ML API error {response.status_code}: {response.text[:200]}")
+        return list(zip(rows, response.json()))
+
+    def _save(self, record):
+        try:
+            response = self._post(self.api_url, record)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{response.status_code}: {response.text[:200]}")
+            self._count("saved")
+        except Exception as e:
+            self._count("failed")
+            print(f"⚠️  Save failed: {e}")
+
+    def _records(self, batch):
+        """Score a batch and turn it into the records to save"""
+        events = [event for event, _ in batch]
+        scored = self._score(events)
+        self._count("scored", len(scored))
+        records = []
+        for i, prediction in scored:
+            record = self.enrich(events[i], batch[i][1], prediction)
+            if record is not None:
+                records.append(record)
+        return records
+
+    def _write(self, records):
+        saves = [self._savers.submit(self._save, record) for record in records]
+        for save in saves:
+            save.result()
+
+    def _export(self, batch):
+        started = time.monotonic()
+        self._write(self._records(batch))
+        self._count("batches")
+
+        latency = time.monotonic() - started
+        with self._lock:
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+            batches = counts["batches"]
+            return {
+                **counts,
+                "queued": self._queue.qsize(),
+                "max_queue": self._queue.maxsize,
+                "batch_latency_avg": round(self.latency_total / batches, 3) if batches else None,
+                "batch_latency_max": round(self.latency_max, 3),
+            }
+
+
+class JsonlExporter(Exporter):
+    """
+    Exporter that appends records to a JSON Lines file instead of saving
+    them to the Node backend, for replays and throughput measurements
+    without a backend. Events are scored first when `ml_url` is given
+    (e.g. a local ML backend), otherwise written as submitted.
+    """
+
+    def __init__(self, path, ml_url=None, enrich=None, **kwargs):
+        super().__init__(ml_url, None, None, enrich or (lambda event, context, prediction: {**event, **prediction}),
+                         **kwargs)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _records(self, batch):
+        if self.ml_url is None:
+            return [event for event, _ in batch]
+        return super()._records(batch)
+
+    def _write(self, records):
+        self._file.writelines(json.dumps(record) + "\n" for record in records)
+        self._file.flush()
+        self._count("saved", len(records))
+
+    def stop(self, timeout=30):
+        super().stop(timeout)
+        self._file.close()
@@ -0,0 +1,270 @@
+import socket
+import struct
+import threading
+from datetime import datetime
+
+# Kernel-side capture filter: only IPv4 TCP/UDP packets ever reach Python
+BPF_FILTER = "ip and (tcp or udp)"
+
+PROTOCOLS = {6: "tcp", 17: "udp"}
+
+_ETH_P_IP = 0x0800
+_ETH_P_VLAN = (0x8100, 0x88a8)
+
+# Link-layer header length by the scapy class a socket reports its frames as;
+# Ethernet frames are walked for VLAN tags instead
+LINK_OFFSETS = {"CookedLinux": 16, "CookedLinuxV2": 20, "Loopback": 4, "IP": 0, "IPv46": 0, "Raw": 0}
+
+# IPv4 header: version/IHL, total length, flags/fragment offset, protocol, source, destination
+_IPV4 = struct.Struct("!BxHxxHxB2x4s4s")
+_PORTS = struct.Struct("!HH")
+_ETHERTYPE = struct.Struct("!H")
+
+# Flow key: lower (address, port) end first, then the higher one, then the protocol
+_KEY = struct.Struct("!4s4sHHB")
+
+
+def ip_offset(frame, link):
+    """Offset of the IPv4 header in a captured frame, or None if it carries none"""
+    if link != "Ether":
+        return LINK_OFFSETS.get(link)
+    if len(frame) < 14:
+        return None
+    offset = 12
+    ethertype = _ETHERTYPE.unpack_from(frame, offset)[0]
+    while ethertype in _ETH_P_VLAN and len(frame) >= offset + 6:
+        offset += 4
+        ethertype = _ETHERTYPE.unpack_from(frame, offset)[0]
+    return offset + 2 if ethertype == _ETH_P_IP else None
+
+
+def parse_packet(frame, link="Ether"):
+    """
+    Pull the flow fields out of a raw IPv4 TCP/UDP frame
+    Returns: (src, dst, proto, sport, dport) with 4-byte addresses, or None
+    """
+    offset = ip_offset(frame, link)
+    if offset is None or len(frame) < offset + 20:
+        return None
+    version_ihl, _, fragment, proto, src, dst = _IPV4.unpack_from(frame, offset)
+    if version_ihl >> 4 != 4 or proto not in PROTOCOLS:
+        return None
+
+    # Only the first fragment carries the ports; later ones count towards the port-less flow
+    sport = dport = 0
+    ports_at = offset + (version_ihl & 0x0F) * 4
+    if not fragment & 0x1FFF and len(frame) >= ports_at + 4:
+        sport, dport = _PORTS.unpack_from(frame, ports_at)
+    return src, dst, proto, sport, dport
+
+
+def flow_key(src, dst, proto, sport, dport):
+    """Packed bidirectional 5-tuple: both directions of a conversation get the same 13 bytes"""
+    if (src, sport) <= (dst, dport):
+        return _KEY.pack(src, dst, sport, dport, proto)
+    return _KEY.pack(dst, src, dport, sport, proto)
+
+
+class FlowRecord:
+    """
+    Counters of one bidirectional flow. The side that sent the first packet
+    seen is the source: its packets count as sent, the other side's as received.
+    """
+
+    __slots__ = ("src", "dst", "sport", "dport", "proto", "start", "last",
+                 "packets_sent", "bytes_sent", "packets_received", "bytes_received")
+
+    def __init__(self, src, dst, proto, sport, dport, t):
+        self.src = src
+        self.dst = dst
+        self.proto = proto
+        self.sport = sport
+        self.dport = dport
+        self.start = self.last = t
+        self.packets_sent = self.bytes_sent = 0
+        self.packets_received = self.bytes_received = 0
+
+    def add(self, src, sport, length, t):
+        """Count one packet of the flow"""
+        if src == self.src and sport == self.sport:
+            self.packets_sent += 1
+            self.bytes_sent += length
+        else:
+            self.packets_received += 1
+            self.bytes_received += length
+        if t > self.last:
+            self.last = t
+
+    @property
+    def packets(self):
+        return self.packets_sent + self.packets_received
+
+    def payload(self):
+        """The flow as a /predict/network record"""
+        return {
+            "timestamp": datetime.fromtimestamp(self.last).isoformat(),
+            "source_ip": socket.inet_ntoa(self.src),
+            "destination_ip": socket.inet_ntoa(self.dst),
+            "protocol": PROTOCOLS[self.proto],
+            "packet_size": (self.bytes_sent + self.bytes_received) / max(self.packets, 1),
+            "connection_duration": self.last - self.start,
+            "port_number": self.dport,
+            "packets_sent": self.packets_sent,
+            "packets_received": self.packets_received,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel: `levels` rings of `slots` buckets, where a
+    level-0 bucket spans `tick` seconds and each level's bucket spans a
+    whole ring of the level below. Scheduling is O(1) and advance() touches
+    only the buckets that come due (plus one cascade per ring turn), so
+    expiry costs O(expired) rather than O(scheduled). Deadlines beyond the
+    wheel's span fire at its edge and are meant to be rescheduled. The
+    first advance() sets the wheel's clock; schedule only after it.
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=3):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = None
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._span = slots ** levels
+
+    def schedule(self, item, deadline):
+        """Fire item at the first advance() past `deadline` seconds"""
+        tick = -int(-deadline // self.tick)
+        delta = min(max(tick - self.current, 1), self._span - 1)
+        tick = self.current + delta
+        for level in range(self.levels):
+            if delta < self.slots ** (level + 1):
+                self._wheels[level][(tick // self.slots ** level) % self.slots].append((tick, item))
+                return
+
+    def advance(self, now):
+        """
+        Move the wheel to `now` seconds
+        Returns: items whose deadline has passed, in deadline order
+        """
+        target = int(now // self.tick)
+        if self.current is None:
+            self.current = target
+        due = []
+        while self.current < target:
+            self.current += 1
+            # Entering a new bucket of a higher level moves its items down, highest level first
+            for level in range(self.levels - 1, 0, -1):
+                if self.current % self.slots ** level == 0:
+                    bucket = self._wheels[level][(self.current // self.slots ** level) % self.slots]
+                    entries = bucket[:]
+                    bucket.clear()
+                    for tick, item in entries:
+                        self._place(tick, item)
+            bucket = self._wheels[0][self.current % self.slots]
+            due.extend(item for _, item in bucket)
+            bucket.clear()
+        return due
+
+    def _place(self, tick, item):
+        delta = max(tick - self.current, 0)
+        for level in range(self.levels):
+            if delta < self.slots ** (level + 1):
+                self._wheels[level][(tick // self.slots ** level) % self.slots].append((tick, item))
+                return
+
+
+class FlowTable:
+    """
+    Thread-safe table of live flows with NetFlow-style expiry.
+
+    A flow ends when it has `export_packets` packets, has been idle for
+    `idle_timeout` seconds, or has been open for `active_timeout` seconds;
+    ended flows are handed to `on_expire(flow, reason)`, which must not
+    block (it runs under the table lock; put the flow on a queue). Timeouts
+    run off a TimingWheel: a flow is scheduled once and, when its bucket
+    comes due, either expires or is rescheduled to its new deadline, so
+    packets never touch the wheel. Beyond `max_flows` flows, `overflow`
+    decides: 'export-oldest' ends the oldest flow early, 'drop-new' leaves
+    packets of new flows uncounted.
+    """
+
+    OVERFLOW_POLICIES = ("export-oldest", "drop-new")
+
+    def __init__(self, on_expire, idle_timeout=15, active_timeout=30, export_packets=10,
+                 max_flows=200000, overflow="export-oldest", tick=1.0):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {self.OVERFLOW_POLICIES}")
+        self.on_expire = on_expire
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.export_packets = export_packets
+        self.max_flows = max_flows
+        self.overflow = overflow
+        self.expired = dict.fromkeys(("packets", "idle", "active", "overflow", "flush"), 0)
+        self.dropped_packets = 0
+        self._flows = {}
+        self._wheel = TimingWheel(tick)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._flows)
+
+    def _deadline(self, flow):
+        return min(flow.last + self.idle_timeout, flow.start + self.active_timeout)
+
+    def _end(self, key, reason):
+        flow = self._flows.pop(key)
+        self.expired[reason] += 1
+        self.on_expire(flow, reason)
+
+    def add(self, fields, length, t):
+        """Count one parsed packet (see parse_packet) of `length` bytes seen at time t"""
+        src, dst, proto, sport, dport = fields
+        key = flow_key(src, dst, proto, sport, dport)
+        with self._lock:
+            flow = self._flows.get(key)
+            if flow is None:
+                if self._wheel.current is None:
+                    self._wheel.advance(t)
+                if len(self._flows) >= self.max_flows:
+                    if self.overflow == "drop-new":
+                        self.dropped_packets += 1
+                        return
+                    # Dicts keep insertion order: the first key is the flow that started first
+                    self._end(next(iter(self._flows)), "overflow")
+                flow = self._flows[key] = FlowRecord(src, dst, proto, sport, dport, t)
+                self._wheel.schedule((key, flow), self._deadline(flow))
+            flow.add(src, sport, length, t)
+            if flow.packets >= self.export_packets:
+                self._end(key, "packets")
+
+    def expire(self, now):
+        """End the flows whose idle or active timeout has passed by `now`"""
+        with self._lock:
+            for key, flow in self._wheel.advance(now):
+                if self._flows.get(key) is not flow:
+                    # Ended already (packets, overflow) and maybe replaced by a newer flow
+                    continue
+                deadline = self._deadline(flow)
+                if deadline > now:
+                    self._wheel.schedule((key, flow), deadline)
+                else:
+                    self._end(key, "idle" if flow.last + self.idle_timeout <= now else "active")
+
+    def flush(self):
+        """End every flow, e.g. on shutdown"""
+        with self._lock:
+            for key in list(self._flows):
+                self._end(key, "flush")
+
+    def stats(self):
+        return {
+            "flows": len(self._flows),
+            "max_flows": self.max_flows,
+            "expired": dict(self.expired),
+            "dropped_packets": self.dropped_packets,
+        }
@@ -1,23 +1,29 @@
+import argparse
+import threading
 import time
 import requests
-from scapy.all import sniff, IP, TCP, UDP
-from collections import defaultdict
-from datetime import datetime
+from scapy.all import RawPcapReader, conf
+from flows import BPF_FILTER, FlowTable, parse_packet
+from exporter import Exporter, JsonlExporter
 
 API_URL = "https://anomaly-detection-behavioral-analytics.onrender.com/api/network/submit"
-ML_API_URL = "https://anomaly-detection-ml-backend.onrender.com/predict/network"
+ML_API_URL = "https://anomaly-detection-ml-backend.onrender.com/predict/network/bulk"
 LOGIN_URL = "https://anomaly-detection-behavioral-analytics.onrender.com/api/auth/login"
 
-# Track flows (connections)
-flows = defaultdict(lambda: {
-    "packets_sent": 0,
-    "packets_received": 0,
-    "bytes_sent": 0,
-    "bytes_received": 0,
-    "start_time": None,
-    "protocol": None,
-    "port": 0
-})
+# A flow is exported once it has this many packets, after IDLE_TIMEOUT seconds
+# without packets or ACTIVE_TIMEOUT seconds after it started
+FLOW_EXPORT_PACKETS = 10
+IDLE_TIMEOUT = 15
+ACTIVE_TIMEOUT = 30
+
+# Most flows tracked at once, and what happens to new flows beyond that
+MAX_FLOWS = 200000
+OVERFLOW_POLICY = "export-oldest"
+
+# Ended flows waiting for export; beyond this they are dropped, never waited on
+EXPORT_QUEUE_SIZE = 10000
+
+exporter = None
 
 def login():
     """Login to web app and get authentication token"""
@@ -41,143 +47,156 @@ def login():
         print(f"❌ Error connecting to server: {e}")
         exit(1)
 
-TOKEN = login()
-
-def get_flow_key(packet):
-    """Create unique flow identifier"""
-    if packet.haslayer(IP):
-        ip = packet[IP]
-        return f"{ip.src}:{ip.dst}"
-    return None
-
-def get_protocol(packet):
-    """Get protocol type"""
-    if packet.haslayer(TCP):
-        return "tcp"
-    elif packet.haslayer(UDP):
-        return "udp"
+def hand_off(flow, reason):
+    """Queue an ended flow for export; called under the flow table lock, so it never blocks"""
+    exporter.submit(flow.payload())
+
+def enrich_flow(ml_payload, _, ml_result):
+    """Record saved to the backend for a scored flow"""
+    src_ip, dst_ip = ml_payload["source_ip"], ml_payload["destination_ip"]
+    if ml_result["is_anomaly"]:
+        print(f"⚠️  ANOMALY: {src_ip} → {dst_ip}")
+        print(f"   Threat: {ml_result['threat_class']} (Confidence: {ml_result['confidence']:.2%})")
+        print(f"   Packets: {ml_payload['packets_sent']}/{ml_payload['packets_received']}, "
+              f"Bytes: {ml_payload['bytes_sent']}/{ml_payload['bytes_received']}, Port: {ml_payload['port_number']}\n")
     else:
-        return "other"
-
-def update_flow(packet):
-    """Update flow statistics"""
-    if not packet.haslayer(IP):
-        return None
-
-    flow_key = get_flow_key(packet)
-    if not flow_key:
-        return None
-
-    ip = packet[IP]
-    flow = flows[flow_key]
-
-    # Initialize flow if new
-    if flow["start_time"] is None:
-        flow["start_time"] = time.time()
-        flow["protocol"] = get_protocol(packet)
-
-        # Get port number
-        if packet.haslayer(TCP):
-            flow["port"] = packet[TCP].dport
-        elif packet.haslayer(UDP):
-            flow["port"] = packet[UDP].dport
-
-    # Update counters
-    flow["packets_sent"] += 1
-    flow["bytes_sent"] += len(packet)
-
-    return flow_key
-
-def send_flow_data(flow_key):
-    """Send aggregated flow data to ML API"""
-    flow = flows[flow_key]
-    src_ip, dst_ip = flow_key.split(":")
-
-    duration = time.time() - flow["start_time"]
-
-    ml_payload = {
-        "timestamp": datetime.now().isoformat(),
-        "source_ip": src_ip,
-        "destination_ip": dst_ip,
-        "protocol": flow["protocol"],
-        "packet_size": flow["bytes_sent"] / max(flow["packets_sent"], 1),
-        "connection_duration": duration,
-        "port_number": flow["port"],
-        "packets_sent": flow["packets_sent"],
-        "packets_received": flow["packets_received"],
-        "bytes_sent": flow["bytes_sent"],
-        "bytes_received": flow["bytes_received"]
+        print(f"✅ Normal: {src_ip} → {dst_ip} (Port {ml_payload['port_number']})")
+
+    return {
+        **ml_payload,
+        "is_anomaly": ml_result["is_anomaly"],
+        "anomaly_score": ml_result["anomaly_score"],
+        "threat_class": ml_result["threat_class"],
+        "confidence": ml_result["confidence"]
     }
 
-    headers = {
-        "Authorization": f"Bearer {TOKEN}",
-        "Content-Type": "application/json"
-    }
-
-    try:
-        # Send to ML backend
-        ml_response = requests.post(ML_API_URL, json=ml_payload)
-
-        if ml_response.status_code == 200:
-            ml_result = ml_response.json()
-
-            data = {
-                **ml_payload,
-                "is_anomaly": ml_result["is_anomaly"],
-                "anomaly_score": ml_result["anomaly_score"],
-                "threat_class": ml_result["threat_class"],
-                "confidence": ml_result["confidence"]
-            }
-
-            resp = requests.post(API_URL, json=data, headers=headers)
-
-            if ml_result["is_anomaly"]:
-                print(f"⚠️  ANOMALY: {src_ip} → {dst_ip}")
-                print(f"   Threat: {ml_result['threat_class']} (Confidence: {ml_result['confidence']:.2%})")
-                print(f"   Packets: {flow['packets_sent']}, Bytes: {flow['bytes_sent']}, Port: {flow['port']}\n")
-            else:
-                print(f"✅ Normal: {src_ip} → {dst_ip} (Port {flow['port']})")
-
-        else:
-            print(f"ML API error: {ml_response.status_code}")
-
-    except Exception as e:
-        print(f"Error: {e}")
-
-def process_packet(packet):
-    """Process captured packet"""
-    flow_key = update_flow(packet)
-
-    if flow_key:
-        flow = flows[flow_key]
-
-        if flow["packets_sent"] >= 10:
-            send_flow_data(flow_key)
-            del flows[flow_key]
-
-def periodic_send():
-    """Periodically send old flows"""
+def expire_flows(table):
+    """Advance the flow table's timers once a second, also while no packets arrive"""
     while True:
-        time.sleep(30)
-        current_time = time.time()
-
-        flows_to_send = []
-        for flow_key, flow in list(flows.items()):
-            if flow["start_time"] and (current_time - flow["start_time"]) > 30:
-                flows_to_send.append(flow_key)
-
-        for flow_key in flows_to_send:
-            send_flow_data(flow_key)
-            del flows[flow_key]
+        time.sleep(1)
+        table.expire(time.time())
+
+def capture(table, iface=None, bpf=BPF_FILTER):
+    """
+    Read raw frames matching the BPF filter, which the kernel (or Npcap)
+    applies before anything is copied to Python; frames are never dissected
+    by scapy, only the header fields a flow needs are unpacked.
+    """
+    sock = conf.L2listen(iface=iface, filter=bpf)
+    try:
+        while True:
+            link, frame, t = sock.recv_raw()
+            if frame is None:
+                continue
+            fields = parse_packet(frame, link.__name__ if link is not None else "Ether")
+            if fields is not None:
+                table.add(fields, len(frame), t or time.time())
+    finally:
+        sock.close()
+
+def packet_info(reader, meta):
+    """Capture time and link type of a packet read from a pcap or pcapng file"""
+    if hasattr(meta, "tshigh"):
+        return ((meta.tshigh << 32) | meta.tslow) / meta.tsresol, meta.linktype
+    return meta.sec + meta.usec / (1e9 if reader.nano else 1e6), reader.linktype
+
+def replay(table, paths, timing="fastest"):
+    """
+    Stream pcap/pcapng files through the flow table one packet at a time,
+    with the capture timestamps as its clock, so flows end as they did on
+    the wire. 'original' timing sleeps to keep the gaps between packets,
+    'fastest' never waits.
+    Returns: number of packets read
+    """
+    packets = 0
+    next_tick = first = started = None
+    links = {}
+    for path in paths:
+        with RawPcapReader(path) as reader:
+            for frame, meta in reader:
+                packets += 1
+                t, linktype = packet_info(reader, meta)
+                if linktype not in links:
+                    layer = conf.l2types.num2layer.get(linktype)
+                    links[linktype] = layer.__name__ if layer is not None else None
+
+                if timing == "original":
+                    if first is None:
+                        first, started = t, time.monotonic()
+                    delay = (t - first) - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+
+                if next_tick is None or t >= next_tick:
+                    table.expire(t)
+                    next_tick = int(t) + 1
+                fields = parse_packet(frame, links[linktype])
+                if fields is not None:
+                    table.add(fields, meta.wirelen, t)
+    return packets
+
+def run_replay(table, paths, timing):
+    """Replay capture files, end the flows left, and report throughput"""
+    started = time.monotonic()
+    packets = replay(table, paths, timing)
+    table.flush()
+    read = time.monotonic() - started
+    exporter.stop(timeout=None)
+    elapsed = time.monotonic() - started
+
+    stats = exporter.stats()
+    flows = sum(table.expired.values())
+    print(f"\n📊 Replayed {packets} packets into {flows} flows in {elapsed:.2f}s")
+    print(f"   Capture: {packets / max(read, 1e-9):,.0f} packets/s, {flows / max(read, 1e-9):,.0f} flows/s")
+    print(f"   End to end: {flows / max(elapsed, 1e-9):,.0f} flows/s exported")
+    print(f"   Export: {stats['saved']} saved, {stats['failed']} failed, {stats['retries']} retries, "
+          f"batch latency avg {stats['batch_latency_avg']}s, max {stats['batch_latency_max']}s")
+    print(f"   Flow table: {table.stats()}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capture network flows and score them with the ML backend")
+    parser.add_argument("--iface", help="interface to capture on (default: scapy's default interface)")
+    parser.add_argument("--filter", default=BPF_FILTER, help=f"BPF capture filter (default: {BPF_FILTER!r})")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT, help="seconds without packets that end a flow")
+    parser.add_argument("--active-timeout", type=float, default=ACTIVE_TIMEOUT, help="seconds after which a flow is exported")
+    parser.add_argument("--max-flows", type=int, default=MAX_FLOWS, help="most flows tracked at once")
+    parser.add_argument("--overflow", choices=FlowTable.OVERFLOW_POLICIES, default=OVERFLOW_POLICY,
+                        help="beyond --max-flows: export the oldest flow early, or ignore new flows")
+    parser.add_argument("--replay", nargs="+", metavar="PCAP", help="read pcap/pcapng files instead of capturing live")
+    parser.add_argument("--timing", choices=("original", "fastest"), default="fastest",
+                        help="replay at the captured pace, or as fast as possible")
+    parser.add_argument("--output", metavar="JSONL", help="append flows to this file instead of the backend")
+    parser.add_argument("--ml-url", help=f"bulk scoring endpoint (default: {ML_API_URL}; none with --output)")
+    parser.add_argument("--api-url", default=API_URL, help="endpoint flows are saved to")
+    parser.add_argument("--token", help="backend token (default: log in)")
+    args = parser.parse_args()
+
     print("\n" + "="*60)
     print("NETWORK MONITOR - ML-POWERED ANOMALY DETECTION")
     print("="*60)
-    print("\n📡 Monitoring network traffic (Ctrl+C to stop)...\n")
 
-    import threading
-    sender_thread = threading.Thread(target=periodic_send, daemon=True)
-    sender_thread.start()
-
-    sniff(prn=process_packet, store=False)
+    # Replays must not lose flows: the replay waits for the exporter instead of dropping
+    drop_when_full = not args.replay
+    if args.output:
+        exporter = JsonlExporter(args.output, args.ml_url, enrich_flow if args.ml_url else None,
+                                 max_queue=EXPORT_QUEUE_SIZE, drop_when_full=drop_when_full)
+    else:
+        exporter = Exporter(args.ml_url or ML_API_URL, args.api_url, args.token or login(), enrich_flow,
+                            max_queue=EXPORT_QUEUE_SIZE, drop_when_full=drop_when_full)
+    exporter.start(report_every=60)
+    table = FlowTable(hand_off, args.idle_timeout, args.active_timeout, FLOW_EXPORT_PACKETS,
+                      args.max_flows, args.overflow)
+
+    if args.replay:
+        print(f"\n📼 Replaying {len(args.replay)} capture file(s) ({args.timing} timing)...\n")
+        run_replay(table, args.replay, args.timing)
+    else:
+        print("\n📡 Monitoring network traffic (Ctrl+C to stop)...\n")
+        threading.Thread(target=expire_flows, args=(table,), daemon=True).start()
+
+        try:
+            capture(table, args.iface, args.filter)
+        except KeyboardInterrupt:
+            table.flush()
+            exporter.stop()
+            print(f"\n🛑 Stopped: {table.stats()}, exporter: {exporter.stats()}")
@@ -0,0 +1,204 @@
+import base64
+import httplib2
+from googleapiclient.errors import HttpError
+import email_monitor
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"")
+
+
+class FakeRequest:
+    def __init__(self, run):
+        self.run = run
+
+    def execute(self):
+        return self.run()
+
+
+class FakeBatch:
+    def __init__(self, callback, log):
+        self.callback = callback
+        self.requests = []
+        log.append(self)
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+
+class FakeGmail:
+    """
+    The slice of the Gmail API service the email agent uses, over an
+    in-memory mailbox; listings come back in pages of `page_size`
+    """
+
+    def __init__(self, page_size=2):
+        self.page_size = page_size
+        self.messages_by_id = {}
+        self.history_records = []
+        self.history_id = 100
+        self.history_expired = False
+        self.failures = {}
+        self.batches = []
+        self.fetch_fields = set()
+
+    def deliver(self, msg_id, subject, unread=True):
+        self.history_id += 1
+        self.messages_by_id[msg_id] = {"unread": unread, "message": {
+            "id": msg_id,
+            "sizeEstimate": 2048,
+            "payload": {
+                "headers": [
+                    {"name": "From", "value": "alice@example.com"},
+                    {"name": "To", "value": "bob@example.com"},
+                    {"name": "Subject", "value": subject},
+                ],
+                "parts": [
+                    {"mimeType": "text/plain", "filename": "",
+                     "body": {"data": base64.urlsafe_b64encode(b"hello").decode()}},
+                    {"mimeType": "application/pdf", "filename": "report.pdf", "body": {}},
+                ],
+            },
+        }}
+        self.history_records.append({"id": str(self.history_id), "messagesAdded": [
+            {"message": {"id": msg_id, "labelIds": ["INBOX", "UNREAD"]}}
+        ]})
+
+    def _page(self, items, page_token):
+        start = int(page_token or 0)
+        end = start + self.page_size
+        return items[start:end], (str(end) if end < len(items) else None)
+
+    # service.users() / .messages() / .history() all resolve to this object
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return self
+
+    def getProfile(self, userId):
+        return FakeRequest(lambda: {"historyId": str(self.history_id)})
+
+    def list(self, userId, pageToken=None, startHistoryId=None, **params):
+        def run():
+            if startHistoryId is None:
+                unread = [{"id": i} for i, m in self.messages_by_id.items() if m["unread"]]
+                page, token = self._page(unread, pageToken)
+                return {"messages": page, **({"nextPageToken": token} if token else {})}
+            if self.history_expired:
+                raise http_error(404)
+            records = [r for r in self.history_records if int(r["id"]) > int(startHistoryId)]
+            page, token = self._page(records, pageToken)
+            return {"history": page, "historyId": str(self.history_id), **({"nextPageToken": token} if token else {})}
+        return FakeRequest(run)
+
+    def get(self, userId, id, format, fields):
+        self.fetch_fields.add((format, fields))
+
+        def run():
+            if self.failures.get(id):
+                self.failures[id] -= 1
+                raise http_error(429)
+            if id not in self.messages_by_id:
+                raise http_error(404)
+            return self.messages_by_id[id]["message"]
+        return FakeRequest(run)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback, self.batches)
+
+
+class FakeExporter:
+    """Records queued subjects; refuses submissions once `room` is used up"""
+
+    def __init__(self, room=None):
+        self.subjects = []
+        self.room = room
+
+    def submit(self, event, context=None):
+        if self.room is not None:
+            if self.room == 0:
+                return False
+            self.room -= 1
+        self.subjects.append(context["subject"])
+        return True
+
+
+def test_first_sync_scores_the_unread_inbox_across_pages():
+    gmail, exporter = FakeGmail(), FakeExporter()
+    for i in range(5):
+        gmail.deliver(f"m{i}", f"old {i}", unread=i != 2)
+
+    history_id, retry = email_monitor.sync_once(gmail, None, exporter)
+
+    assert exporter.subjects == ["old 0", "old 1", "old 3", "old 4"]
+    assert (history_id, retry) == ("105", [])
+    assert gmail.fetch_fields == {("full", email_monitor.MESSAGE_FIELDS)}
+
+
+def test_incremental_sync_pages_history_batches_fetches_and_retries():
+    gmail, exporter = FakeGmail(), FakeExporter()
+    gmail.deliver("m0", "old")
+    history_id, _ = email_monitor.sync_once(gmail, None, exporter)
+
+    for i in range(1, 6):
+        gmail.deliver(f"m{i}", f"new {i}")
+    gmail.failures["m3"] = 1
+    batches_before = len(gmail.batches)
+    history_id, retry = email_monitor.sync_once(gmail, history_id, exporter)
+
+    assert exporter.subjects == ["old", "new 1", "new 2", "new 4", "new 5"]
+    assert (history_id, retry) == ("106", ["m3"])
+    # One batch request for all five new messages
+    assert len(gmail.batches) - batches_before == 1
+
+    history_id, retry = email_monitor.sync_once(gmail, history_id, exporter, retry)
+    assert exporter.subjects[-1] == "new 3"
+    assert retry == []
+
+    history_id, retry = email_monitor.sync_once(gmail, history_id, exporter, retry)
+    assert len(exporter.subjects) == 6
+
+
+def test_expired_history_rescans_the_inbox_and_keeps_pending_retries():
+    gmail, exporter = FakeGmail(), FakeExporter()
+    gmail.deliver("m0", "read", unread=False)
+    gmail.deliver("m1", "waiting")
+    gmail.history_expired = True
+
+    history_id, retry = email_monitor.sync_once(gmail, "1", exporter, retry=["m0"])
+
+    assert exporter.subjects == ["read", "waiting"]
+    assert (history_id, retry) == ("102", [])
+
+
+def test_messages_the_export_queue_refuses_are_retried():
+    gmail, exporter = FakeGmail(), FakeExporter(room=2)
+    for i in range(4):
+        gmail.deliver(f"m{i}", f"mail {i}")
+
+    history_id, retry = email_monitor.sync_once(gmail, None, exporter)
+    assert exporter.subjects == ["mail 0", "mail 1"]
+    assert (history_id, retry) == ("104", ["m2", "m3"])
+
+    exporter.room = None
+    history_id, retry = email_monitor.sync_once(gmail, history_id, exporter, retry)
+    assert exporter.subjects == ["mail 0", "mail 1", "mail 2", "mail 3"]
+    assert (history_id, retry) == ("104", [])
+
+
+def test_sync_state_survives_restarts(tmp_path):
+    path = str(tmp_path / "history.json")
+    assert email_monitor.load_sync_state(path) == (None, [])
+    email_monitor.save_sync_state("12345", ["m3", "m7"], path)
+    assert email_monitor.load_sync_state(path) == ("12345", ["m3", "m7"])
@@ -0,0 +1,213 @@
+import socket
+import struct
+import pytest
+from flows import FlowTable, TimingWheel, flow_key, parse_packet
+
+
+def fields(client=1, sport=40000, dport=80, proto=6):
+    """Flow fields of a packet from 10.0.0.<client> to 10.0.1.1"""
+    return socket.inet_aton(f"10.0.0.{client}"), socket.inet_aton("10.0.1.1"), proto, sport, dport
+
+
+def ipv4(src="10.0.0.1", dst="10.0.1.1", proto=6, sport=40000, dport=80, fragment=0, options=b""):
+    """An IPv4 packet with TCP/UDP ports and a few payload bytes"""
+    ihl = 5 + len(options) // 4
+    header = struct.pack("!BBHHHBBH4s4s", 0x40 | ihl, 0, ihl * 4 + 12, 0, fragment, 64, proto, 0,
+                         socket.inet_aton(src), socket.inet_aton(dst))
+    return header + options + struct.pack("!HH", sport, dport) + b"\0" * 8
+
+
+def ether(payload, vlans=(), ethertype=0x0800):
+    """An Ethernet frame, with a 802.1Q/802.1ad tag per TPID in vlans"""
+    tags = b"".join(struct.pack("!HH", tpid, 100) for tpid in vlans)
+    return b"\xaa" * 6 + b"\xbb" * 6 + tags + struct.pack("!H", ethertype) + payload
+
+
+def reply(packet):
+    src, dst, proto, sport, dport = packet
+    return dst, src, proto, dport, sport
+
+
+class Expired(list):
+    """on_expire callback collecting (reason, flow)"""
+
+    def __call__(self, flow, reason):
+        self.append((reason, flow))
+
+    @property
+    def reasons(self):
+        return [reason for reason, _ in self]
+
+
+def test_wheel_fires_items_at_their_deadline_across_levels():
+    wheel = TimingWheel(tick=1.0, slots=8, levels=3)
+    wheel.advance(0)
+    deadlines = [3, 8, 9, 64, 70, 300, 2.5]
+    for deadline in deadlines:
+        wheel.schedule(deadline, deadline)
+
+    fired = {}
+    for now in range(1, 400):
+        for item in wheel.advance(now):
+            fired[item] = now
+    assert fired == {deadline: -int(-deadline // 1) for deadline in deadlines}
+
+
+def test_wheel_fires_deadlines_beyond_its_span_at_the_edge():
+    wheel = TimingWheel(tick=1.0, slots=4, levels=2)
+    wheel.advance(100)
+    wheel.schedule("far", 1000)
+    assert wheel.advance(114) == []
+    assert wheel.advance(115) == ["far"]
+
+
+def test_flow_ends_after_export_packets_counting_both_directions():
+    expired = Expired()
+    table = FlowTable(expired, export_packets=3)
+    table.add(fields(), 100, 10.0)
+    table.add(reply(fields()), 1500, 10.1)
+    assert len(table) == 1
+    table.add(fields(), 60, 10.2)
+
+    assert expired.reasons == ["packets"] and len(table) == 0
+    flow = expired[0][1]
+    assert (flow.packets_sent, flow.packets_received, flow.bytes_sent, flow.bytes_received) == (2, 1, 160, 1500)
+
+
+def test_idle_flow_ends_once_idle_timeout_passes():
+    expired = Expired()
+    table = FlowTable(expired, idle_timeout=5, active_timeout=30)
+    table.add(fields(), 100, 100.0)
+    table.add(fields(), 100, 102.0)
+
+    for now in range(100, 107):
+        table.expire(now)
+    assert expired == []
+    table.expire(107)
+    assert expired.reasons == ["idle"]
+    assert table.stats()["expired"]["idle"] == 1
+
+
+def test_busy_flow_ends_once_active_timeout_passes():
+    expired = Expired()
+    table = FlowTable(expired, idle_timeout=5, active_timeout=10, export_packets=1000)
+    for second in range(100, 115):
+        table.expire(second)
+        if not expired:
+            table.add(fields(), 100, second + 0.5)
+
+    assert expired.reasons == ["active"]
+    flow = expired[0][1]
+    assert (flow.start, flow.last) == (100.5, 110.5)
+
+
+def test_export_oldest_ends_the_first_flow_beyond_max_flows():
+    expired = Expired()
+    table = FlowTable(expired, max_flows=2, overflow="export-oldest")
+    for client in (1, 2, 3):
+        table.add(fields(client), 100, 100.0 + client)
+
+    assert expired.reasons == ["overflow"]
+    assert socket.inet_ntoa(expired[0][1].src) == "10.0.0.1"
+    assert len(table) == 2 and table.dropped_packets == 0
+
+
+def test_drop_new_leaves_packets_of_new_flows_uncounted():
+    expired = Expired()
+    table = FlowTable(expired, max_flows=2, overflow="drop-new")
+    for client in (1, 2, 3, 3):
+        table.add(fields(client), 100, 100.0 + client)
+    table.add(fields(1), 100, 105.0)
+
+    assert expired == []
+    assert len(table) == 2 and table.dropped_packets == 2
+
+
+def test_unknown_overflow_policy_is_rejected():
+    with pytest.raises(ValueError):
+        FlowTable(Expired(), overflow="drop-oldest")
+
+
+def test_stale_wheel_entries_skip_a_reused_key():
+    expired = Expired()
+    table = FlowTable(expired, idle_timeout=5, active_timeout=30, export_packets=2)
+    table.add(fields(), 100, 100.0)
+    table.add(fields(), 100, 100.5)
+    # The same 5-tuple starts a new flow; the ended flow's wheel entry (due at 105) is still scheduled
+    table.add(fields(), 100, 103.0)
+    assert expired.reasons == ["packets"]
+
+    for now in range(101, 108):
+        table.expire(now)
+    assert expired.reasons == ["packets"] and len(table) == 1
+
+    table.expire(108)
+    assert expired.reasons == ["packets", "idle"]
+    assert expired[1][1] is not expired[0][1] and expired[1][1].start == 103.0
+
+
+def test_flush_ends_every_flow():
+    expired = Expired()
+    table = FlowTable(expired)
+    for client in (1, 2, 3):
+        table.add(fields(client), 100, 100.0)
+    table.flush()
+
+    assert expired.reasons == ["flush"] * 3
+    assert table.stats()["flows"] == 0
+
+
+def test_parse_packet_reads_the_flow_fields():
+    src, dst = socket.inet_aton("10.0.0.1"), socket.inet_aton("10.0.1.1")
+    assert parse_packet(ether(ipv4())) == (src, dst, 6, 40000, 80)
+    assert parse_packet(ether(ipv4(proto=17, sport=53, dport=5353))) == (src, dst, 17, 53, 5353)
+    # Ports come after the IP options
+    assert parse_packet(ether(ipv4(options=b"\x01" * 8))) == (src, dst, 6, 40000, 80)
+
+
+@pytest.mark.parametrize("vlans", [(0x8100,), (0x88a8, 0x8100)])
+def test_parse_packet_walks_vlan_tags(vlans):
+    assert parse_packet(ether(ipv4(), vlans)) == parse_packet(ether(ipv4()))
+
+
+def test_parse_packet_on_other_link_types():
+    assert parse_packet(ipv4(), "Raw") == parse_packet(ether(ipv4()))
+    assert parse_packet(b"\0" * 16 + ipv4(), "CookedLinux") == parse_packet(ether(ipv4()))
+    assert parse_packet(ipv4(), "Dot11") is None
+
+
+def test_only_the_first_fragment_carries_ports():
+    src, dst = socket.inet_aton("10.0.0.1"), socket.inet_aton("10.0.1.1")
+    # More-fragments flag, offset 0: the ports are there
+    assert parse_packet(ether(ipv4(fragment=0x2000))) == (src, dst, 6, 40000, 80)
+    # Offset 185 (1480 bytes in): the "ports" would be payload bytes
+    assert parse_packet(ether(ipv4(fragment=185))) == (src, dst, 6, 0, 0)
+
+
+@pytest.mark.parametrize("frame", [
+    ether(ipv4())[:13],
+    ether(ipv4())[:14 + 19],
+    ether(b"", (0x8100,))[:16],
+    ether(ipv4(), ethertype=0x86DD),
+    ether(ipv4(proto=1)),
+    ether(b"\x60" + ipv4()[1:]),
+])
+def test_parse_packet_rejects_short_and_other_frames(frame):
+    assert parse_packet(frame) is None
+
+
+def test_truncated_ports_count_as_portless():
+    fields = parse_packet(ether(ipv4())[:14 + 20 + 2])
+    assert fields is not None and fields[3:] == (0, 0)
+
+
+def test_flow_key_is_the_same_in_both_directions():
+    packet = parse_packet(ether(ipv4()))
+    answer = parse_packet(ether(ipv4("10.0.1.1", "10.0.0.1", sport=80, dport=40000)))
+    assert flow_key(*packet) == flow_key(*answer)
+    assert len(flow_key(*packet)) == 13
+
+    assert flow_key(*packet) != flow_key(*parse_packet(ether(ipv4(sport=40001))))
+    assert flow_key(*packet) != flow_key(*parse_packet(ether(ipv4(proto=17))))
+    # Same addresses, ports swapped on one side only: another conversation
+    assert flow_key(*packet) != flow_key(*parse_packet(ether(ipv4("10.0.1.1", "10.0.0.1"))))